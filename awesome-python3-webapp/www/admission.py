@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Admission control: global in-flight limit, bounded wait queue and per-client token buckets.
+'''
+
+import asyncio, time, ipaddress
+from collections import deque, OrderedDict
+
+# 数据库连接池只有maxsize个连接，流量突增时如果不加限制，所有请求都会排在连接池上，每个请求的延迟都会变得很长
+# AdmissionController在请求进入handler之前做准入控制：
+#   1. 每个客户端一个令牌桶，每秒补充rate个令牌，最多积攒burst个，令牌用完的请求直接拒绝
+#   2. 同时处理的请求不超过max_inflight个，超过的请求进入等待队列
+#   3. 等待队列最多max_queue个请求，队列满了或者等待超过queue_timeout秒的请求直接拒绝
+# 被拒绝的请求由app.py的admission_factory立即返回503，这样被接受的请求的延迟可以保持稳定
+# 网站部署在反向代理后面时，所有请求的对端地址都是代理的地址，客户端要从代理设置的请求头中取得(见client)
+class AdmissionController(object):
+    def __init__(self, max_inflight=64, max_queue=128, queue_timeout=1.0, rate=20, burst=40, max_clients=10000,
+                 trusted_proxies=()):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.trusted_proxies = [ipaddress.ip_network(p, strict=False) for p in trusted_proxies]
+        self.inflight = 0
+        self._waiters = deque()
+        self._buckets = OrderedDict()  # client -> (令牌数, 上次补充的时间)
+        self.admitted = 0
+        self.rejected = 0
+
+    # 按config中的admission创建，app.py和benchmarks/bench_admission.py共用
+    @classmethod
+    def from_config(cls, options):
+        return cls(options.max_inflight, options.max_queue, options.queue_timeout, options.rate, options.burst,
+                   trusted_proxies=options.trusted_proxies)
+
+    def _trusted(self, address):
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    # 返回用于令牌桶的客户端地址，无法确定客户端时返回None(这个请求不做按客户端的限流)
+    # 对端不是受信任的代理时就是对端地址，请求头可能是伪造的，不使用
+    # 对端是受信任的代理时，取X-Forwarded-For中从右往左第一个不是受信任代理的地址，没有时取X-Real-IP
+    def client(self, remote, headers):
+        if not self._trusted(remote):
+            return remote
+        forwarded = [a.strip() for a in headers.get('X-Forwarded-For', '').split(',') if a.strip()]
+        for address in reversed(forwarded):
+            if not self._trusted(address):
+                return address
+        return headers.get('X-Real-IP') or None
+
+    # 从客户端的令牌桶中取一个令牌，成功返回0，否则返回需要等待多少秒才会有新令牌
+    def check_rate(self, client):
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0
+        else:
+            retry_after = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        # 客户端太多时淘汰最久没有请求的客户端
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        if retry_after:
+            self.rejected += 1
+        return retry_after
+
+    # 申请一个处理名额，成功返回True；队列已满或者等待超时返回False
+    # 返回True的请求处理完后必须调用release
+    async def acquire(self):
+        if self.inflight < self.max_inflight and not self._waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            return False
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(fut)
+            self.rejected += 1
+            return False
+        except asyncio.CancelledError:
+            # 请求被取消(比如客户端断开)，如果名额已经交给了它，要还回去
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                self._discard(fut)
+            raise
+        self.admitted += 1
+        return True
+
+    def _discard(self, fut):
+        try:
+            self._waiters.remove(fut)
+        except ValueError:
+            pass
+
+    # 释放名额：有等待中的请求时直接把名额交给队列中的第一个，否则名额数减1
+    def release(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.inflight -= 1
@@ -40,12 +40,118 @@ class Page(object):
     __repr__ = __str__
 
 
+# 游标分页(seek pagination)：按(created_at, id)倒序翻页，游标是上一页最后一条记录的created_at和id
+# 下一页的条件是 created_at<? or (created_at=? and id<?)，配合(created_at, id)上的索引，
+# 翻到多深都只读一页的行，不像offset那样要跳过前面所有的行；翻页期间插入的新记录也不会让后面的页重复或漏掉记录
+def encode_cursor(created_at, id):
+    return '%r-%s' % (created_at, id)  # repr保证float转换回来完全相等
+
+# 返回(created_at, id)，游标格式不对时抛出APIValueError
+def decode_cursor(cursor):
+    created_at, sep, id = cursor.partition('-')
+    try:
+        if sep and id:
+            return float(created_at), id
+    except ValueError:
+        pass
+    raise APIValueError('cursor', 'invalid cursor.')
+
+
 # 几个简单的api错误异常类，用于抛出异常
 '''
 JSON API definition.
 '''
 import json, logging, inspect, functools
 
+import deadlines
+
+# orjson是可选的更快的JSON后端，没有安装时使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 把要返回的对象转化为可以直接JSON编码的结构
+# Model使用元类预先生成的__serializer__，私有字段(如User.passwd)在这里被去掉，实例本身不会被修改
+# 标准库json遇到dict的子类不会调用default，所以Model必须在编码前转化
+def to_json_data(o):
+    serializer = getattr(o, '__serializer__', None)
+    if serializer is not None:
+        return serializer(o)
+    if isinstance(o, dict):
+        return {k: to_json_data(v) for k, v in o.items()}
+    if isinstance(o, (list, tuple)):
+        return [to_json_data(v) for v in o]
+    if isinstance(o, Page):
+        return o.__dict__
+    return o
+
+# 以上都没有处理的对象，按原来的方式输出它的属性
+def _json_default(o):
+    return o.__dict__
+
+# 序列化为utf-8编码的JSON字节串，供response_factory和需要自己构造Response的handler使用
+def dumps(o):
+    data = to_json_data(o)
+    if orjson is not None:
+        return orjson.dumps(data, default=_json_default)
+    return json.dumps(data, ensure_ascii=False, default=_json_default).encode('utf-8')
+
+# 流式JSON对象，用于返回数据量很大的列表
+# handler返回JSONStream后，response_factory会用分块传输的方式输出:
+#     {"其他字段": ..., "key": [row, row, ...]}
+# rows是一个异步迭代器(比如Model.iterAll())，每凑够chunk_size行就编码并发送一次
+# 这样首字节时间和内存占用都和总行数无关
+# 响应体在handler返回之后才输出，那时RequestHandler已经清除了截止时间，所以创建时记下当前请求的截止时间，
+# 输出时重新设置，读取rows时的数据库操作仍然受这个请求的截止时间限制；超时时响应在中途断开
+class JSONStream(object):
+    '''Stream a JSON object whose `key` member is a list read from an async iterator.'''
+
+    def __init__(self, key, rows, chunk_size=100, **extra):
+        self.key = key
+        self.rows = rows
+        self.chunk_size = chunk_size
+        self.extra = extra
+        self.deadline = deadlines.current()
+
+    # 把整个JSON对象分块写出，write是一个接受bytes的协程函数(比如StreamResponse.write)
+    async def write_to(self, write):
+        token = deadlines.enter(self.deadline)
+        try:
+            await self._write_to(write)
+        finally:
+            deadlines.reset(token)
+
+    async def _write_to(self, write):
+        head = dumps(self.extra)[:-1]  # 去掉结尾的'}'，后面接上列表字段
+        if self.extra:
+            head += b','
+        await write(head + json.dumps(self.key).encode('utf-8') + b':[')
+        batch = []
+        first = True
+        try:
+            async for row in self.rows:
+                batch.append(row)
+                if len(batch) >= self.chunk_size:
+                    await write(self._encode(batch, first))
+                    batch = []
+                    first = False
+            if batch:
+                await write(self._encode(batch, first))
+        finally:
+            # 无论正常结束还是客户端断开，都要关闭迭代器(比如让它释放数据库连接)
+            aclose = getattr(self.rows, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        await write(b']}')
+
+    # 把一批行编码为列表中间的一段，去掉列表的方括号，批与批之间用逗号连接
+    @staticmethod
+    def _encode(batch, first):
+        chunk = dumps(batch)[1:-1]
+        return chunk if first else b',' + chunk
+
+
 class APIError(Exception):
     '''
     the base APIError which contains error(required), data(optional) and message(optional).
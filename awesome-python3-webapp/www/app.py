@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+# startup模块记录启动时各个阶段的耗时，最先导入，从这里开始计时
+import startup
 # logging模块定义了一些函数和模块，可以帮助我们对一个应用程序或库实现一个灵活的事件日志处理系统
 # logging模块可以纪录错误信息，并在错误信息记录完后继续执行
 import logging
@@ -11,26 +13,44 @@ logging.basicConfig(level=logging.INFO)
 import asyncio
 # os模块提供了调用操作系统的接口函数
 import os
-# json模块提供了Python对象到Json模块的转换
-import json
 # time模块提供各种操作时间的函数
 import time
+import math
 # datetime是处理日期和时间的标准库
 from datetime import datetime
+# gzip和zlib用于压缩响应体
+import gzip
+import zlib
+# brotli是可选依赖，没有安装时只协商gzip/deflate
+try:
+    import brotli
+except ImportError:
+    brotli = None
 # aiohttp是基于asyncio实现的http框架
 from aiohttp import web
 # Jinja2 是仿照 Django 模板的 Python 前端引擎模板
 # Environment指的是jinjia2模板的配置环境，FileSystemLoader是文件系统加载器，用来加载模板路径
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from fragcache import FragmentCacheExtension, MemoryStorage
+startup.mark('import libraries')
 
 import orm
-from coroweb import add_routes, add_static
-from handlers import cookie2user, COOKIE_NAME
+import apis
+import rendering
+from admission import AdmissionController
+from deadlines import DeadlineExceeded
+from config import configs
+from coroweb import add_routes, add_static, get_request_data, JSONStreamResponse
+from handlers import cookie2user, user2cookie, is_legacy_cookie, session_cache, COOKIE_NAME
+startup.mark('import app modules')
 
 
 # 这个函数的功能是初始化jinja2模板，配置jinja2的环境
+# production=True时是生产模式：启动时预编译templates目录下的所有模板，之后get_template不再访问文件系统
+# bytecode_cache_dir不为空时，编译结果保存在这个目录中，下次启动直接加载，不需要重新编译
 def init_jinja2(app, **kw):
     logging.info('init jinja2...')
+    production = kw.get('production', configs.templates.production)
     # 设置解析模板需要用到的环境变量
     options = dict(
         autoescape=kw.get('autoescape', True),  # 自动转义xml/html的特殊字符
@@ -39,8 +59,17 @@ def init_jinja2(app, **kw):
         block_end_string=kw.get('block_end_string', '%}'),  # 设置代码的终止字符串
         variable_start_string=kw.get('variable_start_string', '{{'),  # 这两句分别设置了变量的起始和结束字符串
         variable_end_string=kw.get('variable_end_string', '}}'),  # 就是说{{和}}中间是变量，看过templates目录下的test.html文件后就很好理解了
-        auto_reload=kw.get('auto_reload', True)  # 当模板文件被修改后，下次请求加载该模板文件的时候会自动加载修改后的模板文件
+        # 当模板文件被修改后，下次请求加载该模板文件的时候会自动加载修改后的模板文件
+        # 生产模式下关闭，否则每次get_template都要检查一次文件的修改时间
+        auto_reload=kw.get('auto_reload', not production),
+        extensions=[FragmentCacheExtension]  # 提供{% cache key, ttl %}标签，见fragcache.py
     )
+    if production:
+        options['cache_size'] = -1  # 模板缓存不限大小，预编译的模板永远不会被淘汰
+        bytecode_cache_dir = kw.get('bytecode_cache_dir', configs.templates.bytecode_cache_dir)
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_cache_dir)
     path = kw.get('path', None)  # 从kw中获取模板路径，如果没有传入这个参数则默认为None
     # 如果path为None，则将当前文件所在目录下的templates目录设为模板文件目录
     if path is None:
@@ -51,10 +80,22 @@ def init_jinja2(app, **kw):
     logging.info('set jinja2 template path: %s' % path)
     # loader=FileSystemLoader(path)指的是到哪个目录下加载模板文件， **options就是前面的options
     env = Environment(loader=FileSystemLoader(path), **options)
+    # 片段缓存的存储，可以通过fragment_cache参数换成其他实现了get/set的存储
+    fragment_cache = kw.get('fragment_cache', None)
+    if fragment_cache is None:
+        fragment_cache = MemoryStorage(configs.templates.fragment_cache_size, configs.templates.fragment_ttl)
+    env.fragment_cache = fragment_cache
     filters = kw.get('filters', None)  # fillters=>过滤器
     if filters is not None:
         for name, f in filters.items():
             env.filters[name] = f  # 在env中添加过滤器
+    if production:
+        # 过滤器要在编译之前加入env，否则编译时找不到过滤器
+        start = time.time()
+        names = env.list_templates(extensions=['html'])
+        for name in names:
+            env.get_template(name)
+        logging.info('precompiled %d templates in %.1f ms' % (len(names), (time.time() - start) * 1000))
     app['__templating__'] = env  # 前面已经把jinjia2的环境配置都赋值给env了，这里再把env存入app的dict中，这样app就知道要去哪找模板，怎么解析模板
 
 # 时间过滤器，作用是返回日志创建的时间，用于显示在日志标题下面
@@ -71,144 +112,275 @@ def datetime_filter(t):
     dt = datetime.fromtimestamp(t)
     return u'%s年%s月%s日' % (dt.year, dt.month, dt.day)
 
-# 这个函数的作用就是当http请求的时候，通过logging.info输出请求的信息，其中包括请求的方法和路径
-async def logger_factory(app, handler):
-    async def logger(request):
-        logging.info('Request: %s %s' % (request.method, request.path))
-        # await asyncio.sleep(0.3)
+# 下面的中间件都是aiohttp新式的中间件：用@web.middleware装饰，直接接收request和下一个handler
+# 不再需要为每个handler调用一次工厂函数，也没有生成器协程的额外开销(函数名保留了原来的xxx_factory)
+
+# 准入控制中间件，放在最前面，在做任何其他工作之前拒绝超出处理能力的请求
+# 令牌桶用完或者等待队列已满/超时的请求立即返回503和Retry-After，不会排在数据库连接池上
+# 静态文件不访问数据库，不受限制
+# 注意：流式响应(JSONStreamResponse)在中间件返回之后才写出响应体，名额在此之前就已经释放
+@web.middleware
+async def admission_factory(request, handler):
+    options = configs.admission
+    if not options.enabled or request.path.startswith('/static/'):
+        return (await handler(request))
+    controller = request.app['__admission__']
+    client = controller.client(request.remote, request.headers)
+    retry_after = controller.check_rate(client) if client is not None else 0
+    if retry_after:
+        return _service_unavailable(max(options.retry_after, retry_after))
+    if not (await controller.acquire()):
+        return _service_unavailable(options.retry_after)
+    try:
         return (await handler(request))
-    return logger
+    finally:
+        controller.release()
+
+def _service_unavailable(retry_after):
+    return web.Response(status=503, text='Service busy, retry later.',
+                        headers={'Retry-After': str(int(math.ceil(retry_after)))})
+
+# 这个函数的作用就是当http请求的时候，通过logging.info输出请求的信息，其中包括请求的方法和路径
+@web.middleware
+async def logger_factory(request, handler):
+    logging.info('Request: %s %s' % (request.method, request.path))
+    return (await handler(request))
 
 
 
 # 这个middlewares的作用是在处理请求之前，先将cookie解析出来，并将登陆用户绑定到request对象上
 # 以后的每个请求，都是在这个middle之后处理的，都已经绑定了用户信息
-@asyncio.coroutine
-def auth_factory(app, handler):
-    @asyncio.coroutine
-    def auth(request):
-        logging.info('auth_factory :check user: %s %s' % (request.method, request.path))
-        request.__user__ = None  # 先把请求的__user__属性绑定None
-        # 通过cookie名取得加密cookie字符串，COOKIE_NAME是在headlers模块中定义的
-        cookie_str = request.cookies.get(COOKIE_NAME)
-        if cookie_str:
-            user = yield from cookie2user(cookie_str)  # 验证cookie，并得到用户信息
-            if user:
-                logging.info('set current user: %s' % user.email)
-                request.__user__ = user  # 将用户信息绑定到请求上
-
-        # 如果请求路径是管理页面，但是用户不是管理员，将重定向到登陆页面
-
-        # print(bool(request.path == '/manage/blogs/create'))
-        # print(bool(request.path.startswith('/manage/blogs')))
-        if (request.path == '/manage/blogs') and (request.__user__ is None or not request.__user__.admin):
-            return web.HTTPFound('/signin')
-        return (yield from handler(request))
-
-        # 如果请求路径是管理页面，但是用户不是管理员，将重定向到登陆页面
-        # if request.path.startswith('/manage/blogs') and (request.__user__ is None or not request.__user__.admin):
-        #     return web.HTTPFound('/signin')
-        # return (yield from handler(request))
-
-    return auth
+@web.middleware
+async def auth_factory(request, handler):
+    request.__user__ = None  # 先把请求的__user__属性绑定None
+    # 通过cookie名取得加密cookie字符串，COOKIE_NAME是在headlers模块中定义的
+    cookie_str = request.cookies.get(COOKIE_NAME)
+    if cookie_str:
+        user = await cookie2user(cookie_str)  # 验证cookie，并得到用户信息
+        if user:
+            logging.info('set current user: %s' % user.email)
+            request.__user__ = user  # 将用户信息绑定到请求上
 
-# 只有当请求方法为POST时这个函数才起作用
-async def data_factory(app, handler):
-    async def parse_data(request):
-        if request.method == 'POST':
-            if request.content_type.startswith('application/json'):
-                request.__data__ = await request.json()
-                logging.info('request json: %s' % str(request.__data__))
-            elif request.content_type.startswith('application/x-www-form-urlencoded'):
-                request.__data__ = await request.post()
-                logging.info('request form: %s' % str(request.__data__))
-        return (await handler(request))
+    # 如果请求路径是管理页面，但是用户不是管理员，将重定向到登陆页面
+    if (request.path == '/manage/blogs') and (request.__user__ is None or not request.__user__.admin):
+        return web.HTTPFound('/signin')
+    r = await handler(request)
+    # 旧格式的cookie验证通过后，换发一个同样失效时间的新格式cookie，用户不需要重新登录
+    if request.__user__ is not None and is_legacy_cookie(cookie_str) and isinstance(r, web.StreamResponse) \
+            and not r.prepared and COOKIE_NAME not in r.cookies:
+        max_age = int(cookie_str.split('-')[1]) - int(time.time())
+        if max_age > 0:
+            r.set_cookie(COOKIE_NAME, user2cookie(request.__user__, max_age), max_age=max_age, httponly=True)
+    return r
 
-    return parse_data
+# 只有当请求方法为POST时这个函数才起作用
+# 请求体在这里解析一次并缓存在request['__data__']中，后面的中间件和RequestHandler直接复用，不再重复解析
+@web.middleware
+async def data_factory(request, handler):
+    if request.method == 'POST':
+        data = await get_request_data(request)
+        # 只记录字段名，不记录值：请求体里有明文密码(/api/authenticate和/api/users的passwd)
+        if hasattr(data, 'keys'):
+            logging.info('request data fields: %s' % ', '.join(sorted(set(data.keys()))))
+    return (await handler(request))
 
 # 服务器端响应 中间件
-async def response_factory(app, handler):
-    async def response(request):
-        logging.info('response_factory:Response handler...')
+@web.middleware
+async def response_factory(request, handler):
+    logging.info('response_factory:Response handler...')
+    try:
         r = await handler(request)
-        # 如果相应结果为StreamResponse，直接返回
-        # #treamResponse是aiohttp定义response的基类,即所有响应类型都继承自该类
-        # StreamResponse主要为流式数据而设计
-        if isinstance(r, web.StreamResponse):
-            return r
-        # 如果相应结果为字节流，则将其作为应答的body部分，并设置响应类型为流型
-        if isinstance(r, bytes):
-            resp = web.Response(body=r)
-            resp.content_type = 'application/octet-stream'
+    except DeadlineExceeded:
+        # 请求超出了时间预算，数据库操作已经被取消
+        logging.warning('deadline exceeded: %s %s' % (request.method, request.path))
+        return web.Response(status=504, text='Gateway Timeout')
+    # 如果相应结果为StreamResponse，直接返回
+    # #treamResponse是aiohttp定义response的基类,即所有响应类型都继承自该类
+    # StreamResponse主要为流式数据而设计
+    if isinstance(r, web.StreamResponse):
+        return r
+    # 如果响应结果为流式JSON，交给JSONStreamResponse分块输出
+    if isinstance(r, apis.JSONStream):
+        return JSONStreamResponse(r)
+    # 如果相应结果为字节流，则将其作为应答的body部分，并设置响应类型为流型
+    if isinstance(r, bytes):
+        resp = web.Response(body=r)
+        resp.content_type = 'application/octet-stream'
+        return resp
+    # 如果响应结果为字符串
+    if isinstance(r, str):
+        # 判断响应结果是否为重定向，如果是，返回重定向后的结果
+        if r.startswith('redirect:'):
+            return web.HTTPFound(r[9:])  # 即把r字符串之前的"redirect:"去掉
+        # 然后以utf8对其编码，并设置响应类型为html型
+        resp = web.Response(body=r.encode('utf-8'))
+        resp.content_type = 'text/html;charset=utf-8'
+        return resp
+    # 如果响应结果是字典，则获取他的jinja2模板信息，此处为jinja2.env
+    if isinstance(r, dict):
+        template = r.get('__template__')
+        # 若不存在对应模板，则将字典调整为json格式返回，并设置响应类型为json
+        if template is None:
+            resp = web.Response(body=apis.dumps(r))
+            resp.content_type = 'application/json;charset=utf-8'
             return resp
-        # 如果响应结果为字符串
-        if isinstance(r, str):
-            # 判断响应结果是否为重定向，如果是，返回重定向后的结果
-            if r.startswith('redirect:'):
-                return web.HTTPFound(r[9:])  # 即把r字符串之前的"redirect:"去掉
-            # 然后以utf8对其编码，并设置响应类型为html型
-            resp = web.Response(body=r.encode('utf-8'))
+        else:
+            r["__user__"] = request.__user__  # 增加__user__,前端页面将依次来决定是否显示评论框
+            resp = web.Response(body=request.app['__templating__'].get_template(template).render(**r).encode('utf-8'))
             resp.content_type = 'text/html;charset=utf-8'
             return resp
-        # 如果响应结果是字典，则获取他的jinja2模板信息，此处为jinja2.env
-        if isinstance(r, dict):
-            template = r.get('__template__')
-            # 若不存在对应模板，则将字典调整为json格式返回，并设置响应类型为json
-            if template is None:
-                resp = web.Response(
-                    body=json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8'))
-                resp.content_type = 'application/json;charset=utf-8'
-                return resp
-            else:
-                r["__user__"] = request.__user__  # 增加__user__,前端页面将依次来决定是否显示评论框
-                resp = web.Response(body=app['__templating__'].get_template(template).render(**r).encode('utf-8'))
-                resp.content_type = 'text/html;charset=utf-8'
-                return resp
-        # 如果响应结果为整数型，且在100和600之间
-        # 则此时r为状态码，即404，500等
-        if isinstance(r, int) and r >= 100 and r < 600:
-            return web.Response(r)
-        # 如果响应结果为长度为2的元组
-        # 元组第一个值为整数型且在100和600之间
-        # 则t为http状态码，m为错误描述，返回状态码和错误描述
-        if isinstance(r, tuple) and len(r) == 2:
-            t, m = r
-            if isinstance(t, int) and t >= 100 and t < 600:
-                return web.Response(t, str(m))
-        # 默认以字符串形式返回响应结果，设置类型为普通文本
-        resp = web.Response(body=str(r).encode('utf-8'))
-        resp.content_type = 'text/plain;charset=utf-8'
-        return resp
+    # 如果响应结果为整数型，且在100和600之间
+    # 则此时r为状态码，即404，500等
+    if isinstance(r, int) and r >= 100 and r < 600:
+        return web.Response(r)
+    # 如果响应结果为长度为2的元组
+    # 元组第一个值为整数型且在100和600之间
+    # 则t为http状态码，m为错误描述，返回状态码和错误描述
+    if isinstance(r, tuple) and len(r) == 2:
+        t, m = r
+        if isinstance(t, int) and t >= 100 and t < 600:
+            return web.Response(t, str(m))
+    # 默认以字符串形式返回响应结果，设置类型为普通文本
+    resp = web.Response(body=str(r).encode('utf-8'))
+    resp.content_type = 'text/plain;charset=utf-8'
+    return resp
+
+# 上面6个if其实只用到了一个，准确的说只用到了半个。大家可以把用到的代码找出来，把没有用到的注释掉，如果程序能正常运行，那我觉得任务也就完成了
+# 没用到的if语句块了解一下就好，等用到了再回过头来看，你就瞬间理解了。
+
+# 可以压缩的响应类型，图片、字体等本身已经压缩过的类型不再压缩
+_COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
+# 根据请求头Accept-Encoding选择压缩算法，按codings的顺序优先，默认为 br > gzip > deflate
+# 返回None表示客户端不接受任何我们支持的压缩算法
+def choose_encoding(accept_encoding, codings=('br', 'gzip', 'deflate')):
+    if not accept_encoding:
+        return None
+    accepted = dict()
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding.strip()] = q
+    for coding in codings:
+        if coding == 'br' and brotli is None:
+            continue
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > 0:
+            return coding
+    return None
 
-    # 上面6个if其实只用到了一个，准确的说只用到了半个。大家可以把用到的代码找出来，把没有用到的注释掉，如果程序能正常运行，那我觉得任务也就完成了
-    # 没用到的if语句块了解一下就好，等用到了再回过头来看，你就瞬间理解了。
-    return response
+# 压缩响应体，level为gzip/deflate的压缩级别
+def compress_body(body, coding, level):
+    if coding == 'br':
+        # brotli的quality范围是0-11，按gzip的级别换算
+        return brotli.compress(body, quality=min(11, level * 11 // 9))
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=level)
+    return zlib.compress(body, level)
+
+# 响应压缩中间件，放在response_factory之前，这样拿到的已经是web.Response对象
+# 小于min_size的响应不压缩；大于executor_size的响应体在线程池中压缩，避免大响应阻塞事件循环
+# 还没有prepare的StreamResponse交给aiohttp在每次write时增量压缩
+@web.middleware
+async def compress_factory(request, handler):
+    options = configs.compress
+    r = await handler(request)
+    if not options.enabled or not isinstance(r, web.StreamResponse):
+        return r
+    # 已经发送出去的、已经压缩过的、没有响应体的，以及静态文件都不处理
+    if r.prepared or 'Content-Encoding' in r.headers or r.status in (204, 304) or isinstance(r, web.FileResponse):
+        return r
+    if not (r.content_type or '').startswith(_COMPRESSIBLE_TYPES):
+        return r
+    accept_encoding = request.headers.get('Accept-Encoding')
+    if not isinstance(r, web.Response):
+        # 流式响应的长度未知，由aiohttp在写入时逐块压缩(aiohttp只支持gzip/deflate)
+        coding = choose_encoding(accept_encoding, ('gzip', 'deflate'))
+        if coding is not None:
+            r.enable_compression(web.ContentCoding(coding))
+        return r
+    coding = choose_encoding(accept_encoding)
+    if coding is None:
+        return r
+    body = r.body
+    if not isinstance(body, bytes) or len(body) < options.min_size:
+        return r
+    if len(body) >= options.executor_size:
+        r.body = await request.app.loop.run_in_executor(None, compress_body, body, coding, options.level)
+    else:
+        r.body = compress_body(body, coding, options.level)
+    r.headers['Content-Encoding'] = coding
+    r.headers.add('Vary', 'Accept-Encoding')
+    return r
 
 # 调用asyncio实现异步IO
-async def init(loop):
-    # 创建数据库连接池
-    await orm.create_pool(loop=loop, host='127.0.0.1', port=3306, user='pyweb', password='pyweb', db='awesome')
+# sock为None时监听config中的host和port；prefork模式下由server.py传入每个worker自己绑定的socket
+# 返回app对象，app['__server__']和app['__handler__']在shutdown时使用
+async def init(loop, sock=None):
+    # 创建数据库连接池，连接参数和每个进程的连接池大小都来自config
+    await orm.create_pool(loop=loop, **configs.db)
+    startup.mark('create db pool')
+    app = make_app(loop)
+    handler = app.make_handler()
+    if sock is None:
+        srv = await loop.create_server(handler, configs.server.host, configs.server.port)
+    else:
+        srv = await loop.create_server(handler, sock=sock)
+    app['__server__'] = srv
+    app['__handler__'] = handler
+    startup.mark('listen')
+    logging.info('server started at http://%s:%s...' % (configs.server.host, configs.server.port))
+    startup.report(configs.startup.budget)
+    # markdown2等第一次请求才用到的模块在开始接受连接之后导入，不占用启动时间
+    loop.run_in_executor(None, rendering.warm_up)
+    return app
+
+# 创建app对象，完成不需要访问网络的初始化(模板、路由)，benchmarks/bench_startup.py也调用这个函数
+def make_app(loop):
     # 创建app对象，同时传入上文定义的拦截器middlewares
-    app = web.Application(loop=loop, middlewares=[ logger_factory, auth_factory, response_factory ])
+    app = web.Application(loop=loop, middlewares=[ admission_factory, logger_factory, auth_factory, data_factory, compress_factory, response_factory ])
     # 初始化jinja2模板，并传入时间过滤器
     init_jinja2(app, filters=dict(datetime=datetime_filter))
+    startup.mark('init jinja2')
+    # 准入控制的状态，admission_factory中使用
+    app['__admission__'] = AdmissionController.from_config(configs.admission)
     # 下面这两个函数在coroweb模块中
     add_routes(app, 'handlers')  # handlers指的是handlers模块也就是handlers.py
     add_static(app)
-    srv = await loop.create_server(app.make_handler(), '127.0.0.1', 9000)
-    logging.info('server started at http://127.0.0.1:9000...')
-    return srv
+    startup.mark('add routes')
+    return app
+
+# 优雅地关闭服务：先停止接受新连接，等待正在处理的请求完成(最多timeout秒)，再关闭数据库连接池
+async def shutdown(app, timeout=30.0):
+    srv = app['__server__']
+    srv.close()
+    await srv.wait_closed()
+    await app.shutdown()
+    await app['__handler__'].shutdown(timeout)
+    await app.cleanup()
+    await orm.close_pool()
+    rendering.shutdown()  # 关闭markdown转换进程池
+    # 报告有多少个已登录的请求是直接从session缓存验证、没有查询数据库的
+    logging.info('session cache: %(hits)s authenticated requests served with zero DB queries, '
+                 '%(negative_hits)s bad cookies rejected from cache, %(misses)s misses' % session_cache.stats())
 
 
 # asyncio的编程模块实际上就是一个消息循环。我们从asyncio模块中直接获取一个eventloop（事件循环）的引用，//
 # 然后把需要执行的协程扔到eventloop中执行，就实现了异步IO
 # 第一步是获取eventloop
-
-# get_event_loop()函数详见python官方文档18.5.2.5
-# get_event_loop() => 获取当前脚本下的事件循环，返回一个event loop对象(这个对象的类型是'asyncio.windows_events._WindowsSelectorEventLoop')，实现AbstractEventLoop（事件循环的基类）接口
-# 如果当前脚本下没有事件循环，将抛出异常，get_event_loop()永远不会抛出None
-loop = asyncio.get_event_loop()
-# 之后是执行curoutine
-loop.run_until_complete(init(loop))
-# 无限循环运行直到stop()
-loop.run_forever()
+# 直接运行app.py时是单进程的开发模式，生产环境使用server.py启动多个worker进程
+if __name__ == '__main__':
+    # get_event_loop()函数详见python官方文档18.5.2.5
+    # get_event_loop() => 获取当前脚本下的事件循环，返回一个event loop对象(这个对象的类型是'asyncio.windows_events._WindowsSelectorEventLoop')，实现AbstractEventLoop（事件循环的基类）接口
+    # 如果当前脚本下没有事件循环，将抛出异常，get_event_loop()永远不会抛出None
+    loop = asyncio.get_event_loop()
+    # 之后是执行curoutine
+    loop.run_until_complete(init(loop))
+    # 无限循环运行直到stop()
+    loop.run_forever()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Backfill comments.html_content for comments saved before it was stored.
+
+按主键顺序每次读取chunk条还没有html的评论，转换后用一条update语句写回，两批之间暂停pause秒，不长时间占用数据库
+只更新html_content仍为null的行，可以随时中断、重复运行；网站不用停，还没有回填的评论在显示时临时转换
+    python3 backfill_comments.py [--chunk 500] [--pause 0.1]
+'''
+
+import logging
+logging.basicConfig(level=logging.INFO)
+import asyncio, argparse
+
+import orm
+from config import configs
+from models import Comment
+from rendering import text2html
+
+
+async def backfill(loop, chunk, pause):
+    await orm.create_pool(loop=loop, **configs.db)
+    try:
+        last_id, done = '', 0
+        while True:
+            # 按id翻页(seek)，不用offset，越往后也不会越慢
+            comments = await Comment.findAll('`html_content` is null and `id`>?', [last_id], orderBy='`id`',
+                                             limit=(0, chunk))
+            if not comments:
+                break
+            args = []
+            for c in comments:
+                args.extend([c.id, text2html(c.content)])
+            args.extend(c.id for c in comments)
+            await orm.execute('update `comments` set `html_content`=case `id` %s end where `id` in (%s) and `html_content` is null'
+                              % (' '.join(['when ? then ?'] * len(comments)), orm.create_args_string(len(comments))), args)
+            done += len(comments)
+            last_id = comments[-1].id
+            logging.info('backfilled %d comments' % done)
+            await asyncio.sleep(pause)
+        logging.info('done, %d comments backfilled' % done)
+    finally:
+        await orm.close_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill comments.html_content for comments saved before it was stored.')
+    parser.add_argument('--chunk', type=int, default=500, help='comments per batch')
+    parser.add_argument('--pause', type=float, default=0.1, help='seconds to sleep between batches')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(backfill(loop, args.chunk, args.pause))
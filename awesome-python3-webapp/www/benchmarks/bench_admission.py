@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Local load test for admission control.
+模拟一个config中db.maxsize大小的数据库连接池，每个请求占用一个连接10ms，maxsize=10时最大吞吐约1000请求/秒
+在SPIKE_SECONDS秒内以RATE请求/秒的速度(超过处理能力)发送请求，比较：
+  none:      不做准入控制，所有请求都排在连接池上
+  admission: 使用按config中的admission创建的AdmissionController，超出能力的请求立即得到503
+请求和部署时一样经过本机的反向代理：对端地址是127.0.0.1，客户端地址在X-Forwarded-For中，由AdmissionController.client取出
+报告被接受请求的p50/p99延迟和被拒绝的请求数，p99超过SLO时以非0状态退出
+运行方式: python3 benchmarks/bench_admission.py [--clients 500] [--rate 3000]
+'''
+
+import os, sys, time, asyncio, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission import AdmissionController
+from config import configs
+from bench_markdown import option
+
+POOL_SIZE = configs.db.maxsize
+QUERY_TIME = 0.010
+SPIKE_SECONDS = 2.0
+PROXY = '127.0.0.1'  # 反向代理的地址
+SLO = 0.250  # 被接受请求的p99延迟目标(秒)
+
+
+async def handle(pool):
+    async with pool:
+        await asyncio.sleep(QUERY_TIME)
+
+
+async def request(pool, controller, headers, latencies, rejected):
+    start = time.perf_counter()
+    if controller is not None:
+        # 和app.py的admission_factory一样：无法确定客户端时不做按客户端的限流
+        client = controller.client(PROXY, headers)
+        if (client is not None and controller.check_rate(client)) or not (await controller.acquire()):
+            rejected.append(time.perf_counter() - start)
+            return
+        try:
+            await handle(pool)
+        finally:
+            controller.release()
+    else:
+        await handle(pool)
+    latencies.append(time.perf_counter() - start)
+
+
+async def run(name, controller, clients, rate):
+    pool = asyncio.Semaphore(POOL_SIZE)
+    latencies, rejected, tasks = [], [], []
+    start = time.perf_counter()
+    n = int(rate * SPIKE_SECONDS)
+    for i in range(n):
+        # 按固定速率发送请求
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        headers = {'X-Forwarded-For': '10.0.%d.%d' % divmod(random.randrange(clients), 256)}
+        tasks.append(asyncio.ensure_future(request(pool, controller, headers, latencies, rejected)))
+    await asyncio.gather(*tasks)
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print('%-10s admitted %5d  rejected %5d  p50 %7.1f ms  p99 %7.1f ms  max rejection %5.2f ms' % (
+        name, len(latencies), len(rejected), p50 * 1000, p99 * 1000, max(rejected or [0]) * 1000))
+    return p99
+
+
+def main():
+    clients = int(option('--clients', '500'))
+    rate = int(option('--rate', '3000'))
+    admission = configs.admission
+    print('pool %d, max_inflight %d, max_queue %d, queue_timeout %.2fs, %d/s burst %d per client, %d clients at %d/s'
+          % (POOL_SIZE, admission.max_inflight, admission.max_queue, admission.queue_timeout, admission.rate,
+             admission.burst, clients, rate))
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run('none', None, clients, rate))
+    p99 = loop.run_until_complete(run('admission', AdmissionController.from_config(admission), clients, rate))
+    if p99 > SLO:
+        print('FAIL: p99 %.1f ms exceeds SLO %.1f ms' % (p99 * 1000, SLO * 1000))
+        sys.exit(1)
+    print('OK: p99 within SLO %.1f ms' % (SLO * 1000))
+
+if __name__ == '__main__':
+    main()
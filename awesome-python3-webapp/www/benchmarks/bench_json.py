@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: serialize a list of 1,000 users.
+对比原来response_factory中 json.dumps(default=o.__dict__) + 手动屏蔽passwd 的方式
+与apis.dumps使用元类预先生成的序列化函数的方式
+运行方式: python3 benchmarks/bench_json.py
+'''
+
+import os, sys, json, time, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import apis
+from apis import Page
+from models import User, next_id
+
+N = 1000
+
+def make_users():
+    return [User(id=next_id(), email='user%d@example.com' % i, passwd='%040x' % i, admin=False,
+                 name='用户%d' % i, image='http://www.gravatar.com/avatar/%032x?d=mm&s=120' % i,
+                 created_at=time.time()) for i in range(N)]
+
+# 原来的做法：逐个修改passwd，再用标准库json编码
+def legacy(users):
+    for u in users:
+        u.passwd = '*****'
+    return json.dumps(dict(page=Page(N), users=users), ensure_ascii=False, default=lambda o: o.__dict__).encode('utf-8')
+
+def schema_aware(users):
+    return apis.dumps(dict(page=Page(N), users=users))
+
+def main():
+    users = make_users()
+    assert b'passwd' not in schema_aware(users)
+    backend = 'orjson' if apis.orjson is not None else 'json'
+    for name, fn in (('legacy', legacy), ('apis.dumps[%s]' % backend, schema_aware)):
+        number = 50
+        best = min(timeit.repeat(lambda: fn(users), number=number, repeat=5)) / number
+        print('%-20s %8.3f ms / %d users' % (name, best * 1000, N))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: event-loop latency during concurrent logins.
+一个探针协程每隔1ms醒来一次，记录实际的唤醒延迟，同时并发执行LOGINS次密码验证
+inline: 在事件循环中直接调用verify_password (相当于原来在handler中直接计算)
+executor: 使用verify_password_async，在有界线程池中计算
+运行方式: python3 benchmarks/bench_login.py
+'''
+
+import os, sys, time, asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords
+
+LOGINS = 50
+PASSWD = 'b' * 40
+STORED = passwords.hash_password(PASSWD)
+
+
+async def probe(lags, done):
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - start - 0.001)
+
+
+async def inline_login():
+    await asyncio.sleep(0)
+    return passwords.verify_password(STORED, 'uid', PASSWD)
+
+
+async def executor_login():
+    return await passwords.verify_password_async(STORED, 'uid', PASSWD)
+
+
+async def run(name, login):
+    lags = []
+    done = asyncio.Event()
+    task = asyncio.ensure_future(probe(lags, done))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[login() for i in range(LOGINS)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    assert all(ok for ok, rehash in results)
+    lags.sort()
+    print('%-9s %d logins in %6.0f ms, loop lag p50 %7.2f ms, p99 %7.2f ms, max %7.2f ms' % (
+        name, LOGINS, elapsed * 1000, lags[len(lags) // 2] * 1000, lags[int(len(lags) * 0.99)] * 1000, lags[-1] * 1000))
+
+
+def main():
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run('inline', inline_login))
+    loop.run_until_complete(run('executor', executor_login))
+
+if __name__ == '__main__':
+    main()
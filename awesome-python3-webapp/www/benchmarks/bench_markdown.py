@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark and regression check: markdown2.markdown() throughput and peak memory per extra.
+每个用例打开一个extra，转换生成的文档(集中使用这个extra的语法)和corpus目录中的真实博客
+输出每个用例的吞吐量(KB/s，取多轮中最快的一轮)和转换一篇文档时的内存峰值(tracemalloc)
+吞吐量和保存的基线(markdown_baseline.json)比较，下降超过tolerance时以退出码1结束，可以放在提交前或CI中运行
+不同机器的速度不同，基线中同时保存了一个纯python校准任务的速度，比较前按校准速度的比例换算基线
+运行方式: python3 benchmarks/bench_markdown.py [--corpus DIR] [--tolerance 0.3] [--save-baseline]
+'''
+
+import os, sys, re, time, json, functools, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+from bench_markdown_convert import make_post
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'markdown_baseline.json')
+ROUNDS = 15
+ROUND_TIME = 0.1
+
+LINK_PATTERNS = [
+    (re.compile(r'#(\d+)'), r'https://github.com/michaelliao/awesome-python3-webapp/issues/\1'),
+    (re.compile(r'\bPEP[ ]?(\d+)\b', re.I), r'https://www.python.org/dev/peps/pep-\1/'),
+]
+
+
+def make_tables(n):
+    rows = '\n'.join('| row%d | %d | *em* `code` | [link](/blog/%d) |' % (i, i * 7, i) for i in range(20))
+    table = '| Name | Value | Text | Link |\n|:-----|------:|:----:|------|\n%s\n' % rows
+    return '\n'.join('### Table %d\n\n%s\nSome text after table %d.\n' % (i, table, i) for i in range(n))
+
+
+def make_wiki_tables(n):
+    rows = '\n'.join('|| row%d || %d || *em* `code` || [link](/blog/%d) ||' % (i, i * 7, i) for i in range(20))
+    return '\n'.join('### Table %d\n\n%s\n\nSome text after table %d.\n' % (i, rows, i) for i in range(n))
+
+
+def make_fenced(n):
+    code = '\n'.join('    if x > %d and y < %d:  # <tag> & "quotes"\n        return x * %d' % (i, i, i) for i in range(15))
+    return '\n'.join('Block %d:\n\n```\ndef f%d(x, y):\n%s\n```\n' % (i, i, code) for i in range(n))
+
+
+def make_footnotes(n):
+    paragraphs = '\n\n'.join('Paragraph %d cites a source[^n%d] and another one[^m%d].' % (i, i, i) for i in range(n))
+    notes = '\n'.join('[^n%d]: Note %d with *emphasis*.\n[^m%d]: Second note %d, see <http://example.com/%d>.'
+                      % (i, i, i, i, i) for i in range(n))
+    return '%s\n\n%s\n' % (paragraphs, notes)
+
+
+def make_toc(n):
+    parts = []
+    for i in range(n):
+        parts.append('## Chapter %d\n\nIntro %d.\n' % (i, i))
+        for j in range(4):
+            parts.append('### Section %d.%d\n\nText for section %d.%d with **bold**.\n' % (i, j, i, j))
+            parts.append('#### Details\n\nRepeated header names get numbered ids.\n')
+    return '\n'.join(parts)
+
+
+def make_link_patterns(n):
+    line = 'Fixed in #%d, see also #%d and PEP %d; unrelated text with *emphasis* and `code` here.'
+    return '\n\n'.join(' '.join(line % (i * 10 + j, i * 10 + j + 1, 8 + j) for j in range(5)) for i in range(n))
+
+
+# 用例: (名称, markdown2.markdown的参数, 生成的文档)
+def make_cases():
+    return [
+        ('plain', dict(), [make_post(1), make_post(4)]),
+        ('tables', dict(extras=['tables']), [make_tables(5), make_tables(15)]),
+        ('fenced-code-blocks', dict(extras=['fenced-code-blocks']), [make_fenced(5), make_fenced(15)]),
+        ('footnotes', dict(extras=['footnotes']), [make_footnotes(10), make_footnotes(30)]),
+        ('toc', dict(extras=['toc']), [make_toc(3), make_toc(8)]),
+        ('wiki-tables', dict(extras=['wiki-tables']), [make_wiki_tables(5), make_wiki_tables(15)]),
+        ('link-patterns', dict(extras=['link-patterns'], link_patterns=LINK_PATTERNS),
+         [make_link_patterns(10), make_link_patterns(30)]),
+    ]
+
+
+def load_corpus(path):
+    docs = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.md'):
+            with open(os.path.join(path, name), encoding='utf-8') as f:
+                docs.append(f.read())
+    return docs
+
+
+# 校准任务：和markdown2类似的python代码(正则替换、字符串拼接、字典)，用来换算不同机器的速度
+_calibration_words = 'The *quick* brown fox [jumps](/over) the `lazy` dog & <b>cat</b>.'.split(' ')
+_calibration_re = re.compile(r'(\*|_)(?=\S)(.+?)(?<=\S)\1')
+
+
+def calibrate():
+    lines = []
+    seen = dict()
+    for i in range(2000):
+        word = _calibration_words[i % len(_calibration_words)]
+        line = _calibration_re.sub(lambda m: '<em>%s</em>' % m.group(2), ' '.join([word, str(i), word.upper()]))
+        seen[line] = len(seen)
+        lines.append(line.replace('&', '&amp;').replace('<', '&lt;'))
+    return '\n'.join(lines)
+
+
+def convert_all(kw, docs):
+    for t in docs:
+        markdown2.markdown(t, **kw)
+
+
+# 返回每个任务最快一轮中单遍的耗时
+# 所有任务按轮次交替运行，机器忙闲变化时各个任务受到的影响相同，不会只拖慢某一个用例
+# 每轮重复运行多遍，至少持续ROUND_TIME秒，太短的计时误差很大
+def best_times(tasks):
+    passes = []
+    for task in tasks:
+        start = time.perf_counter()
+        task()  # 预热
+        passes.append(max(1, int(ROUND_TIME / (time.perf_counter() - start))))
+    best = [None] * len(tasks)
+    for _ in range(ROUNDS):
+        for i, task in enumerate(tasks):
+            start = time.perf_counter()
+            for _ in range(passes[i]):
+                task()
+            elapsed = (time.perf_counter() - start) / passes[i]
+            best[i] = elapsed if best[i] is None else min(best[i], elapsed)
+    return best
+
+
+def peak_memory(kw, docs):
+    peak = 0
+    for t in docs:
+        tracemalloc.start()
+        markdown2.markdown(t, **kw)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return peak
+
+
+def option(name, default):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+def main():
+    corpus = load_corpus(option('--corpus', os.path.join(HERE, 'corpus')))
+    tolerance = float(option('--tolerance', '0.3'))
+    results = dict()
+    print('%d corpus documents' % len(corpus))
+
+    baseline = None
+    if os.path.exists(BASELINE) and '--save-baseline' not in sys.argv:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+    cases = [(name, kw, docs + corpus) for name, kw, docs in make_cases()]
+    times = best_times([calibrate] + [functools.partial(convert_all, kw, docs) for name, kw, docs in cases])
+    calibration = 1.0 / times[0]
+    for (name, kw, docs), elapsed in zip(cases, times[1:]):
+        size = sum(len(t.encode('utf-8')) for t in docs)
+        results[name] = dict(kb_per_s=size / 1024.0 / elapsed, peak_kb=peak_memory(kw, docs) / 1024.0)
+    print('calibration %.0f ops/s' % calibration)
+    print('%-20s %10s %10s %10s %8s' % ('case', 'KB/s', 'peak KB', 'baseline', 'change'))
+
+    regressions = []
+    for name, result in results.items():
+        expected = None
+        if baseline is not None and name in baseline['cases']:
+            # 按校准速度换算成本机上的期望吞吐量
+            expected = baseline['cases'][name]['kb_per_s'] * calibration / baseline['calibration']
+        if expected is None:
+            print('%-20s %10.1f %10.1f %10s %8s' % (name, result['kb_per_s'], result['peak_kb'], '-', '-'))
+            continue
+        change = result['kb_per_s'] / expected - 1.0
+        print('%-20s %10.1f %10.1f %10.1f %+7.1f%%' % (name, result['kb_per_s'], result['peak_kb'], expected, change * 100))
+        if change < -tolerance:
+            regressions.append(name)
+
+    if '--save-baseline' in sys.argv:
+        with open(BASELINE, 'w') as f:
+            json.dump(dict(calibration=calibration, cases=results), f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('baseline saved to %s' % BASELINE)
+    elif baseline is None:
+        print('no baseline, run with --save-baseline to create one')
+    if regressions:
+        print('throughput regressed more than %d%%: %s' % (tolerance * 100, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
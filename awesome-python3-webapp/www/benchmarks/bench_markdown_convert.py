@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: markdown2 convert throughput on a corpus of typical blog posts.
+new:    每篇文章都 Markdown(...).convert()，即改动前 markdown2.markdown() 的做法
+pooled: markdown2.markdown()，从转换器池里取一个复用的 Markdown 对象
+reused: 单个 Markdown 对象反复 convert()，复用的上限
+运行方式: python3 benchmarks/bench_markdown_convert.py [--dump out.json]
+'''
+
+import os, sys, time, json, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+
+EXTRAS = ['fenced-code-blocks', 'tables', 'footnotes']
+
+PARAGRAPH = '''这是第 %d 段。Some *emphasis*, some **strong text**, a `code span`, an
+[inline link](http://example.com/%d "title") and a [reference link][ref%d].
+Autolink <http://www.example.com/page/%d> and an email <user%d@example.com>.
+'''
+
+SECTION = '''
+## Section %(n)d
+
+%(paragraphs)s
+
+* item one with _em_
+* item two
+    * nested item
+    * another nested item
+* item three
+
+1. first
+2. second
+3. third
+
+> a quote with **bold**
+> spanning two lines
+
+    def indented_code(x):
+        return x * %(n)d
+
+```
+def fenced(y):
+    return {"n": %(n)d, "y": y}
+```
+
+| Name | Value | Note |
+|:-----|------:|:----:|
+| a%(n)d | %(n)d | *x* |
+| b%(n)d | %(n)d | `y` |
+
+A footnote reference[^note%(n)d].
+
+<div class="box">
+raw html block %(n)d
+</div>
+
+---
+
+[ref%(n)d]: http://example.com/ref/%(n)d "Ref %(n)d"
+[^note%(n)d]: The footnote text for section %(n)d.
+'''
+
+
+def make_post(sections):
+    parts = ['# Post title\n\nIntro paragraph with a [link](/blog/1).\n']
+    for n in range(sections):
+        paragraphs = '\n'.join(PARAGRAPH % (i, i, n, i, i) for i in range(3))
+        parts.append(SECTION % dict(n=n, paragraphs=paragraphs))
+    return '\n'.join(parts)
+
+
+def make_corpus():
+    # 短文章居多，夹杂少量长文
+    return [make_post(1)] * 20 + [make_post(5)] * 8 + [make_post(20)] * 2
+
+
+def run(convert, corpus, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in corpus:
+            convert(text)
+    return time.perf_counter() - start
+
+
+def main():
+    corpus = make_corpus()
+    rounds = 5
+    size = sum(len(t) for t in corpus) * rounds
+    docs = len(corpus) * rounds
+    reused = markdown2.Markdown(extras=EXTRAS)
+    cases = [
+        ('new', lambda t: markdown2.Markdown(extras=EXTRAS).convert(t)),
+        ('pooled', lambda t: markdown2.markdown(t, extras=EXTRAS)),
+        ('reused', reused.convert),
+    ]
+    # 预热，把正则缓存填满
+    for _, convert in cases:
+        run(convert, corpus[:1], 1)
+    print('%d docs, %.1f KB per round' % (len(corpus), size / rounds / 1024.0))
+    for name, convert in cases:
+        elapsed = run(convert, corpus, rounds)
+        print('%-8s %8.1f docs/s %8.1f KB/s' % (name, docs / elapsed, size / 1024.0 / elapsed))
+    if '--dump' in sys.argv:
+        # 保存输出，用来确认改动前后渲染结果一致；邮件地址混淆用到随机数，先固定种子
+        path = sys.argv[sys.argv.index('--dump') + 1]
+        random.seed(0)
+        with open(path, 'w') as f:
+            json.dump([markdown2.markdown(t, extras=EXTRAS) for t in corpus], f)
+
+
+if __name__ == '__main__':
+    main()
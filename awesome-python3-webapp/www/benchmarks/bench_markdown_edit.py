@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: edit-save latency for large posts, full conversion vs incremental re-rendering.
+每轮修改文章中随机的一段(每隔一轮改一个标题)，然后重新生成html，相当于在manage_blog_edit.html中改一段后保存
+full:        markdown2.markdown() 转换整篇文章
+incremental: IncrementalRenderer，只转换改动的块，其余的块使用缓存；misses是每轮重新转换的块数，改一个标题也应该接近1
+两者的输出和目录每轮都会比较，必须完全相同
+运行方式: python3 benchmarks/bench_markdown_edit.py
+'''
+
+import os, sys, time, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+from incremental import IncrementalRenderer
+from bench_markdown_convert import make_post
+
+EXTRAS = ['toc', 'fenced-code-blocks', 'tables', 'footnotes']  # 博客用toc，标题都有id
+EDITS = 20
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def main():
+    # 邮件地址混淆用到随机数，固定下来才能比较两种方式的输出
+    markdown2.random = lambda: 0.5
+    rnd = random.Random(0)
+    print('%8s %8s %12s %12s %12s %12s %8s' % ('size', 'blocks', 'full p50', 'full p95', 'incr p50', 'incr p95', 'misses'))
+    for sections in (10, 40, 160):
+        text = make_post(sections)
+        renderer = IncrementalRenderer(extras=EXTRAS)
+        renderer.render(text)  # 第一次保存，填充缓存
+        misses = renderer.misses
+        full, incr = [], []
+        for i in range(EDITS):
+            paragraphs = text.split('\n\n')
+            if i % 2:
+                # 改一个标题，后面的标题id不变，但是整篇文档的id去重要重新计算
+                n = rnd.choice([k for k, p in enumerate(paragraphs) if p.lstrip('\n').startswith('#')])
+            else:
+                n = rnd.randrange(len(paragraphs))
+            paragraphs[n] = paragraphs[n] + ' edit %d' % i
+            text = '\n\n'.join(paragraphs)
+            start = time.perf_counter()
+            expected = markdown2.markdown(text, extras=EXTRAS)
+            full.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            html = renderer.render(text)
+            incr.append(time.perf_counter() - start)
+            assert html == expected, 'incremental output differs after edit %d' % i
+            assert html.toc_html == expected.toc_html, 'incremental toc differs after edit %d' % i
+        print('%7dK %8d %10.1fms %10.1fms %10.1fms %10.1fms %8.1f' % (
+            len(text) // 1024, (renderer.hits + renderer.misses) // (EDITS + 1),
+            percentile(full, 0.5) * 1000, percentile(full, 0.95) * 1000,
+            percentile(incr, 0.5) * 1000, percentile(incr, 0.95) * 1000, (renderer.misses - misses) / EDITS))
+
+
+if __name__ == '__main__':
+    main()
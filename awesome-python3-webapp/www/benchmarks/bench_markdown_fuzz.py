@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Fuzz benchmark: worst-case time of markdown2's "hardened" extra on adversarial input.
+对抗性输入: 每一类都是让原来的正则严重回溯的写法(未闭合的链接、成串的*和_、深层嵌套的列表和引用、未闭合的html标签等)，按多个长度生成
+随机变异: 在corpus目录的真实博客中随机插入markdown的标点、复制片段，固定随机种子，结果可以重现
+每次转换都计算CPU时间，必须在 预算 + slack 秒内完成，或者抛出MarkdownBudgetError(显示时按纯文本处理)
+自动链接的扫描和原来的正则对SAME_OUTPUT中的畸形输入必须输出相同的html
+超出时或输出不同时以退出码1结束；growth一列是最后两个长度的耗时之比，线性时间的扫描大约是长度之比(4)
+运行方式: python3 benchmarks/bench_markdown_fuzz.py [--budget 0.5] [--slack 0.1] [--runs 300] [--seed 1] [--extras a,b] [--corpus DIR]
+'''
+
+import os, sys, time, random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+from bench_markdown import load_corpus, option
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SIZES = (1000, 4000, 16000, 64000)
+
+# 对抗性输入: (名称, 重复的片段)，片段重复到指定长度
+ADVERSARIAL = [
+    ('link_open', '[a]('), ('brackets', '['), ('bracket_pairs', '[a]'), ('image_open', '!['),
+    ('ref_open', '[a]['), ('paren_open', '('), ('code_ticks', '`a'), ('code_runs', '``a`'),
+    ('stars', '*'), ('star_words', '*a'), ('strong_words', '**a'), ('under_words', '_a_a'),
+    ('nested_em', '*a **b '), ('em_lines', '*a\n'), ('lt', '<'), ('tag_open', '<a '),
+    ('tag_attrs', 'a="b" '), ('comment_open', '<!--'), ('pi_open', '<?a '), ('email_open', '<a@'),
+    ('http_open', '<http://'), ('http_runs', '<http:a'), ('div_open', '<div>\n'), ('span_open', '<span>'), ('hashes', '#'),
+    ('tabs', '\t'), ('spaces', ' '), ('quote_nest', '> '), ('dashes', '- '), ('numbers', '1. '),
+    ('backslashes', '\\'), ('footnote_refs', '[^a]'), ('ampersands', '&'), ('pipes', '|'),
+    ('fences', '```\n'), ('pyshell', '>>> a\n'), ('hard_breaks', 'a  \n'), ('quote_lines', '> a\n>\n'),
+]
+
+# 自动链接: 开启hardened前后输出必须相同，包括没有正常闭合的写法
+SAME_OUTPUT = ['<http://x.y</p>', 'a <http://x.y> b', '<HTTP://a<http://b>', '<http:>', '<ftp:x',
+               "<http://a'b>", 'x<http://a>>', '<a href="<http://x>">', '<<http://x>', '<http://x<http://y']
+
+# 随机变异时插入的片段
+SNIPPETS = ['*', '**', '_', '__', '`', '[', ']', '(', ')', '](', '![', '<', '>', '<div>', '</div>', '<!--', '-->',
+            '\\', '#', '\n', '\n\n', '  ', '\t', '- ', '1. ', '> ', '|', '&', '"', "'", 'http://', '[^1]']
+
+
+def adversarial(piece, size):
+    return (piece * (size // len(piece) + 1))[:size]
+
+
+# 深层嵌套的列表，每一层多缩进两个空格
+def nested_list(size):
+    lines, n = [], 0
+    while sum(len(l) for l in lines) < size:
+        lines.append('  ' * n + '- a\n')
+        n += 1
+    return ''.join(lines)
+
+
+def mutate(rnd, doc):
+    chars = list(doc)
+    for _ in range(rnd.randint(1, 50)):
+        i = rnd.randint(0, len(chars))
+        if rnd.random() < 0.1:
+            # 复制一段，制造大量重复的结构
+            j = rnd.randint(0, len(chars))
+            chars[i:i] = chars[min(i, j):max(i, j)] * rnd.randint(1, 4)
+        else:
+            chars[i:i] = rnd.choice(SNIPPETS) * rnd.choice((1, 1, 1, 8, 64))
+    return ''.join(chars)
+
+
+# 返回(CPU时间, 是否超出预算)
+def convert(text, extras):
+    start = time.thread_time()
+    try:
+        markdown2.markdown(text, extras=extras)
+        return time.thread_time() - start, False
+    except markdown2.MarkdownBudgetError:
+        return time.thread_time() - start, True
+
+
+def main():
+    budget = float(option('--budget', '0.5'))
+    slack = float(option('--slack', '0.1'))
+    runs = int(option('--runs', '300'))
+    rnd = random.Random(int(option('--seed', '1')))
+    corpus = load_corpus(option('--corpus', os.path.join(HERE, 'corpus')))
+    extras = dict.fromkeys(e for e in option('--extras', '').split(',') if e)
+    extras['hardened'] = budget
+    limit = budget + slack
+    failures = []
+
+    print('budget %.2fs + slack %.2fs, extras: %s' % (budget, slack, ', '.join(sorted(extras))))
+    print('%-16s %s %8s' % ('case', ' '.join('%9d' % size for size in SIZES), 'growth'))
+    cases = [(name, lambda size, piece=piece: adversarial(piece, size)) for name, piece in ADVERSARIAL]
+    cases.append(('list_nest', nested_list))
+    for name, make in cases:
+        cells, times = [], []
+        for size in SIZES:
+            elapsed, fallback = convert(make(size), extras)
+            times.append(elapsed)
+            # 超出预算回退成纯文本的标记为*
+            cells.append('%8.1f%s' % (elapsed * 1000, '*' if fallback else ' '))
+            if elapsed > limit:
+                failures.append('%s(%d)' % (name, size))
+        growth = times[-1] / times[-2] if times[-2] > 1e-4 else 0.0
+        print('%-16s %s %8.1f' % (name, ' '.join(cells), growth))
+
+    worst, fallbacks = 0.0, 0
+    for i in range(runs):
+        doc = mutate(rnd, rnd.choice(corpus))
+        elapsed, fallback = convert(doc, extras)
+        worst = max(worst, elapsed)
+        fallbacks += fallback
+        if elapsed > limit:
+            failures.append('mutation %d' % i)
+    print('%d mutated corpus documents: worst %.1f ms, %d over budget' % (runs, worst * 1000, fallbacks))
+    print('times in ms of CPU, * = over budget, shown as plain text')
+
+    plain = dict((e, v) for e, v in extras.items() if e != 'hardened')
+    for text in SAME_OUTPUT:
+        if markdown2.markdown(text, extras=extras) != markdown2.markdown(text, extras=plain):
+            failures.append('output of %r' % text)
+
+    if failures:
+        print('took longer than %.2fs: %s' % (limit, ', '.join(failures)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
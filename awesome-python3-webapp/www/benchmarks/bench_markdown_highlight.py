@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: pygments highlighting of fenced code blocks, per-block path vs the shared cache.
+生成代码很多的文章(python/js/sql/bash代码块，有的代码块在文章中重复出现)，用fenced-code-blocks转换
+uncached: 改动前的做法，每个代码块都重新import pygments、查找lexer、创建formatter类和formatter对象，没有缓存
+cold: 每篇文章转换前清空共享缓存，只有文章内去重、lexer和formatter复用带来的提升
+warm: 同一篇文章再次渲染(重启前的重复渲染、预览)，代码块全部命中缓存
+edit: 每次只改动一个代码块(编辑文章后保存)，只有这个代码块需要重新着色
+运行方式: python3 benchmarks/bench_markdown_highlight.py [--blocks 20] [--rounds 5]
+'''
+
+import os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown2
+from bench_markdown import option
+
+EXTRAS = ['fenced-code-blocks']
+
+CODE = [
+    ('python', '''def handler_%(n)d(request, *, page='1'):
+    # 分页查询
+    num = yield from Blog.findNumber('count(id)')
+    p = Page(num, get_page_index(page))
+    if num == 0:
+        return dict(page=p, blogs=())
+    blogs = yield from Blog.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
+    return {"page": p, "blogs": blogs, "n": %(n)d}
+'''),
+    ('javascript', '''function loadBlogs%(n)d(page) {
+    getJSON('/api/blogs', { page: page }, function (err, data) {
+        if (err) {
+            return showError(err);
+        }
+        vm.blogs = data.blogs.filter(b => b.id !== '%(n)d');
+        vm.page = data.page;
+    });
+}
+'''),
+    ('sql', '''select b.id, b.name, count(c.id) as comments
+from blogs b left join comments c on c.blog_id = b.id
+where b.created_at > %(n)d
+group by b.id, b.name
+order by comments desc
+limit 10;
+'''),
+    ('bash', '''for f in /srv/awesome/log/*.log; do
+    gzip -9 "$f" && mv "$f.gz" /srv/awesome/backup/%(n)d/
+done
+kill -HUP $(cat /srv/awesome/awesome.pid)
+'''),
+]
+
+
+def make_code_post(blocks, version=0):
+    parts = ['# Code notes\n\nA post that is mostly code.\n']
+    for i in range(blocks):
+        lang, code = CODE[i % len(CODE)]
+        # 每三个代码块中有一个和前面的重复(同一段代码贴了两次)
+        n = i - 1 if i % 3 == 2 else i
+        if i == 0 and version:
+            n = 10000 + version
+        parts.append('Step %d, in %s:\n\n```%s\n%s```\n' % (i, lang, lang, code % dict(n=n)))
+    return '\n'.join(parts)
+
+
+class UncachedMarkdown(markdown2.Markdown):
+    '''改动前的做法：每个代码块都重新查找lexer、创建formatter，不用缓存'''
+
+    def _highlight_fenced_code_blocks(self, text):
+        pass
+
+    def _get_pygments_lexer(self, lexer_name):
+        try:
+            from pygments import lexers, util
+        except ImportError:
+            return None
+        try:
+            return lexers.get_lexer_by_name(lexer_name)
+        except util.ClassNotFound:
+            return None
+
+    def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
+        import pygments
+        formatter_opts.setdefault('cssclass', 'codehilite')
+        formatter = markdown2._html_code_formatter_class(pygments)(**formatter_opts)
+        return pygments.highlight(codeblock, lexer, formatter)
+
+
+def run(convert, docs, rounds, before=None):
+    elapsed = 0.0
+    for _ in range(rounds):
+        for text in docs:
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            convert(text)
+            elapsed += time.perf_counter() - start
+    return elapsed / rounds / len(docs)
+
+
+def main():
+    blocks = int(option('--blocks', '20'))
+    rounds = int(option('--rounds', '5'))
+    try:
+        markdown2._import_pygments()
+    except ImportError:
+        print('pygments is not installed')
+        sys.exit(1)
+    docs = [make_code_post(blocks // 4), make_code_post(blocks), make_code_post(blocks * 4)]
+    edits = [make_code_post(blocks, version=v) for v in range(1, rounds * 2 + 1)]
+    uncached = lambda t: UncachedMarkdown(extras=EXTRAS).convert(t)
+    cached = lambda t: markdown2.markdown(t, extras=EXTRAS)
+
+    # 两种做法的输出必须一致
+    for text in docs:
+        if uncached(text) != cached(text):
+            print('output differs from the uncached path')
+            sys.exit(1)
+
+    cases = [
+        ('uncached', lambda: run(uncached, docs, rounds)),
+        ('cold', lambda: run(cached, docs, rounds, markdown2._highlight_cache.clear)),
+        ('warm', lambda: run(cached, docs, rounds)),
+        ('edit', lambda: run(cached, edits, 1)),
+    ]
+    print('%d posts with %s code blocks' % (len(docs), '/'.join(str(t.count('```') // 2) for t in docs)))
+    print('%-10s %10s %8s' % ('case', 'ms/post', 'speedup'))
+    base = None
+    for name, case in cases:
+        if name == 'edit':
+            # 编辑场景从已经渲染过一次的文章开始
+            markdown2._highlight_cache.clear()
+            cached(make_code_post(blocks))
+        per_post = case()
+        base = base or per_post
+        print('%-10s %10.2f %7.1fx' % (name, per_post * 1000, base / per_post))
+
+
+if __name__ == '__main__':
+    main()
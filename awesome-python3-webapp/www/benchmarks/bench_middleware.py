@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: per-request middleware overhead, legacy factories vs. @web.middleware.
+legacy: 原来的工厂式中间件(auth为生成器协程)，data_factory解析一次请求体，RequestHandler再解析一次
+modern: app.py现在的中间件，请求体只在data_factory中解析一次，缓存在request['__data__']中
+两条链最后都交给同一个RequestHandler和response_factory，差别只在中间件本身和请求体解析
+运行方式: python3 benchmarks/bench_middleware.py
+'''
+
+import os, sys, json, time, asyncio, functools, logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+import app as webapp
+from coroweb import RequestHandler
+
+logging.disable(logging.INFO)
+
+N = 20000
+BODY = json.dumps(dict(name='test', summary='s' * 100, content='c' * 2000)).encode('utf-8')
+
+
+# 一次性返回请求体的payload，代替aiohttp的StreamReader
+class Payload(object):
+    def __init__(self, data):
+        self._data = data
+
+    async def readany(self):
+        data, self._data = self._data, b''
+        return data
+
+
+async def api_create(request, *, name, summary, content):
+    return dict(name=name)
+
+
+# ---- 原来的工厂式中间件 ----
+
+async def legacy_logger_factory(app, handler):
+    async def logger(request):
+        logging.info('Request: %s %s' % (request.method, request.path))
+        return (await handler(request))
+    return logger
+
+@asyncio.coroutine
+def legacy_auth_factory(app, handler):
+    @asyncio.coroutine
+    def auth(request):
+        logging.info('auth_factory :check user: %s %s' % (request.method, request.path))
+        request.__user__ = None
+        cookie_str = request.cookies.get(webapp.COOKIE_NAME)
+        if cookie_str:
+            user = yield from webapp.cookie2user(cookie_str)
+            if user:
+                request.__user__ = user
+        return (yield from handler(request))
+    return auth
+
+async def legacy_data_factory(app, handler):
+    async def parse_data(request):
+        if request.method == 'POST':
+            if request.content_type.startswith('application/json'):
+                request.__data__ = await request.json()
+        return (await handler(request))
+    return parse_data
+
+async def legacy_response_factory(app, handler):
+    async def response(request):
+        return (await webapp.response_factory(request, handler))
+    return response
+
+
+# aiohttp对两种中间件的处理方式：工厂式中间件每个请求都要调用一遍工厂函数，新式中间件用partial串起来
+async def legacy_chain(app, handler):
+    for factory in reversed([legacy_logger_factory, legacy_auth_factory, legacy_data_factory, legacy_response_factory]):
+        handler = await factory(app, handler)
+    return handler
+
+def modern_chain(app, handler):
+    for middleware in reversed([webapp.logger_factory, webapp.auth_factory, webapp.data_factory, webapp.response_factory]):
+        handler = functools.partial(middleware, handler=handler)
+    return handler
+
+
+def make_request(app):
+    return make_mocked_request('POST', '/api/blogs', headers={'Content-Type': 'application/json'},
+                               app=app, payload=Payload(BODY))
+
+
+async def run(app, name, build):
+    handler = RequestHandler(app, api_create)
+    start = time.perf_counter()
+    for i in range(N):
+        chain = await build(app, handler)
+        resp = await chain(make_request(app))
+        assert resp.status == 200
+    elapsed = time.perf_counter() - start
+    print('%-8s %8.2f us / request' % (name, elapsed / N * 1e6))
+
+
+async def modern(app, handler):
+    return modern_chain(app, handler)
+
+
+def main():
+    app = web.Application()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(run(app, 'legacy', legacy_chain))
+    loop.run_until_complete(run(app, 'modern', modern))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Boot-time check: how long importing app.py and building the app (templates, routes) takes.
+每一轮启动一个新的python进程(-X importtime)，导入app并调用app.make_app()，不连接数据库、不监听端口
+输出最快一轮中startup.mark()记录的各个阶段，以及导入时自身耗时最多的模块
+总耗时超过预算(config中的startup.budget)，或者应该延迟导入的模块(markdown2等)在启动时就被导入时，以退出码1结束
+运行方式: python3 benchmarks/bench_startup.py [--runs 5] [--budget 1.0] [--top 10]
+'''
+
+import os, sys, json, subprocess
+
+WWW = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, WWW)
+
+from config import configs
+from bench_markdown import option
+
+# 第一次请求才用到的模块，启动时不能导入
+LAZY = ('markdown2', 'incremental', 'multiprocessing', 'pygments')
+
+BOOT = '''
+import startup
+import asyncio, json, sys
+import app
+app.make_app(asyncio.new_event_loop())
+print(json.dumps(dict(phases=startup.phases(), total=startup.total(),
+                      lazy=sorted(m for m in %r if m in sys.modules))))
+''' % (LAZY,)
+
+
+# 返回(子进程输出的结果, [(模块, 自身耗时(微秒), 累计耗时(微秒))])
+def boot():
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', BOOT], cwd=WWW,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if p.returncode != 0:
+        print(p.stderr)
+        sys.exit(p.returncode)
+    imports = []
+    for line in p.stderr.splitlines():
+        # import time:      self [us] |  cumulative | imported package
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            own, cumulative, name = line[len('import time:'):].split('|')
+            imports.append((name.strip(), int(own), int(cumulative)))
+    return json.loads(p.stdout.strip().splitlines()[-1]), imports
+
+
+def main():
+    runs = int(option('--runs', '5'))
+    budget = float(option('--budget', str(configs.startup.budget)))
+    top = int(option('--top', '10'))
+    best = None
+    for _ in range(runs):
+        result = boot()
+        if best is None or result[0]['total'] < best[0]['total']:
+            best = result
+    result, imports = best
+
+    print('%-24s %10s %8s' % ('phase', 'ms', 'modules'))
+    for name, elapsed, modules in result['phases']:
+        print('%-24s %10.1f %8d' % (name, elapsed * 1000, modules))
+    print('%-24s %10.1f' % ('total', result['total'] * 1000))
+    print('')
+    print('%-40s %10s %10s' % ('slowest imports', 'self ms', 'cum ms'))
+    for name, own, cumulative in sorted(imports, key=lambda i: -i[1])[:top]:
+        print('%-40s %10.1f %10.1f' % (name, own / 1000.0, cumulative / 1000.0))
+
+    failed = False
+    if result['lazy']:
+        print('imported during boot, should be imported lazily: %s' % ', '.join(result['lazy']))
+        failed = True
+    if result['total'] > budget:
+        print('boot took %.1f ms, over the %.0f ms budget' % (result['total'] * 1000, budget * 1000))
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark: template startup time and render latency, production mode on and off.
+dev:        auto_reload=True，第一次使用时编译模板，每次get_template都检查文件修改时间
+production: 启动时预编译所有模板，运行时get_template不访问文件系统
+production+bytecode: 同上，编译结果保存在磁盘上，第二次启动直接加载
+运行方式: python3 benchmarks/bench_templates.py
+'''
+
+import os, sys, time, timeit, tempfile, logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as webapp
+from apis import Page
+
+logging.disable(logging.INFO)
+
+BLOGS = [dict(id=str(i), name='Blog %d' % i, summary='summary ' * 20, created_at=time.time() - i * 3600) for i in range(10)]
+
+
+def startup(**kw):
+    app = dict()
+    start = time.perf_counter()
+    webapp.init_jinja2(app, filters=dict(datetime=webapp.datetime_filter), **kw)
+    return app['__templating__'], time.perf_counter() - start
+
+
+def render(env):
+    return env.get_template('blogs.html').render(blogs=BLOGS, page=Page(100, 1), __user__=None)
+
+
+def main():
+    cache_dir = tempfile.mkdtemp()
+    cases = [
+        ('dev', dict(production=False)),
+        ('production', dict(production=True, bytecode_cache_dir=None)),
+        ('production+bytecode (cold)', dict(production=True, bytecode_cache_dir=cache_dir)),
+        ('production+bytecode (warm)', dict(production=True, bytecode_cache_dir=cache_dir)),
+    ]
+    for name, kw in cases:
+        env, elapsed = startup(**kw)
+        first = time.perf_counter()
+        render(env)
+        first = time.perf_counter() - first
+        number = 2000
+        per_render = min(timeit.repeat(lambda: render(env), number=number, repeat=3)) / number
+        print('%-28s startup %7.2f ms  first render %7.2f ms  render %7.1f us' % (
+            name, elapsed * 1000, first * 1000, per_render * 1e6))
+
+if __name__ == '__main__':
+    main()
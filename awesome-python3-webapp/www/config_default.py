@@ -12,9 +12,72 @@ configs = {
         'port': 3306,
         'user': 'pyweb',
         'password': 'pyweb',
-        'db': 'awesome'
+        'db': 'awesome',
+        'maxsize': 10,  # 每个进程的连接池大小，prefork模式下总连接数为 workers * maxsize
+        'minsize': 1
+    },
+    'server': {
+        'host': '127.0.0.1',
+        'port': 9000,
+        'workers': 0,  # server.py启动的worker进程数，0表示和CPU核数相同
+        'backlog': 128,
+        'graceful_timeout': 30,  # worker退出时等待正在处理的请求的最长时间(秒)
+        'reload_interval': 2  # 滚动重启时，新worker启动后等待多久再停掉旧worker(秒)
     },
     'session': {
-        'secret': 'Awesome'
+        'secret': 'Awesome',
+        'cache_size': 10000,  # 每个进程最多缓存多少个已验证的cookie
+        'cache_ttl': 300,  # 已验证的cookie缓存多少秒(不会超过cookie本身的失效时间)
+        'negative_ttl': 60,  # 验证失败的cookie缓存多少秒
+        'version_ttl': 60  # 内存中的会话版本号多少秒后重新从数据库读取，也就是撤销会话在其他进程生效的最长时间
+    },
+    'passwords': {
+        'algorithm': 'pbkdf2_sha256',  # pbkdf2_sha256 或 scrypt，修改后旧的哈希会在用户下次登录时升级
+        'iterations': 100000,  # pbkdf2的迭代次数
+        'scrypt_n': 16384,
+        'scrypt_r': 8,
+        'scrypt_p': 1,
+        'workers': 4,  # 计算密码哈希的线程数
+        'max_pending': 64  # 最多同时排队的哈希任务数，超过的登录请求会等待
+    },
+    'templates': {
+        'production': False,  # 生产模式：启动时预编译所有模板，运行时不检查模板文件是否修改
+        'bytecode_cache_dir': None,  # 生产模式下保存模板编译结果的目录，None表示不使用磁盘缓存
+        'fragment_cache_size': 10000,  # {% cache %}片段缓存最多保存多少个片段
+        'fragment_ttl': 300  # {% cache %}没有指定ttl时缓存的秒数
+    },
+    'deadline': {
+        'default': 10.0  # 每个请求的默认时间预算(秒)，可以用@get(path, timeout=...)为单个路由指定，0表示不限制
+    },
+    'admission': {
+        'enabled': True,
+        'max_inflight': 64,  # 每个进程同时处理的请求数上限
+        'max_queue': 128,  # 等待队列长度上限
+        'queue_timeout': 1.0,  # 在队列中最多等待多少秒
+        'rate': 20,  # 每个客户端每秒的请求数
+        'burst': 40,  # 每个客户端允许的突发请求数
+        # 受信任的反向代理(地址或网段)，只有来自这些地址的请求才使用X-Forwarded-For/X-Real-IP中的客户端地址
+        # 服务只监听127.0.0.1，由本机的代理转发；来自代理但没有这两个请求头的请求不做按客户端的限流
+        'trusted_proxies': ['127.0.0.1', '::1'],
+        'retry_after': 1  # 503响应中Retry-After的最小值(秒)
+    },
+    'compress': {
+        'enabled': True,
+        'min_size': 1024,  # 小于这个字节数的响应不压缩
+        'level': 6,  # gzip/deflate的压缩级别(1-9)，brotli的quality会按比例换算
+        'executor_size': 65536  # 超过这个字节数的响应体放到线程池中压缩，避免阻塞事件循环
+    },
+    'markdown': {
+        'inline_size': 8192,  # 小于这个字符数的markdown直接在事件循环中转换，更大的放到进程池中转换
+        'workers': 2,  # 每个web进程的markdown转换进程数
+        'max_pending': 32,  # 最多同时排队的转换任务数
+        'timeout': 2.0,  # 单个文档最多转换多少秒，超时的内容视为无法渲染
+        'block_cache_size': 20000,  # 增量转换时每个转换进程最多缓存多少个块的html
+        'block_cache_ttl': 86400,  # 块的html缓存多少秒
+        'hardened': True,  # 用线性时间的扫描代替markdown2中会严重回溯的正则(见markdown2的hardened extra)
+        'budget': 0.5  # hardened时单个文档最多用多少秒CPU时间，超出时和timeout一样：保存博客时拒绝，显示旧博客时按纯文本显示
+    },
+    'startup': {
+        'budget': 1.0  # 启动时导入模块、初始化模板和路由最多用多少秒，超出时记录警告，bench_startup.py超出时失败
     }
 }
\ No newline at end of file
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Per-request deadlines carried in a context variable.
+'''
+
+import asyncio, time, contextvars
+
+# 当前请求的截止时间(time.monotonic()的值)，None表示没有时间限制
+# 每个请求在aiohttp中是一个单独的task，contextvars保证各个请求的截止时间互不影响
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    '''
+    Raised when the current request runs out of its time budget. Mapped to 504 by response_factory.
+    '''
+    pass
+
+
+# 为当前请求设置时间预算(秒)，返回的token传给reset恢复原来的截止时间
+# timeout为None或0表示没有时间限制
+def start(timeout):
+    return _deadline.set(time.monotonic() + timeout if timeout else None)
+
+
+def reset(token):
+    _deadline.reset(token)
+
+
+# 当前的截止时间(time.monotonic()的值)，没有时间限制时返回None
+# 和enter一起用，把请求的截止时间带到handler返回之后才执行的代码里(比如JSONStream的分块输出)
+def current():
+    return _deadline.get()
+
+
+# 把截止时间设为deadline(current()的返回值)，返回的token传给reset
+def enter(deadline):
+    return _deadline.set(deadline)
+
+
+# 当前请求剩余的时间(秒)，没有时间限制时返回None，已经超时抛出DeadlineExceeded
+def remaining():
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+
+# 在当前请求剩余的时间内等待aw完成，超时后aw被取消并抛出DeadlineExceeded
+# orm.select和orm.execute用它限制获取连接和执行SQL的时间
+async def run(aw):
+    try:
+        left = remaining()
+    except DeadlineExceeded:
+        if asyncio.iscoroutine(aw):
+            aw.close()
+        raise
+    if left is None:
+        return (await aw)
+    try:
+        return (await asyncio.wait_for(aw, left))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
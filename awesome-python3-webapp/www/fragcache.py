@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Template fragment caching: the {% cache key, ttl %} ... {% endcache %} tag.
+'''
+
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+# 模板中的用法:
+#     {% cache ['blog-item', blog.id, blog.updated_at], 600 %} ... {% endcache %}
+# key可以是字符串，也可以是列表(比如模型的id和修改时间)，列表的各项用':'连接成最终的key
+# ttl是缓存的秒数，省略时使用存储对象的默认值
+# 第一次渲染时把块的输出保存起来，之后直接把保存的字符串拼接到页面中，不再执行块中的代码
+
+
+# 默认的存储：进程内的LRU缓存
+# 可以换成任何实现了get(key)和set(key, value, ttl)的对象(比如memcached或redis的包装)
+class MemoryStorage(object):
+    def __init__(self, maxsize=10000, default_ttl=300):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._items = OrderedDict()  # key -> (value, 过期时间)
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.time():
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._items.pop(key, None)
+        self._items[key] = (value, time.time() + (ttl if ttl is not None else self.default_ttl))
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+# 把模板中给出的key转化为字符串
+def make_key(key):
+    if isinstance(key, (list, tuple)):
+        return ':'.join(str(k) for k in key)
+    return str(key)
+
+
+class FragmentCacheExtension(Extension):
+    tags = set(['cache'])
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        # 存储对象保存在environment上，init_jinja2可以把它换成其他实现
+        environment.extend(fragment_cache_prefix='fragment:', fragment_cache=MemoryStorage())
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, key, ttl, caller):
+        key = self.environment.fragment_cache_prefix + make_key(key)
+        rv = self.environment.fragment_cache.get(key)
+        if rv is not None:
+            # 外部存储取回的是普通字符串，标记为安全的html，避免被再次转义
+            return Markup(rv)
+        rv = caller()
+        self.environment.fragment_cache.set(key, rv, ttl)
+        return rv
@@ -1,19 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import re, time, json, logging, hashlib, base64, asyncio
-
-# markdown2模块是一个支持markdown文本输入的模块，是Trent Mick写的开源模块，我们将其拷贝在本文件夹中，在这里调用
-import markdown2
+import re, time, json, logging, hashlib, hmac, base64, asyncio
 
 from aiohttp import web
 
 from coroweb import get, post
-from apis import APIValueError, APIResourceNotFoundError, APIError, APIPermissionError, Page
+from apis import APIValueError, APIResourceNotFoundError, APIError, APIPermissionError, Page, JSONStream, dumps, \
+    encode_cursor, decode_cursor
 
 from models import User, Comment, Blog, next_id
+from orm import execute
 from config import configs
+from sessions import SessionCache, SessionVersions
+from passwords import hash_password_async, verify_password_async
+from rendering import render_markdown, plain_text_html, plain_text_summary, text2html, RenderTimeout
 
+BLOG_EXTRAS = ['toc']  # 博客内容转换时生成目录(标题会带上id，目录链接到标题)
 COOKIE_NAME = 'awesession'  # cookie名，用于设置cookie
 _COOKIE_KEY = configs.session.secret  # cookie密钥，作为加密cookie的原始字符串的一部分
 
@@ -40,38 +43,69 @@ def get_page_index(page_str):
     return p
 
 
+# 计算cookie的签名：用session.secret作为密钥，对 用户id-失效时间-会话版本号 做HMAC-SHA256
+# 签名里不再包含密码，所以验证cookie不需要从数据库读取用户
+def _sign_session(uid, expires, version):
+    msg = '%s-%s-%s' % (uid, expires, version)
+    return hmac.new(_COOKIE_KEY.encode('utf-8'), msg.encode('utf-8'), hashlib.sha256).hexdigest()
+
 # 这个函数在day10中定义
 # 通过用户信息计算加密cookie
 def user2cookie(user, max_age):
     '''
     Generate cookie str by user.根据用户信息生成cookie
     '''
-    # build cookie string by: id-expires-sha1
-    # 根据id、过期日期、sha1值生成字符串
+    # build cookie string by: id-expires-version-hmac
+    # 根据id、过期日期、会话版本号、签名生成字符串
     # expires（失效时间）是当前时间加cookie最大存活时间的字符串
     expires = str(int(time.time() + max_age))
-    logging.info('计算加密cookie:expires:%s'%expires)
-    # 利用用户id，加密后的密码，失效时间，加上cookie密钥，组合成 待加密的原始字符串
-    s = '%s-%s-%s-%s' % (user.id, user.passwd, expires, _COOKIE_KEY)
-    logging.info('计算加密cookie:s:%s' % s)
-    # 生成加密的字符串，并于用户id，失效时间共同组成cookie
-    L = [user.id, expires, hashlib.sha1(s.encode('utf-8')).hexdigest()]
-    logging.info('计算加密cookie:L:%s' % L)
-    return '-'.join(L)
+    version = str(user.getValueOrDefault('session_version'))
+    return '-'.join([user.id, expires, version, _sign_session(user.id, expires, version)])
 
-# 这个函数在day11中被定义
-# 文本转html
-# 这个函数在get_blog()中被调用
-def text2html(text):
-    # 先用filter函数对输入的文本进行过滤处理，断行，去首尾空白字符
-    # 再用map函数对特殊符号进行转换，在将字符串装入html的<p>标签中
-    lines = map(lambda s: '<p>%s</p>' % s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'), filter(lambda s: s.strip() != '', text.split('\n')))
-    # lines是一个字符串列表，该字符串即表示html的段落
-    logging.info(lines)
-    return ''.join(lines)
+# 旧格式的cookie(id-expires-sha1)，sha1里包含了用户的密码，验证时必须读取用户
+# 只用于迁移：验证通过后auth_factory会换发新格式的cookie
+def is_legacy_cookie(cookie_str):
+    return cookie_str.count('-') == 2
+
+# 已验证cookie的进程内缓存，命中时不需要查询数据库
+session_cache = SessionCache(configs.session.cache_size, configs.session.cache_ttl, configs.session.negative_ttl)
+# 每个用户当前的会话版本号，懒刷新
+session_versions = SessionVersions(configs.session.cache_size, configs.session.version_ttl)
+
+# 用户的密码或管理员权限改变后必须调用，使该用户已缓存的cookie重新验证
+def invalidate_sessions(uid):
+    session_cache.invalidate_user(uid)
+
+# 修改users表中一个用户的字段，所有对用户的修改都通过这个函数，修改后当前进程中缓存的该用户立即失效
+@asyncio.coroutine
+def update_user(uid, **fields):
+    names = sorted(fields)
+    yield from execute('update `users` set %s where `id`=?' % ', '.join('`%s`=?' % n for n in names),
+                       [fields[n] for n in names] + [uid])
+    invalidate_sessions(uid)
+
+# 撤销用户所有已签发的cookie：数据库中的会话版本号加1
+# 当前进程立即生效，其他进程在session.version_ttl秒内生效
+@asyncio.coroutine
+def revoke_sessions(uid):
+    yield from execute('update `users` set `session_version`=`session_version`+1 where `id`=?', [uid])
+    session_versions.set(uid, (yield from User.findNumber('session_version', 'id=?', [uid])))
+    invalidate_sessions(uid)
+
+# 取得用户当前的会话版本号，内存中没有或已过期时才查询数据库
+@asyncio.coroutine
+def current_session_version(uid):
+    version = session_versions.get(uid)
+    if version is None:
+        version = yield from User.findNumber('session_version', 'id=?', [uid])
+        if version is not None:
+            session_versions.set(uid, version)
+    return version
 
 # 这个函数在day10中被定义
 # 解密cookie ,成功后返回 相应的用户(user)
+# 新格式的cookie只需要计算签名、比较内存中的版本号就能完成验证
+# 再查session_cache，命中时直接返回缓存的用户，不查询数据库
 @asyncio.coroutine
 def cookie2user(cookie_str):
     '''
@@ -79,13 +113,50 @@ def cookie2user(cookie_str):
     '''
     if not cookie_str:
         return None
+    if is_legacy_cookie(cookie_str):
+        return (yield from _legacy_cookie2user(cookie_str))
     try:
-        # 解密是加密的逆向过程，因此，先通过“-”拆分cookie，得到用户id，失效时间，以及加密字符串
-        L = cookie_str.split('-') # 返回一个str的list
-        # cookie应该是由三部分组成的，如果得到的不是三部分，则显然出错了
-        if len(L) != 3:
+        # 先通过“-”拆分cookie，得到用户id，失效时间，会话版本号以及签名
+        L = cookie_str.split('-')
+        if len(L) != 4:
             return None
-        uid, expires, sha1 = L
+        uid, expires, version, signature = L
+        # 如果过了失效时间，则cookie失效了
+        if int(expires) < time.time():
+            return None
+        # 签名不一致，说明cookie是伪造的或者被修改过
+        if not hmac.compare_digest(signature, _sign_session(uid, expires, version)):
+            logging.info('invalid session signature')
+            return None
+        # 版本号不一致，说明会话已被撤销
+        if int(version) != (yield from current_session_version(uid)):
+            return None
+        found, user = session_cache.get(cookie_str)
+        if found:
+            return user
+        user = yield from User.find(uid)
+        if user is None:
+            session_cache.put_invalid(cookie_str)
+            return None
+        # passwd是私有字段，输出JSON时由User的序列化器去掉(见orm.make_serializer)，不需要修改用户对象
+        session_cache.put(cookie_str, user, int(expires))
+        return user
+    except ValueError:
+        # 失效时间或版本号不是数字，cookie是伪造的
+        return None
+    except Exception as e:
+        logging.exception(e)
+        return None
+
+# 验证旧格式的cookie，验证结果同样缓存在session_cache中
+@asyncio.coroutine
+def _legacy_cookie2user(cookie_str):
+    found, user = session_cache.get(cookie_str)
+    if found:
+        return user
+    try:
+        # 解密是加密的逆向过程，因此，先通过“-”拆分cookie，得到用户id，失效时间，以及加密字符串
+        uid, expires, sha1 = cookie_str.split('-')
 
         # 如果过了失效时间，则cookie失效了
         if int(expires) < time.time():
@@ -94,6 +165,7 @@ def cookie2user(cookie_str):
         # 在数据库中查找用户信息, 如果不存在用户名，则也出错了
         user = yield from User.find(uid)
         if user is None:
+            session_cache.put_invalid(cookie_str)
             return None
 
         # 再用sha1处理得到的信息，与cookie里的sha1对象做对比
@@ -101,13 +173,20 @@ def cookie2user(cookie_str):
         # 如果不一致，则说明出错了
         if sha1 != hashlib.sha1(s.encode('utf-8')).hexdigest():
             logging.info('invalid sha1')
+            session_cache.put_invalid(cookie_str)
             return None
 
-        user.passwd = '******'
         # 验证cookie就是为了验证当前用户是否在登陆状态，从而使用户不必再进行登陆
         # 因此 返回用户信息即可
+        session_versions.set(uid, user.session_version)
+        session_cache.put(cookie_str, user, int(expires))
         return user
+    except ValueError:
+        # 失效时间不是数字，cookie是伪造的
+        session_cache.put_invalid(cookie_str)
+        return None
     except Exception as e:
+        # 数据库错误等临时性的错误不缓存
         logging.exception(e)
         return None
 
@@ -150,22 +229,35 @@ def index(*, page='1'):
 
 # day11定义
 # 页面：博客详情页
-@get('/blog/{id}')
+# 截止时间按整个请求计算：第一次访问旧博客时要先转换markdown(最多等markdown.timeout + 1秒，见rendering.py)，
+# 之后的数据库操作用的是剩下的时间，所以这个路由的预算比默认的deadline.default(10秒)多留一些
+@get('/blog/{id}', timeout=15.0)
 @asyncio.coroutine
 def get_blog(id, request):
     blog = yield from Blog.find(id)  # 通过id从数据库中拉去博客信息
-    # 从数据库拉取指定blog的全部评论，按时间降序排序，即最新的排在最前
-    comments = yield from Comment.findAll('blog_id=?', [id], orderBy='created_at desc')
-    # 将每条评论都转化成html格式
-    for c in comments:
-        c.html_content = text2html(c.content)
-    # blog也是markdown格式，将其转化成html格式
-    blog.html_content = markdown2.markdown(blog.content)
+    if blog is None:
+        raise APIResourceNotFoundError('Blog')
+    # 页面中只嵌入最新的一页评论，其余的在滚动到评论列表底部时通过/api/blogs/{id}/comments加载
+    comments, next_cursor = yield from find_comments_page(id)
+    # blog也是markdown格式，html和目录在保存博客时就已经生成并存入数据库，这里直接使用
+    # 旧的博客还没有html，第一次访问时生成并保存(连同目录和摘要)，以后就不用再转换了
+    # 转换超时的内容按纯文本显示，也不保存，等作者修改后重新生成
+    if blog.html_content is None:
+        try:
+            blog.html_content, blog.toc_html = yield from render_markdown(blog.content, extras=BLOG_EXTRAS)
+        except RenderTimeout:
+            logging.warning('markdown of blog %s took too long, showing plain text' % blog.id)
+            blog.html_content = plain_text_html(blog.content)
+        else:
+            blog.auto_summary = plain_text_summary(blog.html_content)
+            yield from execute('update `blogs` set `html_content`=?, `toc_html`=?, `auto_summary`=? where `id`=?',
+                               [blog.html_content, blog.toc_html, blog.auto_summary, blog.id])
     return {
         '__template__': 'blog.html',
         'blog': blog,
           '__user__':request.__user__,
-        'comments': comments
+        'comments': comments,
+        'next_cursor': next_cursor
     }
 
 
@@ -248,13 +340,13 @@ def manage_users(*, page='1'):  # 管理页面默认从1开始
 # ----------------------------------API 功能定义区---------------------------
 
 # API：获取用户信息
-@get('/api/users')
+# 用户可能有几万个，用iterAll逐批读取，再以JSONStream分块输出，不会把所有用户一次性读进内存
+# 截止时间也覆盖分块输出的时间(见apis.JSONStream)，客户端读得慢时也要来得及输出完，所以比默认的10秒多留一些
+@get('/api/users', timeout=30.0)
 async def api_get_users():
-    users = await User.findAll(orderBy="created_at desc")
-    for u in users:
-        u.passwd = "*****"
-    # 以dict形式返回,并且未指定__template__,将被app.py的response factory处理为json
-    return dict(users=users)
+    # passwd是私有字段，序列化时会被自动去掉，不需要再手动修改
+    # 输出格式仍然是 {"users": [...]}，将被app.py的response factory分块输出为json
+    return JSONStream('users', User.iterAll(orderBy="created_at desc"))
 
 
 # API:用户注册
@@ -292,14 +384,13 @@ def api_register_user(*, email, name, passwd):  # 注册信息包括用户名邮
 
     # 数据库无相应的email信息，说明是第一次注册
     uid = next_id()   # next_id是models函数里的用于生成一个基于时间的独一无二的id，作为数据库表中每一行的主键
-    sha1_passwd = '%s:%s' % (uid, passwd)  # 将用户id和密码组合
     # 创建用户对象，其中密码不是用户输入的密码
+    # 密码用的是pbkdf2/scrypt这样的慢哈希算法(见passwords.py)，在线程池中计算，不会阻塞事件循环
     # unicode格式的对象在进行哈希运算时必须先编码成utf8格式
-    # hashlib.sha1()表示计算一个字符串的sha1值
-    # hash.hexdigest()函数将hash对象转换成16进制表示的字符串
-    # 密码用的是sha1算法，而邮箱用的是md5算法
+    # 邮箱用的是md5算法
     # Gravatar是一项在全球范围内使用的头像服务，不过在中国好像被墙了
-    user = User(id=uid, name=name.strip(), email=email, passwd=hashlib.sha1(sha1_passwd.encode('utf-8')).hexdigest(), image='http://www.gravatar.com/avatar/%s?d=mm&s=120' % hashlib.md5(email.encode('utf-8')).hexdigest())
+    passwd_hash = yield from hash_password_async(passwd)
+    user = User(id=uid, name=name.strip(), email=email, passwd=passwd_hash, image='http://www.gravatar.com/avatar/%s?d=mm&s=120' % hashlib.md5(email.encode('utf-8')).hexdigest())
     yield from user.save()  # 将用户信息储存到数据库中
 
     # make session cookie:
@@ -311,11 +402,10 @@ def api_register_user(*, email, name, passwd):  # 注册信息包括用户名邮
     # max_age是cookie的最大存活周期,单位是秒.当时间结束时,客户端将抛弃该cookie.之后需要重新登录
     # 设置最大存活周琪是24小时
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
-    user.passwd = '******'  # 修改密码的外部显示为*
     # 设置content_type，将在data_factory中间件中继续处理
     r.content_type = 'application/json'
-    # json.dump方法将对象序列化为json格式
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    # dumps会去掉passwd等私有字段，再将对象序列化为json格式
+    r.body = dumps(user)
     return r
 
 
@@ -336,25 +426,53 @@ def authenticate(*, email, passwd):  # 通过邮箱与密码验证登陆
         raise APIValueError('email', 'Email not exist.')
     user = users[0] # 取得用户记录.事实上,就只有一条用户记录,只不过返回的是list
     # ----------------------------- 验证密码 -------------------------------
-    # 数据库中存储的并非原始的用户密码,而是加密的字符串
-    # 我们对此时用户输入的密码做相同的加密操作,将结果与数据库中储存的密码比较,来验证密码的正确性
-    # 以下步骤合成为一步就是:sha1 = hashlib.sha1((user.id+":"+passwd).encode("utf-8"))
-    # 对照用户注册时对原始密码的操作(见api_register_user),操作完全一样
-    sha1 = hashlib.sha1()
-    sha1.update(user.id.encode('utf-8'))
-    sha1.update(b':')
-    sha1.update(passwd.encode('utf-8'))
-    if user.passwd != sha1.hexdigest():
+    # 数据库中存储的并非原始的用户密码,而是慢哈希算法计算出的字符串
+    # 验证在线程池中进行(见passwords.py)，登录请求很多时也不会阻塞其他请求
+    ok, rehash = yield from verify_password_async(user.passwd, user.id, passwd)
+    if not ok:
         raise APIValueError('passwd', 'Invalid password.')
+    # 旧的sha1哈希或者参数已经过时的哈希，趁用户登录时用当前的算法和参数重新计算
+    if rehash:
+        user.passwd = yield from hash_password_async(passwd)
+        yield from update_user(user.id, passwd=user.passwd)
+        logging.info('upgraded password hash for user %s' % user.id)
     # 登录密码验证成功，设置cookie:
     # 与注册用户部分代码完全一样
     r = web.Response()
     r.set_cookie(COOKIE_NAME, user2cookie(user, 86400), max_age=86400, httponly=True)
-    user.passwd = '******'
     r.content_type = 'application/json'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf-8')
+    r.body = dumps(user)
     return r
 
+# API：设置或取消管理员权限，只有管理员可以调用，不能取消自己的权限
+# 权限改变后撤销该用户所有的cookie：其他进程中缓存的用户也会在session.version_ttl秒内失效，该用户需要重新登录
+@post('/api/users/{id}/admin')
+@asyncio.coroutine
+def api_set_user_admin(id, request, *, admin):
+    check_admin(request)
+    admin = admin in (True, 1, '1', 'true')
+    if id == request.__user__.id and not admin:
+        raise APIValueError('admin', 'cannot revoke your own admin rights.')
+    user = yield from User.find(id)
+    if user is None:
+        raise APIResourceNotFoundError('User')
+    yield from update_user(id, admin=admin)
+    yield from revoke_sessions(id)
+    return dict(id=id, admin=admin)
+
+# API：撤销用户在所有浏览器上的登录，管理员或用户本人可以调用
+# /signout只删除当前浏览器的cookie，这个接口使该用户已签发的所有cookie失效
+@post('/api/users/{id}/sessions/revoke')
+@asyncio.coroutine
+def api_revoke_user_sessions(id, request):
+    if request.__user__ is None or (request.__user__.id != id and not request.__user__.admin):
+        raise APIPermissionError()
+    user = yield from User.find(id)
+    if user is None:
+        raise APIResourceNotFoundError('User')
+    yield from revoke_sessions(id)
+    return dict(id=id)
+
 # 实现用户登出
 @get('/signout')
 def signout(request):
@@ -376,23 +494,33 @@ def api_get_blog(*, id):
     blog = yield from Blog.find(id)
     return blog
 
+# 保存博客时把markdown转换成html和目录，并从html中提取纯文本摘要，大的博客在进程池中转换(见rendering.py)
+# 转换超时说明内容有问题(比如让正则回溯很严重的输入)，拒绝保存
+async def render_blog_content(blog):
+    try:
+        blog.html_content, blog.toc_html = await render_markdown(blog.content, extras=BLOG_EXTRAS)
+    except RenderTimeout:
+        raise APIValueError('content', 'content is too complex to render.')
+    blog.auto_summary = plain_text_summary(blog.html_content)
+
+
 # day11定义
 # API：实现博客创建功能
 @post('/api/blogs')
 @asyncio.coroutine
-def api_create_blog(request, *, name, summary, content):
+def api_create_blog(request, *, name, content, summary=''):
     check_admin(request) # 检查用户权限
-    # 验证博客信息的合法性
+    # 验证博客信息的合法性，摘要可以不写，列表中显示从内容提取的摘要
     if not name or not name.strip():
         raise APIValueError('name', 'name cannot be empty.')
-    if not summary or not summary.strip():
-        raise APIValueError('summary', 'summary cannot be empty.')
     if not content or not content.strip():
         raise APIValueError('content', 'content cannot be empty.')
     logging.info('---------------------- get here -------------------------')
     # 创建博客对象
+    # markdown转换成的html、目录和摘要在这里生成一次，和content一起保存，博客详情页和列表直接使用
     blog = Blog(user_id=request.__user__.id, user_name=request.__user__.name, user_image=request.__user__.image,
-            name=name.strip(), summary=summary.strip(), content=content.strip())
+            name=name.strip(), summary=(summary or '').strip(), content=content.strip())
+    yield from render_blog_content(blog)
     yield from blog.save()  # 储存博客到数据库中
     return blog  # 返回博客信息
 
@@ -427,6 +555,37 @@ def api_comments(*, page='1'):
     comments = yield from Comment.findAll(orderBy='created_at desc', limit=(p.offset, p.limit))
     return dict(page=p, comments=comments)
 
+# 博客详情页和api每次返回的评论数
+COMMENTS_PAGE_SIZE = 20
+
+# 按(created_at, id)倒序读取一页评论，cursor为空时读取最新的一页(见apis.encode_cursor)
+# 多读一条用来判断后面还有没有评论，返回(评论列表, 下一页的游标)，没有下一页时游标为None
+@asyncio.coroutine
+def find_comments_page(blog_id, cursor=''):
+    where, args = 'blog_id=?', [blog_id]
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor)
+        where += ' and (created_at<? or (created_at=? and id<?))'
+        args.extend([created_at, created_at, comment_id])
+    comments = yield from Comment.findAll(where, args, orderBy='created_at desc, id desc',
+                                          limit=(0, COMMENTS_PAGE_SIZE + 1))
+    next_cursor = None
+    if len(comments) > COMMENTS_PAGE_SIZE:
+        comments = comments[:COMMENTS_PAGE_SIZE]
+        next_cursor = encode_cursor(comments[-1].created_at, comments[-1].id)
+    # 评论的html在保存时就已经生成，这里直接使用；还没有回填的旧评论(见backfill_comments.py)临时转换一次
+    for c in comments:
+        if c.html_content is None:
+            c.html_content = text2html(c.content)
+    return comments, next_cursor
+
+# API：获取一篇博客的评论，用游标分页，cursor是上一页返回的next_cursor
+@get('/api/blogs/{id}/comments')
+@asyncio.coroutine
+def api_blog_comments(id, *, cursor=''):
+    comments, next_cursor = yield from find_comments_page(id, cursor)
+    return dict(comments=comments, next_cursor=next_cursor)
+
 # day14定义
 # API：创建评论
 @post('/api/blogs/{id}/comments')
@@ -443,9 +602,13 @@ def api_create_comment(id, request, *, content):
     blog = yield from Blog.find(id)
     if blog is None:
         raise APIResourceNotFoundError('Blog')
-    # 创建评论对象
-    comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
+    # 创建评论对象，评论的html在这里生成一次，和评论一起保存，显示时直接使用
+    content = content.strip()
+    comment = Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content,
+                      html_content=text2html(content))
     yield from comment.save()  # 储存评论到数据库中
+    # 在数据库中原子地加1，不是读出来加1再写回，同时发表的评论不会互相覆盖
+    yield from execute('update `blogs` set `comment_count`=`comment_count`+1 where `id`=?', [blog.id])
     return comment  # 返回评论
 
 # day14定义
@@ -457,26 +620,29 @@ def api_delete_comments(id, request):
     c = yield from Comment.find(id)  # 从数据库中拉去评论
     if c is None:
         raise APIResourceNotFoundError('Comment')
-    yield from c.remove()  # 删除评论
+    # 删除评论，同一条评论被同时删除两次时只有真正删掉的那次减1
+    if (yield from c.remove()) == 1:
+        yield from execute('update `blogs` set `comment_count`=`comment_count`-1 where `id`=? and `comment_count`>0',
+                           [c.blog_id])
     return dict(id=id)  # 返回被删除评论的id
 
 # day14定义
 # API:修改博客
 @post('/api/blogs/{id}')
 @asyncio.coroutine
-def api_update_blog(id, request, *, name, summary, content):
+def api_update_blog(id, request, *, name, content, summary=''):
     check_admin(request)  # 检查用户权限
     blog = yield from Blog.find(id)  # 从数据库中拉去修改前的博客
     # 检查博客的合法性
     if not name or not name.strip():
         raise APIValueError('name', 'name cannot be empty.')
-    if not summary or not summary.strip():
-        raise APIValueError('summary', 'summary cannot be empty.')
     if not content or not content.strip():
         raise APIValueError('content', 'content cannot be empty.')
     blog.name = name.strip()
-    blog.summary = summary.strip()
+    blog.summary = (summary or '').strip()
     blog.content = content.strip()
+    yield from render_blog_content(blog)  # 内容变了，重新生成html、目录和摘要
+    blog.updated_at = time.time()  # 修改时间变了，模板中以它为key的片段缓存自然失效
     yield from blog.update()  # 更新博客
     return blog  # 返回博客信息
 
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Incremental Markdown rendering: only blocks that changed since the last save are converted again.
+'''
+
+import bisect, hashlib, os, re
+
+import markdown2
+from fragcache import MemoryStorage
+
+# 文档先对整篇执行一次markdown2转换的准备阶段(_prepare: 统一换行和tab、把原始html块和```代码块替换成占位符、
+# 提取链接定义和脚注定义)，然后按顶层块切分(段落、列表、引用、代码块等，块之间是空行)，每个块单独执行块级转换
+# 转换结果按 (块内容的hash, 整篇文档的链接定义, 块之前的脚注数) 缓存，修改博客的一段时，其他块直接用缓存
+# 跨块的内容:
+#     链接定义 [id]: url 和脚注定义 [^id]: ... 可以写在任何位置，在准备阶段提取，注入到每个块的转换中
+#     脚注的编号取决于它前面引用了多少个脚注，只有块中有[^时前面的脚注数才参与缓存的key
+#     header-ids的去重取决于前面的标题：块中的标题id先输出为占位符，拼接所有块时再按顺序去重、替换(见_unique_id)，
+#     所以修改一个标题不会使后面所有块的缓存失效
+#     脚注列表在所有块之后统一生成
+# 输出和对整篇文档调用markdown2.markdown()相同
+
+_list_item_re = re.compile(r'^[ ]{0,3}(?:[*+-]|\d+\.)[ \t]+')
+_quote_re = re.compile(r'^[ \t]*>')
+_fence_open_re = re.compile(r'^```[\w+-]*[ \t]*$')
+_fence_close_re = re.compile(r'^```[ \t]*$')
+_html_open_re = re.compile(r'<(%s)\b' % markdown2.Markdown._block_tags_a)
+# 块中标题id的占位符，数字是这个块中第几个标题id；带上随机前缀，文档中不会碰巧出现同样的字符串
+# 缓存只在本进程内，每个进程的前缀不同也没有关系
+_ID_PREFIX = '\x02%s-' % os.urandom(8).hex()
+_ID_MARK = _ID_PREFIX + '%d\x03'
+_id_mark_re = re.compile(re.escape(_ID_PREFIX) + '(\\d+)\x03')
+
+
+# 转换单个块的Markdown，reset时注入整篇文档准备阶段的结果和块之前的脚注数
+class _BlockMarkdown(markdown2.Markdown):
+    prepared = None  # 整篇文档的Markdown对象，已经执行过_prepare
+    footnotes_before = 0
+
+    def reset(self):
+        super(_BlockMarkdown, self).reset()
+        whole = self.prepared
+        if whole is None:
+            return
+        self.urls.update(whole.urls)
+        self.titles.update(whole.titles)
+        self.html_blocks.update(whole.html_blocks)
+        self.html_spans.update(whole.html_spans)
+        self._escape_table.update(whole._escape_table)  # 准备阶段转换```代码块时保存的代码
+        self._deadline = whole._deadline  # hardened的CPU时间预算对整篇文档计算
+        if "footnotes" in self.extras:
+            # 块中只需要知道哪些脚注有定义，脚注内容在所有块之后统一转换
+            # 脚注的编号是footnote_ids的长度，前面的脚注用None占位
+            self.footnotes = dict.fromkeys(whole.footnotes, '')
+            self.footnote_ids = [None] * self.footnotes_before
+        self._header_ids = []
+
+    # 返回占位符，去重前的id记在_header_ids中
+    def header_id_from_text(self, text, prefix, n):
+        self._count_from_header_id = {}
+        self._header_ids.append(super(_BlockMarkdown, self).header_id_from_text(text, prefix, n))
+        return _ID_MARK % (len(self._header_ids) - 1)
+
+    # 返回(html, 块中引用的脚注, 目录项, 去重前的标题id)，html和目录项中的标题id是占位符
+    def render(self, source, footnotes_before):
+        self.footnotes_before = footnotes_before
+        self.reset()
+        html = self._finish(self._run_block_gamut(source + '\n\n'))
+        footnote_ids = tuple(self.footnote_ids[footnotes_before:]) if "footnotes" in self.extras else ()
+        return html, footnote_ids, tuple(self._toc or ()), tuple(self._header_ids)
+
+
+# 把准备阶段之后的文档切分成可以独立转换的顶层块，返回字符串列表
+# 只在"空行之后、顶格开始的一行"处切分，并且以下情况不切分:
+#     在```代码块或跨越空行的html块中(准备阶段没有替换掉的，比如紧挨着另一个代码块的代码块)
+#     下一行是列表项，而当前块中有列表(松散列表的各项之间有空行)
+#     下一行是引用，而当前块中有引用(引用的各段之间可以有空行)
+#     下一行是>>>开头的python交互式会话(pyshell会把它缩进成代码块，和前面的代码块合并)
+def split_blocks(text):
+    lines = text.split('\n')
+    blocks = []
+    current = []
+    has_list = has_quote = False
+    blank_before = True
+    hold_until = -1  # html块结束的行号，在此之前不切分
+    ends = {}  # _html_block_end使用的行号索引
+    in_fence = False
+    for i, line in enumerate(lines):
+        if in_fence:
+            in_fence = not _fence_close_re.match(line)
+            current.append(line)
+            blank_before = not line
+            continue
+        if not line:
+            if current:
+                current.append(line)
+            blank_before = True
+            continue
+        if blank_before and i > hold_until and not line[0].isspace() and current \
+                and not (has_list and _list_item_re.match(line)) \
+                and not (has_quote and _quote_re.match(line)) and not line.startswith('>>>'):
+            blocks.append('\n'.join(current).rstrip('\n'))
+            current = []
+            has_list = has_quote = False
+        if blank_before and _fence_open_re.match(line):
+            in_fence = True
+        elif not line[0].isspace() and i > hold_until:
+            hold_until = _html_block_end(lines, i, ends)
+        if _list_item_re.match(line):
+            has_list = True
+        if _quote_re.match(line):
+            has_quote = True
+        current.append(line)
+        blank_before = False
+    if current:
+        blocks.append('\n'.join(current).rstrip('\n'))
+    return blocks
+
+
+# 第i行以块级html标签或注释开头时，返回它可能结束的行号(和markdown2中hash html块的正则一致)，否则返回-1
+# 每种结束标记出现在哪些行只查找一遍，保存在ends中，否则每个没有结束的<div>都要扫描到文档末尾
+def _html_block_end(lines, i, ends):
+    line = lines[i]
+    if line.startswith('<!--'):
+        found = _lines_with(lines, ends, ('-->',), lambda l: '-->' in l)
+        k = bisect.bisect_left(found, i)
+        return found[k] if k < len(found) else -1
+    m = _html_open_re.match(line)
+    if m is None:
+        return -1
+    end_tag = '</%s>' % m.group(1)
+    exact = _lines_with(lines, ends, (end_tag, True), lambda l: l.rstrip(' \t') == end_tag)
+    k = bisect.bisect_right(exact, i)
+    if k < len(exact):
+        return exact[k]
+    liberal = _lines_with(lines, ends, (end_tag, False), lambda l: l.rstrip(' \t').endswith(end_tag))
+    k = bisect.bisect_left(liberal, i)
+    return liberal[k] if k < len(liberal) else -1
+
+
+# 满足test的行号(升序)，按key缓存在ends中
+def _lines_with(lines, ends, key, test):
+    if key not in ends:
+        ends[key] = [j for j, line in enumerate(lines) if test(line)]
+    return ends[key]
+
+
+def _digest(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+# 和markdown2.Markdown.header_id_from_text相同的去重：第二个同名的id加上-2，第三个加上-3……
+def _unique_id(counts, header_id):
+    if header_id in counts:
+        counts[header_id] += 1
+        return '%s-%s' % (header_id, counts[header_id])
+    counts[header_id] = 1
+    return header_id
+
+
+class IncrementalRenderer(object):
+    '''
+    Markdown converter that caches rendered HTML per top-level block.
+    '''
+
+    def __init__(self, cache=None, **kw):
+        extras = kw.get('extras') or ()
+        if 'metadata' in extras or kw.get('use_file_vars'):
+            raise ValueError('metadata and file variables apply to the whole document')
+        self.cache = cache if cache is not None else MemoryStorage(maxsize=10000, default_ttl=86400)
+        self._whole = markdown2.Markdown(**kw)
+        self._block = _BlockMarkdown(**kw)
+        self.hits = 0
+        self.misses = 0
+
+    # 转换整篇文档，返回和markdown2.markdown()相同的UnicodeWithAttrs
+    def render(self, text):
+        whole = self._whole
+        whole.reset()
+        prepared = whole._prepare(text)
+        block = self._block
+        block.prepared = whole
+        footnote_ids = sorted(whole.footnotes) if "footnotes" in whole.extras else ()
+        defs = _digest(repr((sorted(whole.urls.items()), sorted(whole.titles.items()), footnote_ids)))
+
+        parts = []
+        toc = []
+        footnote_ids = []
+        counts = {}  # 标题id -> 出现的次数
+        # 空文档也要和markdown2的输出一致(一个空段落)
+        for source in split_blocks(prepared) or ['']:
+            before = len(footnote_ids) if "footnotes" in whole.extras and '[^' in source else 0
+            key = (self._digest_block(source), defs, before)
+            value = self.cache.get(key)
+            if value is None:
+                self.misses += 1
+                value = block.render(source, before)
+                self.cache.set(key, value)
+            else:
+                self.hits += 1
+            html, block_footnote_ids, block_toc, header_ids = value
+            footnote_ids.extend(block_footnote_ids)
+            if header_ids:
+                ids = [_unique_id(counts, header_id) for header_id in header_ids]
+                html = _id_mark_re.sub(lambda m: ids[int(m.group(1))], html)
+                block_toc = [(level, ids[int(_id_mark_re.match(mark).group(1))], name) for level, mark, name in block_toc]
+            if html:
+                parts.append(html)
+            toc.extend(block_toc)
+
+        text = '\n\n'.join(parts)
+        if "footnotes" in whole.extras:
+            whole.footnote_ids = footnote_ids
+            text += whole._finish(whole._add_footnotes(''))
+        rv = markdown2.UnicodeWithAttrs(text + '\n')
+        if "toc" in whole.extras:
+            rv._toc = toc or None
+        return rv
+
+    # 块中的占位符每次转换都不同(随机前缀加计数)，计算缓存的key时换回原来的html，这样key和哪次转换、哪个进程无关
+    def _digest_block(self, source):
+        whole = self._whole
+        for placeholders in (whole.html_blocks, whole.html_spans):
+            for key, html in placeholders.items():
+                if key in source:
+                    source = source.replace(key, whole._unescape_special_chars(html))
+        return _digest(source)
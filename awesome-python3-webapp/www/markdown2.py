@@ -43,6 +43,11 @@ see <https://github.com/trentm/python-markdown2/wiki/Extras> for details):
   syntax highlighting.
 * footnotes: Support footnotes as in use on daringfireball.net and
   implemented in other Markdown processors (tho not in Markdown.pl v1.0.1).
+* hardened: For untrusted input. Replaces the regexes that backtrack
+  badly on crafted text (emphasis, HTML tags and blocks, links) with
+  linear-time scanners and limits the nesting of blockquotes and lists.
+  The argument, if any, is a CPU time budget in seconds for one
+  conversion; past it `MarkdownBudgetError` is raised.
 * header-ids: Adds "id" attributes to headers. The id value is a slug of
   the header text.
 * html-classes: Takes a dict mapping html tag names (lowercase) to a
@@ -86,14 +91,15 @@ import os
 import sys
 from pprint import pprint, pformat
 import re
+import bisect
+import time
 import logging
-try:
-    from hashlib import md5
-except ImportError:
-    from md5 import md5
 import optparse
-from random import random, randint
+from random import random
 import codecs
+import hashlib
+import threading
+from collections import OrderedDict
 
 
 #---- Python version compat
@@ -131,14 +137,40 @@ log = logging.getLogger("markdown")
 
 DEFAULT_TAB_WIDTH = 4
 
+# "hardened" extra: deepest nesting of blockquotes, and of lists, that is
+# still converted. Each level runs the block gamut over its text again.
+HARDENED_MAX_NESTING = 8
+
+# The "hardened" extra's budget is CPU time of the converting thread, so
+# time spent waiting for the GIL or the CPU doesn't count against it.
+try:
+    _cpu_time = time.thread_time
+except AttributeError:  # Python < 3.7
+    _cpu_time = time.clock
+
+
+# Placeholders for hashed HTML blocks and spans, code and escaped
+# characters are a random prefix plus a counter: "tok-" + 16 random hex
+# digits + a 16 hex digit counter. They are all the same length, so no
+# placeholder is a prefix of another, and user text can't forge one
+# without knowing the prefix. `Markdown.reset()` picks a new prefix for
+# every conversion; the module-level table below has its own.
+def _new_token_prefix():
+    return "tok-" + "".join(["%02x" % b for b in bytearray(os.urandom(8))])
+
+def _token(prefix, n):
+    return "%s%016x" % (prefix, n)
 
-SECRET_SALT = bytes(randint(0, 1000000))
-def _hash_text(s):
-    return 'md5-' + md5(SECRET_SALT + s.encode("utf-8")).hexdigest()
+_g_token_prefix = _new_token_prefix()
 
-# Table of hash values for escaped characters:
-g_escape_table = dict([(ch, _hash_text(ch))
-    for ch in '\\`*_{}[]()>#+-.!'])
+# Table of placeholders for escaped characters:
+g_escape_table = dict([(ch, _token(_g_token_prefix, i))
+    for i, ch in enumerate('\\`*_{}[]()>#+-.!')])
+# Placeholders for quotes with the "smarty-pants" extra:
+g_smarty_pants_escape_table = {
+    '"': _token(_g_token_prefix, len(g_escape_table)),
+    "'": _token(_g_token_prefix, len(g_escape_table) + 1),
+}
 
 
 
@@ -147,6 +179,10 @@ g_escape_table = dict([(ch, _hash_text(ch))
 class MarkdownError(Exception):
     pass
 
+class MarkdownBudgetError(MarkdownError):
+    """The conversion used up the CPU budget of the "hardened" extra."""
+    pass
+
 
 
 #---- public api
@@ -166,10 +202,195 @@ def markdown_path(path, encoding="utf-8",
 def markdown(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
              safe_mode=None, extras=None, link_patterns=None,
              use_file_vars=False):
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    converter = acquire_converter(html4tags=html4tags, tab_width=tab_width,
+                                  safe_mode=safe_mode, extras=extras,
+                                  link_patterns=link_patterns,
+                                  use_file_vars=use_file_vars)
+    try:
+        return converter.convert(text)
+    finally:
+        release_converter(converter)
+
+# Idle converters, keyed by their constructor options. A converter is
+# only ever used by one caller at a time: `acquire_converter` pops it
+# from the idle list and `release_converter` puts it back. `convert()`
+# starts with `reset()`, so nothing leaks from one document to the next.
+MAX_IDLE_CONVERTERS = 4     # per set of options
+_idle_converters = {}
+_idle_converters_lock = threading.Lock()
+
+def _converter_key(html4tags, tab_width, safe_mode, extras, link_patterns,
+                   use_file_vars):
+    if extras is None:
+        extras_key = None
+    elif isinstance(extras, dict):
+        extras_key = tuple(sorted(extras.items()))
+    else:
+        extras_key = tuple(sorted(extras))
+    if link_patterns is not None:
+        link_patterns = tuple(tuple(p) for p in link_patterns)
+    key = (bool(html4tags), tab_width, safe_mode, extras_key, link_patterns,
+           bool(use_file_vars))
+    try:
+        hash(key)
+    except TypeError:
+        # e.g. a dict argument for the "html-classes" extra: don't pool
+        return None
+    return key
+
+def acquire_converter(html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
+                      safe_mode=None, extras=None, link_patterns=None,
+                      use_file_vars=False):
+    """Return a `Markdown` instance for these options, reusing an idle one
+    if possible. Hand it back with `release_converter()` when done.
+    """
+    key = _converter_key(html4tags, tab_width, safe_mode, extras,
+                         link_patterns, use_file_vars)
+    if key is not None:
+        with _idle_converters_lock:
+            idle = _idle_converters.get(key)
+            if idle:
+                return idle.pop()
+    converter = Markdown(html4tags=html4tags, tab_width=tab_width,
+                         safe_mode=safe_mode, extras=extras,
+                         link_patterns=link_patterns,
+                         use_file_vars=use_file_vars)
+    converter._pool_key = key
+    return converter
+
+def release_converter(converter):
+    """Return a converter obtained from `acquire_converter()` to the pool."""
+    key = getattr(converter, "_pool_key", None)
+    if key is None:
+        return
+    # Drop references to the last document before parking the converter.
+    converter.reset()
+    with _idle_converters_lock:
+        idle = _idle_converters.setdefault(key, [])
+        if len(idle) < MAX_IDLE_CONVERTERS:
+            idle.append(converter)
+
+# Syntax highlighted code blocks, shared by all conversions: pygments
+# output keyed by (lexer, formatter options, digest of the code). Lexing
+# and formatting is most of the time spent on a post with code, and most
+# conversions are of a post that was converted before with only a few
+# blocks changed. At most HIGHLIGHT_CACHE_SIZE characters of HTML are
+# kept; the least recently used blocks are dropped first.
+HIGHLIGHT_CACHE_SIZE = 4 * 1024 * 1024
+
+class _HighlightCache(object):
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.chars = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._items.get(key)
+            if html is not None:
+                self._items.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        if len(html) > self.max_chars:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.chars -= len(old)
+            self._items[key] = html
+            self.chars += len(html)
+            while self.chars > self.max_chars:
+                self.chars -= len(self._items.popitem(last=False)[1])
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.chars = 0
+
+_highlight_cache = _HighlightCache(HIGHLIGHT_CACHE_SIZE)
+
+# pygments is imported on first use, and lexers and formatters are looked
+# up once per name and set of options: `get_lexer_by_name` walks the
+# lexer table and building a formatter computes the style's CSS, which
+# takes longer than highlighting a short block. Lexer names come from the
+# documents, so only the first MAX_PYGMENTS_LOOKUPS are remembered.
+MAX_PYGMENTS_LOOKUPS = 256
+_pygments = None            # the module, or False if it isn't installed
+_pygments_lexers = {}       # lexer name -> lexer, or None if unknown
+_pygments_formatters = {}   # formatter options key -> formatter
+_HtmlCodeFormatter = None
+
+def _import_pygments():
+    global _pygments
+    if _pygments is None:
+        try:
+            import pygments
+            import pygments.formatters
+            import pygments.lexers
+            import pygments.util
+        except ImportError:
+            _pygments = False
+        else:
+            _pygments = pygments
+    return _pygments
+
+def _pygments_lexer(lexer_name):
+    try:
+        return _pygments_lexers[lexer_name]
+    except KeyError:
+        pass
+    pygments = _import_pygments()
+    if not pygments:
+        return None
+    try:
+        lexer = pygments.lexers.get_lexer_by_name(lexer_name)
+    except pygments.util.ClassNotFound:
+        lexer = None
+    if len(_pygments_lexers) < MAX_PYGMENTS_LOOKUPS:
+        _pygments_lexers[lexer_name] = lexer
+    return lexer
+
+def _html_code_formatter_class(pygments):
+    class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
+        def _wrap_code(self, inner):
+            """A function for use in a Pygments Formatter which
+            wraps in <code> tags.
+            """
+            yield 0, "<code>"
+            for tup in inner:
+                yield tup
+            yield 0, "</code>"
+
+        def wrap(self, source, outfile=None):
+            """Return the source with a code, pre, and div. Pygments
+            2.12 and later call `wrap(source)` and add the div themselves.
+            """
+            source = self._wrap_pre(self._wrap_code(source))
+            if outfile is None:
+                return source
+            return self._wrap_div(source)
+    return HtmlCodeFormatter
+
+def _formatter_key(formatter_opts):
+    return repr(sorted(formatter_opts.items()))
+
+def _pygments_formatter(formatter_opts):
+    global _HtmlCodeFormatter
+    key = _formatter_key(formatter_opts)
+    formatter = _pygments_formatters.get(key)
+    if formatter is None:
+        if _HtmlCodeFormatter is None:
+            _HtmlCodeFormatter = _html_code_formatter_class(_import_pygments())
+        formatter = _HtmlCodeFormatter(**formatter_opts)
+        if len(_pygments_formatters) < MAX_PYGMENTS_LOOKUPS:
+            _pygments_formatters[key] = formatter
+    return formatter
+
+def _highlight_key(codeblock, lexer, formatter_opts):
+    digest = hashlib.sha1(codeblock.encode("utf-8")).hexdigest()
+    return (type(lexer), _formatter_key(formatter_opts), digest)
 
 class Markdown(object):
     # The dict of "extras" to enable in processing -- a mapping of
@@ -189,6 +410,11 @@ class Markdown(object):
     # Used to track when we're inside an ordered or unordered list
     # (see _ProcessListItems() for details):
     list_level = 0
+    # Nesting depth of blockquotes, limited by the "hardened" extra.
+    _quote_level = 0
+    # CPU time (`_cpu_time()`) at which the "hardened" extra's budget is
+    # used up, or None.
+    _deadline = None
 
     _ws_only_line_re = re.compile(r"^[ \t]+$", re.M)
 
@@ -224,12 +450,12 @@ class Markdown(object):
 
         self.link_patterns = link_patterns
         self.use_file_vars = use_file_vars
-        self._outdent_re = re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+        self._outdent_re = _outdent_re_from_tab_width(tab_width)
 
-        self._escape_table = g_escape_table.copy()
+        self._base_escape_table = g_escape_table.copy()
         if "smarty-pants" in self.extras:
-            self._escape_table['"'] = _hash_text('"')
-            self._escape_table["'"] = _hash_text("'")
+            self._base_escape_table.update(g_smarty_pants_escape_table)
+        self._escape_table = self._base_escape_table.copy()
 
     def reset(self):
         self.urls = {}
@@ -237,7 +463,16 @@ class Markdown(object):
         self.html_blocks = {}
         self.html_spans = {}
         self.list_level = 0
+        self._quote_level = 0
         self.extras = self._instance_extras.copy()
+        self._deadline = None
+        if self.extras.get("hardened"):
+            self._deadline = _cpu_time() + self.extras["hardened"]
+        # `_encode_code` adds an entry per code span; start from the
+        # fixed table again so a reused converter doesn't keep them all.
+        self._escape_table = self._base_escape_table.copy()
+        self._token_prefix = _new_token_prefix()
+        self._token_count = 0
         if "footnotes" in self.extras:
             self.footnotes = {}
             self.footnote_ids = []
@@ -245,6 +480,25 @@ class Markdown(object):
             self._count_from_header_id = {} # no `defaultdict` in Python 2.4
         if "metadata" in self.extras:
             self.metadata = {}
+        self._toc = None
+        self._last_li_endswith_two_eols = False
+        # Highlighted code blocks of this conversion, see
+        # `_highlight_fenced_code_blocks()`.
+        self._highlighted = {}
+
+    def _new_token(self):
+        """Return a placeholder that is unique within this conversion."""
+        self._token_count += 1
+        return _token(self._token_prefix, self._token_count)
+
+    def _check_budget(self):
+        """Raise MarkdownBudgetError once the CPU budget of the "hardened"
+        extra is used up. Called from the gamuts and from the loops that
+        run long on crafted input.
+        """
+        if self._deadline is not None and _cpu_time() > self._deadline:
+            raise MarkdownBudgetError("conversion used more than %ss of CPU time"
+                                      % self.extras["hardened"])
 
     # Per <https://developer.mozilla.org/en-US/docs/HTML/Element/a> "rel"
     # should only be used in <a> tags with an "href" attribute.
@@ -262,7 +516,28 @@ class Markdown(object):
         # one article (e.g. an index page that shows the N most recent
         # articles):
         self.reset()
+        text = self._prepare(text)
 
+        text = self._run_block_gamut(text)
+
+        if "footnotes" in self.extras:
+            text = self._add_footnotes(text)
+
+        text = self._finish(text)
+
+        text += "\n"
+
+        rv = UnicodeWithAttrs(text)
+        if "toc" in self.extras:
+            rv._toc = self._toc
+        if "metadata" in self.extras:
+            rv.metadata = self.metadata
+        return rv
+
+    def _prepare(self, text):
+        """Everything `convert` does before the block gamut: normalize the
+        text, hash raw HTML blocks and strip link and footnote definitions.
+        """
         if not isinstance(text, unicode):
             #TODO: perhaps shouldn't presume UTF-8 for string input?
             text = unicode(text, 'utf-8')
@@ -324,11 +599,10 @@ class Markdown(object):
             text = self._strip_footnote_definitions(text)
         text = self._strip_link_definitions(text)
 
-        text = self._run_block_gamut(text)
-
-        if "footnotes" in self.extras:
-            text = self._add_footnotes(text)
+        return text
 
+    def _finish(self, text):
+        """Everything `convert` does after the block gamut and footnotes."""
         text = self.postprocess(text)
 
         text = self._unescape_special_chars(text)
@@ -337,16 +611,12 @@ class Markdown(object):
             text = self._unhash_html_spans(text)
 
         if "nofollow" in self.extras:
-            text = self._a_nofollow.sub(r'<\1 rel="nofollow"\2', text)
-
-        text += "\n"
+            if "hardened" in self.extras:
+                text = _hardened_add_nofollow(text)
+            else:
+                text = self._a_nofollow.sub(r'<\1 rel="nofollow"\2', text)
 
-        rv = UnicodeWithAttrs(text)
-        if "toc" in self.extras:
-            rv._toc = self._toc
-        if "metadata" in self.extras:
-            rv.metadata = self.metadata
-        return rv
+        return text
 
     def postprocess(self, text):
         """A hook for subclasses to do some postprocessing of the html, if
@@ -525,6 +795,12 @@ class Markdown(object):
         """
         if '\t' not in text:
             return text
+        if '\r' not in text:
+            # Same result: `_detab_re` expands each tab to the next multiple
+            # of tab_width counted from the line start. The regex retries
+            # `(.*?)` from every position of a line with no tab left, which
+            # is quadratic in the length of that line.
+            return text.expandtabs(self.tab_width)
         return self._detab_re.subn(self._detab_sub, text)[0]
 
     # I broke out the html5 tags here and add them to _block_tags_a and
@@ -566,7 +842,9 @@ class Markdown(object):
     _html_markdown_attr_re = re.compile(
         r'''\s+markdown=("1"|'1')''')
     def _hash_html_block_sub(self, match, raw=False):
-        html = match.group(1)
+        return self._hash_html_block(match.group(1), raw)
+
+    def _hash_html_block(self, html, raw=False):
         if raw and self.safe_mode:
             html = self._sanitize_html(html)
         elif 'markdown-in-html' in self.extras and 'markdown=' in html:
@@ -577,14 +855,14 @@ class Markdown(object):
                 middle = '\n'.join(lines[1:-1])
                 last_line = lines[-1]
                 first_line = first_line[:m.start()] + first_line[m.end():]
-                f_key = _hash_text(first_line)
+                f_key = self._new_token()
                 self.html_blocks[f_key] = first_line
-                l_key = _hash_text(last_line)
+                l_key = self._new_token()
                 self.html_blocks[l_key] = last_line
                 return ''.join(["\n\n", f_key,
                     "\n\n", middle, "\n\n",
                     l_key, "\n\n"])
-        key = _hash_text(html)
+        key = self._new_token()
         self.html_blocks[key] = html
         return "\n\n" + key + "\n\n"
 
@@ -615,10 +893,16 @@ class Markdown(object):
         # the inner nested divs must be indented.
         # We need to do this before the next, more liberal match, because the next
         # match will start at the first `<div>` and stop at the first `</div>`.
-        text = self._strict_tag_block_re.sub(hash_html_block_sub, text)
+        if "hardened" in self.extras:
+            text = self._hash_tag_blocks(text, raw, liberal=False)
+        else:
+            text = self._strict_tag_block_re.sub(hash_html_block_sub, text)
 
         # Now match more liberally, simply from `\n<tag>` to `</tag>\n`
-        text = self._liberal_tag_block_re.sub(hash_html_block_sub, text)
+        if "hardened" in self.extras:
+            text = self._hash_tag_blocks(text, raw, liberal=True)
+        else:
+            text = self._liberal_tag_block_re.sub(hash_html_block_sub, text)
 
         # Special case just for <hr />. It was easier to make a special
         # case than to make the other regex more complicated.
@@ -630,6 +914,7 @@ class Markdown(object):
         if "<!--" in text:
             start = 0
             while True:
+                self._check_budget()
                 # Delimiters for next comment block.
                 try:
                     start_idx = text.index("<!--", start)
@@ -677,7 +962,7 @@ class Markdown(object):
                 html = text[start_idx:end_idx]
                 if raw and self.safe_mode:
                     html = self._sanitize_html(html)
-                key = _hash_text(html)
+                key = self._new_token()
                 self.html_blocks[key] = html
                 text = text[:start_idx] + "\n\n" + key + "\n\n" + text[end_idx:]
 
@@ -694,31 +979,73 @@ class Markdown(object):
 
         return text
 
+    _strict_tag_block_start_re = re.compile(r"^<(%s)\b" % _block_tags_a, re.M)
+    _strict_tag_block_end_re = re.compile(r"^</(%s)>[ \t]*(?=\n|\Z)"
+                                          % _block_tags_a, re.M)
+    _liberal_tag_block_start_re = re.compile(r"^<(%s)\b" % _block_tags_b, re.M)
+    _liberal_tag_block_end_re = re.compile(r"</(%s)>[ \t]*(?=\n|\Z)"
+                                           % _block_tags_b)
+    _tag_block_tail_re = re.compile(r"[ \t]*(?=\n|\Z)")
+
+    def _hash_tag_blocks(self, text, raw, liberal):
+        """Does `_strict_tag_block_re.sub()` (or `_liberal_tag_block_re`)
+        for the "hardened" extra.
+        The regexes retry `(.*\n)*?` from every opening tag to the end of
+        the text when the closing tag is missing, which is quadratic for
+        e.g. "<div>\n" * n. Here all closing tags are found in one pass
+        and each opening tag looks up the first one that the regex would
+        have matched.
+        """
+        if liberal:
+            start_re = self._liberal_tag_block_start_re
+            end_re = self._liberal_tag_block_end_re
+        else:
+            start_re = self._strict_tag_block_start_re
+            end_re = self._strict_tag_block_end_re
+        # tag -> sorted start positions of the closing tags and the end
+        # positions of their matches.
+        ends = {}
+        for match in end_re.finditer(text):
+            starts, stops = ends.setdefault(match.group(1), ([], []))
+            starts.append(match.start())
+            stops.append(match.end())
+
+        chunks = []
+        pos = 0
+        for match in start_re.finditer(text):
+            start, tag = match.start(), match.group(1)
+            if start < pos or tag not in ends:
+                continue
+            starts, stops = ends[tag]
+            stop = None
+            if liberal:
+                # `.*</tag>` may close the block on its first line.
+                i = bisect.bisect_left(starts, match.end())
+            else:
+                close = "</%s>" % tag
+                if text.startswith(close, match.end()):
+                    # "<tag</tag>": no lines in between.
+                    m = self._tag_block_tail_re.match(text, match.end() + len(close))
+                    if m:
+                        stop = m.end()
+                nl = text.find("\n", match.end())
+                i = bisect.bisect_left(starts, nl + 1) if nl != -1 else len(starts)
+            if stop is None and i < len(starts):
+                stop = stops[i]
+            if stop is None:
+                continue
+            chunks.append(text[pos:start])
+            chunks.append(self._hash_html_block(text[start:stop], raw))
+            pos = stop
+        if not chunks:
+            return text
+        chunks.append(text[pos:])
+        return "".join(chunks)
+
     def _strip_link_definitions(self, text):
         # Strips link definitions from text, stores the URLs and titles in
         # hash references.
-        less_than_tab = self.tab_width - 1
-
-        # Link defs are in the form:
-        #   [id]: url "optional title"
-        _link_def_re = re.compile(r"""
-            ^[ ]{0,%d}\[(.+)\]: # id = \1
-              [ \t]*
-              \n?               # maybe *one* newline
-              [ \t]*
-            <?(.+?)>?           # url = \2
-              [ \t]*
-            (?:
-                \n?             # maybe one newline
-                [ \t]*
-                (?<=\s)         # lookbehind for whitespace
-                ['"(]
-                ([^\n]*)        # title = \3
-                ['")]
-                [ \t]*
-            )?  # title is optional
-            (?:\n+|\Z)
-            """ % less_than_tab, re.X | re.M | re.U)
+        _link_def_re = _link_def_re_from_tab_width(self.tab_width)
         return _link_def_re.sub(self._extract_link_def_sub, text)
 
     def _extract_link_def_sub(self, match):
@@ -749,22 +1076,7 @@ class Markdown(object):
             [^note-id]:
                 Text of the note.
         """
-        less_than_tab = self.tab_width - 1
-        footnote_def_re = re.compile(r'''
-            ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
-            [ \t]*
-            (                       # footnote text = \2
-              # First line need not start with the spaces.
-              (?:\s*.*\n+)
-              (?:
-                (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
-                .*\n+
-              )*
-            )
-            # Lookahead for non-space at line-start, or end of doc.
-            (?:(?=^[ ]{0,%d}\S)|\Z)
-            ''' % (less_than_tab, self.tab_width, self.tab_width),
-            re.X | re.M)
+        footnote_def_re = _footnote_def_re_from_tab_width(self.tab_width)
         return footnote_def_re.sub(self._extract_footnote_def_sub, text)
 
     _hr_re = re.compile(r'^[ ]{0,3}([-_*][ ]{0,2}){3,}$', re.M)
@@ -772,6 +1084,7 @@ class Markdown(object):
     def _run_block_gamut(self, text):
         # These are all the transformations that form block-level
         # tags like paragraphs, headers, and list items.
+        self._check_budget()
 
         if "fenced-code-blocks" in self.extras:
             text = self._do_fenced_code_blocks(text)
@@ -825,13 +1138,7 @@ class Markdown(object):
         if ">>>" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        _pyshell_block_re = re.compile(r"""
-            ^([ ]{0,%d})>>>[ ].*\n   # first line
-            ^(\1.*\S+.*\n)*         # any number of subsequent lines
-            ^\n                     # ends with a blank line
-            """ % less_than_tab, re.M | re.X)
-
+        _pyshell_block_re = _pyshell_block_re_from_tab_width(self.tab_width)
         return _pyshell_block_re.sub(self._pyshell_block_sub, text)
 
     def _table_sub(self, match):
@@ -879,26 +1186,7 @@ class Markdown(object):
         """Copying PHP-Markdown and GFM table syntax. Some regex borrowed from
         https://github.com/michelf/php-markdown/blob/lib/Michelf/Markdown.php#L2538
         """
-        less_than_tab = self.tab_width - 1
-        table_re = re.compile(r'''
-                (?:(?<=\n\n)|\A\n?)             # leading blank line
-                ^[ ]{0,%d}                      # allowed whitespace
-                (.*[|].*)  \n                   # $1: header row (at least one pipe)
-                ^[ ]{0,%d}                      # allowed whitespace
-                (                               # $2: underline row
-                    # underline row with leading bar
-                    (?:  \|\ *:?-+:?\ *  )+  \|?  \n
-                    |
-                    # or, underline row without leading bar
-                    (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
-                )
-                (                               # $3: data rows
-                    (?:
-                        ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
-                        .*\|.*  \n
-                    )+
-                )
-            ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+        table_re = _table_re_from_tab_width(self.tab_width)
         return table_re.sub(self._table_sub, text)
 
     def _wiki_table_sub(self, match):
@@ -927,17 +1215,13 @@ class Markdown(object):
         if "||" not in text:
             return text
 
-        less_than_tab = self.tab_width - 1
-        wiki_table_re = re.compile(r'''
-            (?:(?<=\n\n)|\A\n?)            # leading blank line
-            ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
-            (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
-            ''' % less_than_tab, re.M | re.X)
+        wiki_table_re = _wiki_table_re_from_tab_width(self.tab_width)
         return wiki_table_re.sub(self._wiki_table_sub, text)
 
     def _run_span_gamut(self, text):
         # These are all the transformations that occur *within* block-level
         # tags like paragraphs, headers, and list items.
+        self._check_budget()
 
         text = self._do_code_spans(text)
 
@@ -963,12 +1247,18 @@ class Markdown(object):
 
         # Do hard breaks:
         if "break-on-newline" in self.extras:
-            text = re.sub(r" *\n", "<br%s\n" % self.empty_element_suffix, text)
+            text = self._break_on_newline_re.sub("<br%s\n" % self.empty_element_suffix, text)
         else:
-            text = re.sub(r" {2,}\n", " <br%s\n" % self.empty_element_suffix, text)
+            text = self._hard_break_re.sub(" <br%s\n" % self.empty_element_suffix, text)
 
         return text
 
+    # Same matches as r" *\n" and r" {2,}\n", but only tried from the start
+    # of a run of spaces: retrying from every space in the run is quadratic
+    # in its length (e.g. deeply indented lines).
+    _break_on_newline_re = re.compile(r"(?<! ) *\n")
+    _hard_break_re = re.compile(r"(?<! ) {2,}\n")
+
     # "Sorta" because auto-links are identified as "tag" tokens.
     _sorta_html_tokenize_re = re.compile(r"""
         (
@@ -987,6 +1277,14 @@ class Markdown(object):
         )
         """, re.X)
 
+    def _tokenize_html(self, text):
+        """Split `text` into alternating text and HTML tokens, see
+        `_sorta_html_tokenize_re`.
+        """
+        if "hardened" in self.extras:
+            return _split_html_tokens(text)
+        return self._sorta_html_tokenize_re.split(text)
+
     def _escape_special_chars(self, text):
         # Python markdown note: the HTML tokenization here differs from
         # that in Markdown.pl, hence the behaviour for subtle cases can
@@ -996,7 +1294,7 @@ class Markdown(object):
         # here.
         escaped = []
         is_html_markup = False
-        for token in self._sorta_html_tokenize_re.split(text):
+        for token in self._tokenize_html(text):
             if is_html_markup:
                 # Within tags/HTML-comments/auto-links, encode * and _
                 # so they don't conflict with their use in Markdown for
@@ -1023,10 +1321,10 @@ class Markdown(object):
 
         tokens = []
         is_html_markup = False
-        for token in self._sorta_html_tokenize_re.split(text):
+        for token in self._tokenize_html(text):
             if is_html_markup and not _is_auto_link(token):
                 sanitized = self._sanitize_html(token)
-                key = _hash_text(sanitized)
+                key = self._new_token()
                 self.html_spans[key] = sanitized
                 tokens.append(key)
             else:
@@ -1127,6 +1425,9 @@ class Markdown(object):
         Markdown.pl because of the lack of atomic matching support in
         Python's regex engine used in $g_nested_brackets.
         """
+        if "hardened" in self.extras:
+            return self._do_links_hardened(text)
+
         MAX_LINK_TEXT_SENTINEL = 3000  # markdown2 issue 24
 
         # `anchor_allowed_pos` is used to support img links inside
@@ -1304,6 +1605,159 @@ class Markdown(object):
 
         return text
 
+    _title_start_re = re.compile(r'''(?<![ \t])[ \t]+(['"])''')
+
+    def _extract_url_and_title_hardened(self, text, start, find_balanced):
+        """`_extract_url_and_title()` for `_do_links_hardened()`.
+        `_inline_link_title` retries its lazy title from every space up to
+        the closing ')'. That ')' is known here, so only the title's
+        opening quote is searched for.
+        """
+        idx = self._find_non_whitespace(text, start+1)
+        if idx == len(text):
+            return None, None, None
+        end_idx = idx
+        has_anglebrackets = text[idx] == "<"
+        if has_anglebrackets:
+            end_idx = find_balanced(end_idx+1, "<", ">") or len(text)
+        end_idx = find_balanced(end_idx, "(", ")") or len(text)
+        # `\)$`: the last character, or the one before a final newline.
+        if text[end_idx-1:end_idx] == ")":
+            close = end_idx - 1
+        elif text[end_idx-2:end_idx] == ")\n":
+            close = end_idx - 2
+        else:
+            return None, None, None
+        url, title = text[idx:close], None
+        for match in self._title_start_re.finditer(text, idx, close - 1):
+            if match.group(1) == text[close-1]:
+                url, title = text[idx:match.start()], text[match.end():close-1]
+                break
+        if has_anglebrackets:
+            url = self._strip_anglebrackets.sub(r'\1', url)
+        return url, title, end_idx
+
+    def _do_links_hardened(self, text, anchor_allowed=True):
+        """`_do_links()` for the "hardened" extra.
+        `_do_links()` looks for the closing ']' and ')' by scanning from
+        every '[' (to the end of the text if there is no ')') and splices
+        each link into the text, which is quadratic for e.g. "[a](" * n.
+        Here the closing brackets are looked up in `_BalanceIndex` tables
+        built once per text, the result is collected in a list and the
+        text of an anchor is converted separately, for images only.
+        """
+        MAX_LINK_TEXT_SENTINEL = 3000  # markdown2 issue 24
+
+        indexes = {}
+        def find_balanced(start, open_c, close_c):
+            if open_c not in indexes:
+                indexes[open_c] = _BalanceIndex(text, open_c, close_c)
+            return indexes[open_c].find(start)
+
+        chunks = []
+        pos = 0  # text[:pos] is in `chunks`
+        curr_pos = 0
+        text_length = len(text)
+        while True:
+            self._check_budget()
+            start_idx = text.find('[', curr_pos)
+            if start_idx == -1:
+                break
+            # Find the matching closing ']', see `_do_links()`.
+            p = find_balanced(start_idx+1, '[', ']')
+            if p is None or p > start_idx + MAX_LINK_TEXT_SENTINEL:
+                curr_pos = start_idx + 1
+                continue
+            p -= 1
+            link_text = text[start_idx+1:p]
+
+            # Possibly a footnote ref?
+            if "footnotes" in self.extras and link_text.startswith("^"):
+                normed_id = re.sub(r'\W', '-', link_text[1:])
+                if normed_id in self.footnotes:
+                    self.footnote_ids.append(normed_id)
+                    result = '<sup class="footnote-ref" id="fnref-%s">' \
+                             '<a href="#fn-%s">%s</a></sup>' \
+                             % (normed_id, normed_id, len(self.footnote_ids))
+                    chunks.extend([text[pos:start_idx], result])
+                    pos = p+1
+                curr_pos = p+1
+                continue
+
+            # Now determine what this is by the remainder.
+            p += 1
+            if p == text_length:
+                if anchor_allowed:
+                    break
+                # The text of an anchor, followed by "</a>".
+                curr_pos = start_idx + 1
+                continue
+
+            if text[p] == '(':
+                # Inline anchor or img.
+                url, title, url_end_idx = self._extract_url_and_title_hardened(
+                    text, p, find_balanced)
+                if url is None:
+                    curr_pos = start_idx + 1
+                    continue
+                img_alt = _xml_escape_attr(link_text)
+            else:
+                # Reference anchor or img.
+                match = self._tail_of_reference_link_re.match(text, p)
+                if not match:
+                    curr_pos = start_idx + 1
+                    continue
+                link_id = match.group("id").lower()
+                if not link_id:
+                    link_id = link_text.lower()  # for links like [this][]
+                if link_id not in self.urls:
+                    # This id isn't defined, leave the markup alone.
+                    curr_pos = match.end()
+                    continue
+                url, title = self.urls[link_id], self.titles.get(link_id)
+                url_end_idx = match.end()
+                img_alt = link_text.replace('"', '&quot;')
+
+            is_img = start_idx > 0 and text[start_idx-1] == "!"
+            if not is_img and not anchor_allowed:
+                curr_pos = start_idx + 1
+                continue
+            if is_img:
+                start_idx -= 1
+            # We've got to encode these to avoid conflicting
+            # with italics/bold.
+            url = url.replace('*', self._escape_table['*']) \
+                     .replace('_', self._escape_table['_'])
+            if title:
+                title_str = ' title="%s"' % (
+                    _xml_escape_attr(title)
+                        .replace('*', self._escape_table['*'])
+                        .replace('_', self._escape_table['_']))
+            else:
+                title_str = ''
+            if is_img:
+                img_class_str = self._html_class_str_from_tag("img")
+                result = '<img src="%s" alt="%s"%s%s%s' \
+                    % (url.replace('"', '&quot;'), img_alt,
+                       title_str, img_class_str, self.empty_element_suffix)
+                if "smarty-pants" in self.extras:
+                    result = result.replace('"', self._escape_table['"'])
+                chunks.extend([text[pos:start_idx], result])
+            else:
+                result_head = '<a href="%s"%s>' % (url, title_str)
+                if "smarty-pants" in self.extras:
+                    result_head = result_head.replace('"', self._escape_table['"'])
+                    link_text = link_text.replace('"', self._escape_table['"'])
+                # <img> allowed in the link text, <a> not.
+                chunks.extend([text[pos:start_idx], result_head,
+                               self._do_links_hardened(link_text, False), '</a>'])
+            pos = curr_pos = url_end_idx
+
+        if not chunks:
+            return text
+        chunks.append(text[pos:])
+        return ''.join(chunks)
+
     def header_id_from_text(self, text, prefix, n):
         """Generate a header id attribute value from the given header
         HTML content.
@@ -1358,7 +1812,9 @@ class Markdown(object):
             # atx header
             n = len(match.group(5))
             header_group = match.group(6)
+        return self._h(n, header_group)
 
+    def _h(self, n, header_group):
         demote_headers = self.extras.get("demote-headers")
         if demote_headers:
             n = min(n + demote_headers, 6)
@@ -1388,10 +1844,91 @@ class Markdown(object):
         #   ...
         #   ###### Header 6
 
+        if "hardened" in self.extras:
+            return self._do_headers_hardened(text)
         if 'tag-friendly' in self.extras:
             return self._h_re_tag_friendly.sub(self._h_sub, text)
         return self._h_re.sub(self._h_sub, text)
 
+    _setext_underline_re = re.compile(r'(=+|-+)[ \t]*\n+')
+
+    def _do_headers_hardened(self, text):
+        """`_do_headers()` for the "hardened" extra.
+        `_h_re` backtracks over runs of spaces and '#'s: the setext `(.+)`
+        over trailing spaces, the atx `(.+?)` retries the closing
+        `[ \t]*\#*` from every position. That is quadratic in the length
+        of a line like "#" * n + " a". This finds the same headers line by
+        line, working out where the regex's groups would end.
+        """
+        tag_friendly = 'tag-friendly' in self.extras
+        chunks = []
+        pos = 0  # text[:pos] is in `chunks`
+        i = 0    # start of the current line
+        while True:
+            eol = text.find('\n', i)
+            if eol == -1:
+                break
+            header = None
+            if eol > i:
+                # Setext: any line, then a line of '='s or '-'s.
+                match = self._setext_underline_re.match(text, eol + 1)
+                if match:
+                    n = {"=": 1, "-": 2}[match.group(1)[0]]
+                    header = n, text[i:eol], match.end()
+                elif text[i] == '#':
+                    header = self._atx_header(text, i, eol, tag_friendly)
+            if header is None:
+                i = eol + 1
+                continue
+            n, header_group, end = header
+            chunks.extend([text[pos:i], self._h(n, header_group)])
+            pos = i = end
+        if not chunks:
+            return text
+        chunks.append(text[pos:])
+        return ''.join(chunks)
+
+    def _atx_header(self, text, i, eol, tag_friendly):
+        """The level, text and match end of the atx header `_h_re` finds
+        at line text[i:eol], or None.
+        """
+        if text[eol-1] == '\\':
+            return None  # `(?<!\\)` fails however the line is split
+        h = 0
+        while h < 6 and text[i+h] == '#':
+            h += 1
+        ws = 0
+        while text[i+h+ws] in ' \t':
+            ws += 1
+        start = i + h + ws
+        if tag_friendly and not ws:
+            return None
+        if start == eol:
+            # `(.+?)` needs a character: give one back from `[ \t]*`,
+            # or else from `\#{1,6}`.
+            if ws > 1 or (ws and not tag_friendly):
+                start -= 1
+            elif not ws and h > 1:
+                h -= 1
+                start -= 1
+            else:
+                return None
+        # The header text ends where the rest of the line is `[ \t]*`
+        # and `\#*`, but not with the '#'s right after a backslash.
+        q = eol
+        while q > i and text[q-1] == '#':
+            q -= 1
+        t = q
+        while t > i and text[t-1] in ' \t':
+            t -= 1
+        k = max(start + 1, t)
+        if k <= q and text[q-1] == '\\':
+            k = q + 1
+        end = eol
+        while end < len(text) and text[end] == '\n':
+            end += 1
+        return h, text[start:k], end
+
     _marker_ul_chars  = '*+-'
     _marker_any = r'(?:[%s]|\d+\.)' % _marker_ul_chars
     _marker_ul = '(?:[%s])' % _marker_ul_chars
@@ -1408,42 +1945,21 @@ class Markdown(object):
 
     def _do_lists(self, text):
         # Form HTML ordered (numbered) and unordered (bulleted) lists.
+        if ("hardened" in self.extras
+                and self.list_level >= HARDENED_MAX_NESTING):
+            return text
 
         # Iterate over each *non-overlapping* list match.
         pos = 0
         while True:
+            self._check_budget()
             # Find the *first* hit for either list style (ul or ol). We
             # match ul and ol separately to avoid adjacent lists of different
             # types running into each other (see issue #16).
             hits = []
             for marker_pat in (self._marker_ul, self._marker_ol):
-                less_than_tab = self.tab_width - 1
-                whole_list = r'''
-                    (                   # \1 = whole list
-                      (                 # \2
-                        [ ]{0,%d}
-                        (%s)            # \3 = first list item marker
-                        [ \t]+
-                        (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
-                      )
-                      (?:.+?)
-                      (                 # \4
-                          \Z
-                        |
-                          \n{2,}
-                          (?=\S)
-                          (?!           # Negative lookahead for another list item marker
-                            [ \t]*
-                            %s[ \t]+
-                          )
-                      )
-                    )
-                ''' % (less_than_tab, marker_pat, marker_pat)
-                if self.list_level:  # sub-list
-                    list_re = re.compile("^"+whole_list, re.X | re.M | re.S)
-                else:
-                    list_re = re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
-                                         re.X | re.M | re.S)
+                list_re = _list_re_from_tab_width(self.tab_width, marker_pat,
+                                                  bool(self.list_level))
                 match = list_re.search(text, pos)
                 if match:
                     hits.append((match.start(), match))
@@ -1516,36 +2032,29 @@ class Markdown(object):
         return list_str
 
     def _get_pygments_lexer(self, lexer_name):
-        try:
-            from pygments import lexers, util
-        except ImportError:
-            return None
-        try:
-            return lexers.get_lexer_by_name(lexer_name)
-        except util.ClassNotFound:
-            return None
+        return _pygments_lexer(lexer_name)
 
     def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
-        import pygments
-        import pygments.formatters
-
-        class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
-            def _wrap_code(self, inner):
-                """A function for use in a Pygments Formatter which
-                wraps in <code> tags.
-                """
-                yield 0, "<code>"
-                for tup in inner:
-                    yield tup
-                yield 0, "</code>"
-
-            def wrap(self, source, outfile):
-                """Return the source with a code, pre, and div."""
-                return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
-
         formatter_opts.setdefault("cssclass", "codehilite")
-        formatter = HtmlCodeFormatter(**formatter_opts)
-        return pygments.highlight(codeblock, lexer, formatter)
+        key = _highlight_key(codeblock, lexer, formatter_opts)
+        colored = self._highlighted.get(key) or _highlight_cache.get(key)
+        if colored is None:
+            colored = _import_pygments().highlight(
+                codeblock, lexer, _pygments_formatter(formatter_opts))
+            _highlight_cache.set(key, colored)
+        return colored
+
+    def _unhash_code(self, codeblock):
+        for key, sanitized in list(self.html_spans.items()):
+            codeblock = codeblock.replace(key, sanitized)
+        replacements = [
+            ("&amp;", "&"),
+            ("&lt;", "<"),
+            ("&gt;", ">")
+        ]
+        for old, new in replacements:
+            codeblock = codeblock.replace(old, new)
+        return codeblock
 
     def _code_block_sub(self, match, is_fenced_code_block=False):
         lexer_name = None
@@ -1570,20 +2079,9 @@ class Markdown(object):
                 formatter_opts = self.extras['code-color'] or {}
 
         if lexer_name:
-            def unhash_code( codeblock ):
-                for key, sanitized in list(self.html_spans.items()):
-                    codeblock = codeblock.replace(key, sanitized)
-                replacements = [
-                    ("&amp;", "&"),
-                    ("&lt;", "<"),
-                    ("&gt;", ">")
-                ]
-                for old, new in replacements:
-                    codeblock = codeblock.replace(old, new)
-                return codeblock
             lexer = self._get_pygments_lexer(lexer_name)
             if lexer:
-                codeblock = unhash_code( codeblock )
+                codeblock = self._unhash_code(codeblock)
                 colored = self._color_with_pygments(codeblock, lexer,
                                                     **formatter_opts)
                 return "\n\n%s\n\n" % colored
@@ -1611,20 +2109,7 @@ class Markdown(object):
 
     def _do_code_blocks(self, text):
         """Process Markdown `<pre><code>` blocks."""
-        code_block_re = re.compile(r'''
-            (?:\n\n|\A\n?)
-            (               # $1 = the code block -- one or more lines, starting with a space/tab
-              (?:
-                (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
-                .*\n+
-              )+
-            )
-            ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
-            # Lookahead to make sure this block isn't already in a code block.
-            # Needed when syntax highlighting is being used.
-            (?![^<]*\</code\>)
-            ''' % (self.tab_width, self.tab_width),
-            re.M | re.X)
+        code_block_re = _code_block_re_from_tab_width(self.tab_width)
         return code_block_re.sub(self._code_block_sub, text)
 
     _fenced_code_block_re = re.compile(r'''
@@ -1639,8 +2124,42 @@ class Markdown(object):
 
     def _do_fenced_code_blocks(self, text):
         """Process ```-fenced unindented code blocks ('fenced-code-blocks' extra)."""
+        self._highlight_fenced_code_blocks(text)
         return self._fenced_code_block_re.sub(self._fenced_code_block_sub, text)
 
+    def _highlight_fenced_code_blocks(self, text):
+        """Highlight all fenced code blocks of `text` that name a lexer in
+        one batch, before `_fenced_code_block_sub` puts them in place: each
+        distinct block is looked up in the shared cache once, and the ones
+        that miss are highlighted with one formatter for the whole batch.
+        Each block is still lexed on its own, so lexer state can't leak
+        from one block into the next.
+        """
+        formatter_opts = dict(self.extras['fenced-code-blocks'] or {})
+        formatter_opts.setdefault("cssclass", "codehilite")
+        pending = []
+        for match in self._fenced_code_block_re.finditer(text):
+            lexer_name = match.group(1)
+            lexer = lexer_name and self._get_pygments_lexer(lexer_name)
+            if not lexer:
+                continue
+            codeblock = self._unhash_code(match.group(2)[:-1])
+            key = _highlight_key(codeblock, lexer, formatter_opts)
+            if key in self._highlighted:
+                continue
+            colored = _highlight_cache.get(key)
+            self._highlighted[key] = colored
+            if colored is None:
+                pending.append((key, codeblock, lexer))
+        if not pending:
+            return
+        formatter = _pygments_formatter(formatter_opts)
+        for key, codeblock, lexer in pending:
+            self._check_budget()
+            colored = _import_pygments().highlight(codeblock, lexer, formatter)
+            _highlight_cache.set(key, colored)
+            self._highlighted[key] = colored
+
     # Rules for a code span:
     # - backslash escapes are not interpreted in a code span
     # - to include one or or a run of more backticks the delimiters must
@@ -1704,8 +2223,11 @@ class Markdown(object):
         ]
         for before, after in replacements:
             text = text.replace(before, after)
-        hashed = _hash_text(text)
-        self._escape_table[text] = hashed
+        # The same code text must map to the same placeholder: the table
+        # maps text -> placeholder, so a second one would orphan the first.
+        hashed = self._escape_table.get(text)
+        if hashed is None:
+            hashed = self._escape_table[text] = self._new_token()
         return hashed
 
     _strong_re = re.compile(r"(\*\*|__)(?=\S)(.+?[*_]*)(?<=\S)\1", re.S)
@@ -1714,7 +2236,16 @@ class Markdown(object):
     _code_friendly_em_re = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*", re.S)
     def _do_italics_and_bold(self, text):
         # <strong> must go first:
-        if "code-friendly" in self.extras:
+        if "hardened" in self.extras:
+            # The regexes above try every closing delimiter up to the end
+            # of the text for each opening one that has no match.
+            if "code-friendly" in self.extras:
+                text = _hardened_strong_sub(text, _hardened_cf_strong_open_re)
+                text = _hardened_em_sub(text, _hardened_cf_em_open_re)
+            else:
+                text = _hardened_strong_sub(text, _hardened_strong_open_re)
+                text = _hardened_em_sub(text, _hardened_em_open_re)
+        elif "code-friendly" in self.extras:
             text = self._code_friendly_strong_re.sub(r"<strong>\1</strong>", text)
             text = self._code_friendly_em_re.sub(r"<em>\1</em>", text)
         else:
@@ -1787,17 +2318,23 @@ class Markdown(object):
         bq = match.group(1)
         bq = self._bq_one_level_re.sub('', bq)  # trim one level of quoting
         bq = self._ws_only_line_re.sub('', bq)  # trim whitespace-only lines
+        self._quote_level += 1
         bq = self._run_block_gamut(bq)          # recurse
+        self._quote_level -= 1
 
         bq = re.sub('(?m)^', '  ', bq)
         # These leading spaces screw with <pre> content, so we need to fix that:
-        bq = self._html_pre_block_re.sub(self._dedent_two_spaces_sub, bq)
+        if '<pre>' in bq:
+            bq = self._html_pre_block_re.sub(self._dedent_two_spaces_sub, bq)
 
         return "<blockquote>\n%s\n</blockquote>\n\n" % bq
 
     def _do_block_quotes(self, text):
         if '>' not in text:
             return text
+        if ("hardened" in self.extras
+                and self._quote_level >= HARDENED_MAX_NESTING):
+            return text
         return self._block_quote_re.sub(self._block_quote_sub, text)
 
     def _form_paragraphs(self, text):
@@ -1886,15 +2423,51 @@ class Markdown(object):
         return text
 
     def _encode_backslash_escapes(self, text):
+        # The table grows with every code span; most text has nothing to
+        # escape, so don't scan it once per entry.
+        if "\\" not in text:
+            return text
         for ch, escape in list(self._escape_table.items()):
             text = text.replace("\\"+ch, escape)
         return text
 
     _auto_link_re = re.compile(r'<((https?|ftp):[^\'">\s]+)>', re.I)
+    # "hardened" extra: `_auto_link_re` rescans to the end of the run from
+    # every "<http:" inside it, quadratic on e.g. "<http:a<http:a<http:a...".
+    # A match starts at the first "<http:" of a maximal run of
+    # `[^'">\s]` and ends at the '>' right after the run, so find the runs
+    # once and look for the start inside each.
+    _auto_link_run_re = re.compile(r'[^\'">\s]+')
+    _auto_link_start_re = re.compile(r'<(?:https?|ftp):', re.I)
     def _auto_link_sub(self, match):
         g1 = match.group(1)
         return '<a href="%s">%s</a>' % (g1, g1)
 
+    def _hardened_auto_links(self, text):
+        """`_auto_link_re.sub()` for the "hardened" extra, same output in
+        linear time.
+        """
+        if '<' not in text:
+            return text
+        pieces = []
+        pos = 0
+        for run in self._auto_link_run_re.finditer(text):
+            end = run.end()
+            if text[end:end+1] != '>':
+                continue
+            start = self._auto_link_start_re.search(text, run.start(), end)
+            # The url needs at least one character after the scheme.
+            if start is None or start.end() == end:
+                continue
+            url = text[start.start()+1:end]
+            pieces.append(text[pos:start.start()])
+            pieces.append('<a href="%s">%s</a>' % (url, url))
+            pos = end + 1
+        if not pieces:
+            return text
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
     _auto_email_link_re = re.compile(r"""
           <
            (?:mailto:)?
@@ -1910,7 +2483,10 @@ class Markdown(object):
             self._unescape_special_chars(match.group(1)))
 
     def _do_auto_links(self, text):
-        text = self._auto_link_re.sub(self._auto_link_sub, text)
+        if "hardened" in self.extras:
+            text = self._hardened_auto_links(text)
+        else:
+            text = self._auto_link_re.sub(self._auto_link_sub, text)
         text = self._auto_email_link_re.sub(self._auto_email_link_sub, text)
         return text
 
@@ -1957,7 +2533,7 @@ class Markdown(object):
                         .replace('*', self._escape_table['*'])
                         .replace('_', self._escape_table['_']))
                 link = '<a href="%s">%s</a>' % (escaped_href, text[start:end])
-                hash = _hash_text(link)
+                hash = self._new_token()
                 link_from_hash[hash] = link
                 text = text[:start] + hash + text[end:]
         for hash, link in list(link_from_hash.items()):
@@ -1966,6 +2542,8 @@ class Markdown(object):
 
     def _unescape_special_chars(self, text):
         # Swap back in all the special characters we've hidden.
+        if "tok-" not in text:
+            return text
         for ch, hash in list(self._escape_table.items()):
             text = text.replace(hash, ch)
         return text
@@ -2170,17 +2748,25 @@ def _dedent(text, tabsize=8, skip_first_line=False):
 class _memoized(object):
    """Decorator that caches a function's return value each time it is called.
    If called later with the same arguments, the cached value is returned, and
-   not re-evaluated.
+   not re-evaluated. At most `maxsize` results are kept; the oldest entry is
+   dropped first, so odd argument values (e.g. many different tab widths)
+   can't grow the cache without bound.
    http://wiki.python.org/moin/PythonDecoratorLibrary
    """
-   def __init__(self, func):
+   def __init__(self, func, maxsize=32):
       self.func = func
+      self.maxsize = maxsize
       self.cache = {}
+      self.order = []
    def __call__(self, *args):
       try:
          return self.cache[args]
       except KeyError:
-         self.cache[args] = value = self.func(*args)
+         value = self.func(*args)
+         if len(self.order) >= self.maxsize:
+            del self.cache[self.order.pop(0)]
+         self.cache[args] = value
+         self.order.append(args)
          return value
       except TypeError:
          # uncachable -- for instance, passing a list as an argument.
@@ -2232,6 +2818,356 @@ def _hr_tag_re_from_tab_width(tab_width):
 _hr_tag_re_from_tab_width = _memoized(_hr_tag_re_from_tab_width)
 
 
+# The regexes below depend on the tab width, so they can't be class
+# attributes. Build them once per tab width instead of once per call.
+
+def _outdent_re_from_tab_width(tab_width):
+    return re.compile(r'^(\t|[ ]{1,%d})' % tab_width, re.M)
+_outdent_re_from_tab_width = _memoized(_outdent_re_from_tab_width)
+
+def _link_def_re_from_tab_width(tab_width):
+    # Link defs are in the form:
+    #   [id]: url "optional title"
+    return re.compile(r"""
+        ^[ ]{0,%d}\[(.+)\]: # id = \1
+          [ \t]*
+          \n?               # maybe *one* newline
+          [ \t]*
+        <?(.+?)>?           # url = \2
+          [ \t]*
+        (?:
+            \n?             # maybe one newline
+            [ \t]*
+            (?<=\s)         # lookbehind for whitespace
+            ['"(]
+            ([^\n]*)        # title = \3
+            ['")]
+            [ \t]*
+        )?  # title is optional
+        (?:\n+|\Z)
+        """ % (tab_width - 1), re.X | re.M | re.U)
+_link_def_re_from_tab_width = _memoized(_link_def_re_from_tab_width)
+
+def _footnote_def_re_from_tab_width(tab_width):
+    return re.compile(r'''
+        ^[ ]{0,%d}\[\^(.+)\]:   # id = \1
+        [ \t]*
+        (                       # footnote text = \2
+          # First line need not start with the spaces.
+          (?:\s*.*\n+)
+          (?:
+            (?:[ ]{%d} | \t)  # Subsequent lines must be indented.
+            .*\n+
+          )*
+        )
+        # Lookahead for non-space at line-start, or end of doc.
+        (?:(?=^[ ]{0,%d}\S)|\Z)
+        ''' % (tab_width - 1, tab_width, tab_width),
+        re.X | re.M)
+_footnote_def_re_from_tab_width = _memoized(_footnote_def_re_from_tab_width)
+
+def _pyshell_block_re_from_tab_width(tab_width):
+    return re.compile(r"""
+        ^([ ]{0,%d})>>>[ ].*\n   # first line
+        ^(\1.*\S+.*\n)*         # any number of subsequent lines
+        ^\n                     # ends with a blank line
+        """ % (tab_width - 1), re.M | re.X)
+_pyshell_block_re_from_tab_width = _memoized(_pyshell_block_re_from_tab_width)
+
+def _table_re_from_tab_width(tab_width):
+    # The rows are matched as `[^\n|]*[|].*` rather than `.*[|].*`: the
+    # same lines, but split at the first pipe only. Otherwise a header row
+    # without an underline row is retried at every pipe of the line.
+    less_than_tab = tab_width - 1
+    return re.compile(r'''
+            (?:(?<=\n\n)|\A\n?)             # leading blank line
+            ^[ ]{0,%d}                      # allowed whitespace
+            ([^\n|]*[|].*)  \n              # $1: header row (at least one pipe)
+            ^[ ]{0,%d}                      # allowed whitespace
+            (                               # $2: underline row
+                # underline row with leading bar
+                (?:  \|\ *:?-+:?\ *  )+  \|?  \n
+                |
+                # or, underline row without leading bar
+                (?:  \ *:?-+:?\ *\|  )+  (?:  \ *:?-+:?\ *  )?  \n
+            )
+            (                               # $3: data rows
+                (?:
+                    ^[ ]{0,%d}(?!\ )         # ensure line begins with 0 to less_than_tab spaces
+                    [^\n|]*\|.*  \n
+                )+
+            )
+        ''' % (less_than_tab, less_than_tab, less_than_tab), re.M | re.X)
+_table_re_from_tab_width = _memoized(_table_re_from_tab_width)
+
+def _wiki_table_re_from_tab_width(tab_width):
+    return re.compile(r'''
+        (?:(?<=\n\n)|\A\n?)            # leading blank line
+        ^([ ]{0,%d})\|\|.+?\|\|[ ]*\n  # first line
+        (^\1\|\|.+?\|\|\n)*        # any number of subsequent lines
+        ''' % (tab_width - 1), re.M | re.X)
+_wiki_table_re_from_tab_width = _memoized(_wiki_table_re_from_tab_width)
+
+def _code_block_re_from_tab_width(tab_width):
+    return re.compile(r'''
+        (?:\n\n|\A\n?)
+        (               # $1 = the code block -- one or more lines, starting with a space/tab
+          (?:
+            (?:[ ]{%d} | \t)  # Lines must start with a tab or a tab-width of spaces
+            .*\n+
+          )+
+        )
+        ((?=^[ ]{0,%d}\S)|\Z)   # Lookahead for non-space at line-start, or end of doc
+        # Lookahead to make sure this block isn't already in a code block.
+        # Needed when syntax highlighting is being used.
+        (?![^<]*\</code\>)
+        ''' % (tab_width, tab_width),
+        re.M | re.X)
+_code_block_re_from_tab_width = _memoized(_code_block_re_from_tab_width)
+
+def _list_re_from_tab_width(tab_width, marker_pat, sublist):
+    whole_list = r'''
+        (                   # \1 = whole list
+          (                 # \2
+            [ ]{0,%d}
+            (%s)            # \3 = first list item marker
+            [ \t]+
+            (?!\ *\3\ )     # '- - - ...' isn't a list. See 'not_quite_a_list' test case.
+          )
+          (?:.+?)
+          (                 # \4
+              \Z
+            |
+              \n{2,}
+              (?=\S)
+              (?!           # Negative lookahead for another list item marker
+                [ \t]*
+                %s[ \t]+
+              )
+          )
+        )
+    ''' % (tab_width - 1, marker_pat, marker_pat)
+    if sublist:
+        return re.compile("^"+whole_list, re.X | re.M | re.S)
+    else:
+        return re.compile(r"(?:(?<=\n\n)|\A\n?)"+whole_list,
+                          re.X | re.M | re.S)
+_list_re_from_tab_width = _memoized(_list_re_from_tab_width)
+
+class _BalanceIndex(object):
+    """`Markdown._find_balanced()` for one text and pair of characters in
+    O(log n) a call, for the "hardened" extra.
+    """
+    def __init__(self, text, open_c, close_c):
+        # positions[k] is the k-th open_c or close_c in text and depths[k]
+        # the nesting depth after it; entry 0 stands for the start of the
+        # text. lower[k] is the first entry after k with a smaller depth:
+        # where a scan that starts after entry k balances out.
+        positions, depths = [-1], [0]
+        depth = 0
+        for match in re.finditer("[%s]" % re.escape(open_c + close_c), text):
+            if match.group() == open_c:
+                depth += 1
+            else:
+                depth -= 1
+            positions.append(match.start())
+            depths.append(depth)
+        lower = [None] * len(positions)
+        stack = []
+        for k, depth in enumerate(depths):
+            while stack and depths[stack[-1]] > depth:
+                lower[stack.pop()] = k
+            stack.append(k)
+        self.positions = positions
+        self.lower = lower
+
+    def find(self, start):
+        """The index after the close_c where a scan from `start` balances
+        out, or None if it doesn't.
+        """
+        k = self.lower[bisect.bisect_left(self.positions, start) - 1]
+        if k is None:
+            return None
+        return self.positions[k] + 1
+
+# "hardened" extra: the tag alternative of `_sorta_html_tokenize_re`
+# without its backtracking. A quoted attribute value ends at the first
+# matching quote, and values and the number of attributes are bounded, so
+# one '<' can't make the scan run across the rest of the line.
+_hardened_html_tag_re = re.compile(r"""
+    </?
+    (?:\w+)                                     # tag name
+    (?:\s+(?:[\w-]+:)?[\w-]+=(?:"[^"\n]{0,1024}"|'[^'\n]{0,1024}')){0,64}
+    \s*/?>
+    """, re.X)
+_word_char_re = re.compile(r"\w")
+
+def _finder(text, sub):
+    """Return `find(start)`, the same as `text.find(sub, start)` for
+    non-decreasing `start`, that reuses the last result while it is still
+    ahead instead of scanning the same stretch of text again.
+    """
+    last = [-1, -1]     # start and result of the last real search
+    def find(start):
+        searched_from, found = last
+        if searched_from != -1 and searched_from <= start \
+                and (found == -1 or found >= start):
+            return found
+        found = text.find(sub, start)
+        last[:] = [start, found]
+        return found
+    return find
+
+def _split_html_tokens(text):
+    """`Markdown._sorta_html_tokenize_re.split(text)` in linear time, for
+    the "hardened" extra. The regex looks for the end of a comment, a
+    processing instruction or an auto-link from every '<', up to the end
+    of the line or text, so "<!--" * n takes quadratic time.
+    """
+    find_gt = _finder(text, ">")
+    find_comment_end = _finder(text, "-->")
+    find_pi_end = _finder(text, "?>")
+    find_nl = _finder(text, "\n")
+    tokens = []
+    pos = 0
+    i = text.find("<")
+    while i != -1:
+        end = None
+        match = _hardened_html_tag_re.match(text, i)
+        if match:
+            end = match.end()
+        elif _word_char_re.match(text, i + 1):
+            # auto-link: <\w+[^>]*>
+            gt = find_gt(i + 1)
+            if gt != -1:
+                end = gt + 1
+        elif text.startswith("<!--", i):
+            # comment: <!--.*?--> on one line
+            close, nl = find_comment_end(i + 4), find_nl(i + 4)
+            if close != -1 and (nl == -1 or nl > close):
+                end = close + 3
+        elif text.startswith("<?", i):
+            # processing instruction: <\?.*?\?> on one line
+            close, nl = find_pi_end(i + 2), find_nl(i + 2)
+            if close != -1 and (nl == -1 or nl > close):
+                end = close + 2
+        if end is None:
+            i = text.find("<", i + 1)
+            continue
+        tokens.append(text[pos:i])
+        tokens.append(text[i:end])
+        pos = end
+        i = text.find("<", end)
+    tokens.append(text[pos:])
+    return tokens
+
+# "hardened" extra: `Markdown._strong_re` and `_em_re` (and their
+# code-friendly versions) as scanners that pick the same matches in
+# linear time.
+_a_start_re = re.compile(r"<(a)", re.IGNORECASE)
+_href_re = re.compile(r"href=", re.IGNORECASE)
+
+def _hardened_add_nofollow(text):
+    """`Markdown._a_nofollow.sub()` in linear time, for the "hardened"
+    extra. From every "<a" the regex's `[^>]*` runs to the next '>' and
+    backtracks to the last "href=" before it, so "<a " * n with no '>'
+    takes quadratic time.
+    """
+    hrefs = [match.start() for match in _href_re.finditer(text)]
+    if not hrefs:
+        return text
+    find_gt = _finder(text, ">")
+    chunks = []
+    pos = 0
+    for match in _a_start_re.finditer(text):
+        if match.start() < pos:
+            continue  # inside the last match
+        gt = find_gt(match.end())
+        if gt == -1:
+            gt = len(text)
+        # The last "href=" before the '>' ends the match.
+        idx = bisect.bisect_left(hrefs, gt) - 1
+        if idx < 0 or hrefs[idx] < match.end():
+            continue
+        chunks.append(text[pos:match.start()])
+        chunks.append('<%s rel="nofollow"' % match.group(1))
+        chunks.append(text[match.end():hrefs[idx] + 5])
+        pos = hrefs[idx] + 5
+    chunks.append(text[pos:])
+    return ''.join(chunks)
+
+_hardened_strong_open_re = re.compile(r"(?:\*\*|__)(?=\S)")
+_hardened_cf_strong_open_re = re.compile(r"\*\*(?=\S)")
+_hardened_strong_close_re = re.compile(r"(?<=\S)(?=(\*\*|__))")
+_hardened_em_open_re = re.compile(r"[*_](?=\S)")
+_hardened_cf_em_open_re = re.compile(r"\*(?=\S)")
+_hardened_em_close_re = re.compile(r"(?<=\S)([*_])")
+_emphasis_run_re = re.compile(r"[*_]+")
+
+def _hardened_strong_sub(text, open_re):
+    """`_strong_re.sub(r"<strong>\2</strong>", text)` for the opening
+    delimiters matched by `open_re`.
+    For an opening "**" at i, `(.+?[*_]*)` first reaches a closing "**"
+    (preceded by a non-space) at the first one from i+3 on; `[*_]*` then
+    takes the whole run of '*' and '_' around it and gives back until the
+    last closing "**" in that run.
+    """
+    closers = {}
+    for match in _hardened_strong_close_re.finditer(text):
+        closers.setdefault(match.group(1), []).append(match.start())
+    if not closers:
+        return text
+    run_starts, run_ends = [], []
+    for match in _emphasis_run_re.finditer(text):
+        run_starts.append(match.start())
+        run_ends.append(match.end())
+
+    chunks = []
+    pos = 0
+    match = open_re.search(text)
+    while match:
+        i = match.start()
+        ends = closers.get(text[i:i+2], ())
+        k = bisect.bisect_left(ends, i + 3)
+        if k == len(ends):
+            match = open_re.search(text, i + 1)
+            continue
+        run = bisect.bisect_right(run_starts, ends[k]) - 1
+        end = ends[bisect.bisect_right(ends, run_ends[run] - 2) - 1]
+        chunks.extend([text[pos:i], "<strong>", text[i+2:end], "</strong>"])
+        pos = end + 2
+        match = open_re.search(text, pos)
+    chunks.append(text[pos:])
+    return "".join(chunks)
+
+def _hardened_em_sub(text, open_re):
+    """`_em_re.sub(r"<em>\2</em>", text)` for the opening delimiters
+    matched by `open_re`: an opening '*' at i is closed by the first '*'
+    from i+2 on that follows a non-space.
+    """
+    closers = {}
+    for match in _hardened_em_close_re.finditer(text):
+        closers.setdefault(match.group(1), []).append(match.start())
+    if not closers:
+        return text
+
+    chunks = []
+    pos = 0
+    match = open_re.search(text)
+    while match:
+        i = match.start()
+        ends = closers.get(text[i], ())
+        k = bisect.bisect_left(ends, i + 2)
+        if k == len(ends):
+            match = open_re.search(text, i + 1)
+            continue
+        end = ends[k]
+        chunks.extend([text[pos:i], "<em>", text[i+1:end], "</em>"])
+        pos = end + 1
+        match = open_re.search(text, pos)
+    chunks.append(text[pos:])
+    return "".join(chunks)
+
 def _xml_escape_attr(attr, skip_single_quote=True):
     """Escape the given string for use in an HTML/XML tag attribute.
     By default this doesn't bother with escaping `'` to `&#39;`, presuming that
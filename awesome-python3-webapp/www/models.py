@@ -7,7 +7,7 @@ Models for user, blog, comment.
 
 import time, uuid
 
-from orm import Model, StringField, BooleanField, FloatField, TextField
+from orm import Model, StringField, BooleanField, FloatField, TextField, IntegerField
 
 def next_id():
     return '%015d%s000' % (int(time.time() * 1000), uuid.uuid4().hex)
@@ -17,10 +17,11 @@ class User(Model):
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     email = StringField(ddl='varchar(50)')
-    passwd = StringField(ddl='varchar(50)')
+    passwd = StringField(ddl='varchar(200)', private=True)
     admin = BooleanField()
     name = StringField(ddl='varchar(50)')
     image = StringField(ddl='varchar(500)')
+    session_version = IntegerField(private=True)  # 会话版本号，加1即撤销该用户所有已签发的cookie
     created_at = FloatField(default=time.time)
 
 class Blog(Model):
@@ -31,9 +32,16 @@ class Blog(Model):
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
     name = StringField(ddl='varchar(50)')
-    summary = StringField(ddl='varchar(200)')
+    summary = StringField(ddl='varchar(200)')  # 作者写的摘要，可以为空
+    auto_summary = StringField(ddl='varchar(200)')  # 从html提取的纯文本摘要，和html_content一起生成，列表中没有summary时显示
     content = TextField()
+    html_content = TextField()  # content转换成的html，保存博客时生成，为None时在第一次访问时生成
+    toc_html = TextField()  # 目录的html，和html_content一起生成，没有标题时为None
+    # 评论数，创建/删除评论时用原子的加减1维护，列表中直接显示，不用每篇博客count一次
+    # update()不写回这个字段；计数偶尔出现的偏差由reconcile_comment_counts.py定期修正
+    comment_count = IntegerField(updatable=False)
     created_at = FloatField(default=time.time)
+    updated_at = FloatField(default=time.time)  # 最后修改时间，用于模板片段缓存的key
 
 class Comment(Model):
     __table__ = 'comments'
@@ -44,4 +52,5 @@ class Comment(Model):
     user_name = StringField(ddl='varchar(50)')
     user_image = StringField(ddl='varchar(500)')
     content = TextField()
+    html_content = TextField()  # content转换成的html，保存评论时生成，为None的旧评论由backfill_comments.py回填
     created_at = FloatField(default=time.time)
\ No newline at end of file
@@ -6,11 +6,16 @@ __author__ = 'Zhang'
 # aiomysql是Mysql的python异步驱动程序，操作数据库要用到
 import asyncio, logging, aiomysql
 
+import deadlines
+
 s = "just for test"
 # 这个函数的作用是输出信息，让你知道这个时间点程序在做什么
 def log(sql, args=()):
     logging.info('SQL: %s' % sql)
 
+# 全局连接池，由create_pool创建
+__pool = None
+
 # 创建全局连接池
 # 这个函数将来会在app.py的init函数中引用
 # 目的是为了让每个HTTP请求都能s从连接池中直接获取数据库连接
@@ -40,44 +45,143 @@ async def create_pool(loop, **kw):
     )
 
 
+# 关闭连接池，在服务退出(比如server.py中worker优雅退出)时调用
+async def close_pool():
+    global __pool
+    if __pool is not None:
+        __pool.close()
+        await __pool.wait_closed()
+        __pool = None
+
+
+# 在当前请求的截止时间内从连接池获取一个连接
+# 超时(或请求被取消)时不取消获取连接的任务：取消可能发生在连接已经拿到、还没交给我们的时候，这个连接就再也回不到连接池了
+# 而是让它继续完成，连接晚到时直接放回连接池
+async def _acquire():
+    deadlines.remaining()  # 已经超时就不再去获取连接
+    pool = __pool
+    task = asyncio.ensure_future(pool.acquire())
+    try:
+        return (await deadlines.run(asyncio.shield(task)))
+    except BaseException:
+        task.add_done_callback(lambda t: _release_late(pool, t))
+        raise
+
+
+def _release_late(pool, task):
+    if not task.cancelled() and task.exception() is None:
+        pool.release(task.result())
+
+
 # =================================以下是SQL函数处理区====================================
 # select和execute方法是实现其他Model类中SQL语句都经常要用的方法
 
 # 将执行SQL的代码封装进select函数，调用的时候只要传入sql，和sql所需要的一些参数就好
 # sql参数即为sql语句，args表示要搜索的参数
 # size用于指定最大的查询数量，不指定将返回所有查询结果
+# 获取连接、执行SQL、读取结果都受当前请求的截止时间限制(见deadlines.py)，超时抛出DeadlineExceeded
 async def select(sql, args, size=None):
     log(sql, args)
     # 声明全局变量，这样才能引用create_pool函数创建的__pool变量
     global __pool
     # 从连接池中获得一个数据库连接
-    # 用with语句可以封装清理（关闭conn)和处理异常工作
-    with (await __pool) as conn:
+    conn = await _acquire()
+    try:
         cur = await conn.cursor(aiomysql.DictCursor)
         # SQL语句的占位符是?，而MySQL的占位符是%s
-        await cur.execute(sql.replace('?', '%s'), args or ())
+        await deadlines.run(cur.execute(sql.replace('?', '%s'), args or ()))
         if size:
-            rs = await cur.fetchmany(size)
+            rs = await deadlines.run(cur.fetchmany(size))
         else:
-            rs = await cur.fetchall()
+            rs = await deadlines.run(cur.fetchall())
         await cur.close()
         logging.info('rows returned: %s' % len(rs))
         return rs
+    except (deadlines.DeadlineExceeded, asyncio.CancelledError):
+        # 查询被中途打断，连接的状态不确定，关闭它而不是放回连接池
+        conn.close()
+        raise
+    finally:
+        __pool.release(conn)
 
 
 # 定义execute()函数执行insert update delete语句
 # execute()函数只返回结果数，不返回结果集，适用于insert, update这些语句
 async def execute(sql, args):
     log(sql)
-    with (await __pool) as conn:
-        try:
-            cur = await conn.cursor()
-            await cur.execute(sql.replace('?', '%s'), args)
-            affected = cur.rowcount
-            await cur.close()
-        except BaseException as e:
-            raise
+    conn = await _acquire()
+    try:
+        cur = await conn.cursor()
+        await deadlines.run(cur.execute(sql.replace('?', '%s'), args))
+        affected = cur.rowcount
+        await cur.close()
         return affected
+    except (deadlines.DeadlineExceeded, asyncio.CancelledError):
+        conn.close()
+        raise
+    finally:
+        __pool.release(conn)
+
+
+# 按键集分页(keyset pagination)逐批读取查询结果的异步迭代器
+# 每一批是一次普通的select(... limit chunk_size)，读完马上归还连接，下一批从上一批最后一行的排序键接着读
+# 所以调用者处理一批数据的时候(比如写给读得很慢的客户端)不占用数据库连接，每一批都和select一样受当前截止时间的限制
+# keys是排序用的列，最后一列必须唯一(一般是主键)，desc为True时按降序读取
+# model不为None时，每一行都会被转化为model的实例
+class RowIterator(object):
+    def __init__(self, sql, where, args, keys, desc=False, model=None, chunk_size=100):
+        self._sql = sql
+        self._where = where
+        self._args = list(args or ())
+        self._keys = keys
+        self._desc = desc
+        self._model = model
+        self._chunk_size = chunk_size
+        self._last = None  # 上一批最后一行的排序键
+        self._rows = ()
+        self._index = 0
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._index >= len(self._rows):
+            if self._done:
+                raise StopAsyncIteration
+            self._rows = await select(*self._next_query())
+            self._index = 0
+            if len(self._rows) < self._chunk_size:
+                self._done = True
+            if not self._rows:
+                raise StopAsyncIteration
+            self._last = [self._rows[-1][k] for k in self._keys]
+        row = self._rows[self._index]
+        self._index += 1
+        return self._model(**row) if self._model is not None else row
+
+    # 下一批的sql和参数：(k1, k2) < (上一批最后一行的k1, k2)，升序时为>
+    def _next_query(self):
+        where, args = [], []
+        if self._where:
+            where.append('(%s)' % self._where)
+            args.extend(self._args)
+        if self._last is not None:
+            where.append('(%s) %s (%s)' % (', '.join('`%s`' % k for k in self._keys), '<' if self._desc else '>',
+                                           create_args_string(len(self._keys))))
+            args.extend(self._last)
+        order = ', '.join('`%s`%s' % (k, ' desc' if self._desc else '') for k in self._keys)
+        sql = [self._sql]
+        if where:
+            sql.append('where %s' % ' and '.join(where))
+        sql.append('order by %s limit ?' % order)
+        args.append(self._chunk_size)
+        return ' '.join(sql), args
+
+    # 提前结束迭代时调用(比如客户端断开连接)，不再读取后面的批次；批与批之间不占用连接，没有需要归还的资源
+    async def aclose(self):
+        self._done = True
+        self._rows = ()
 
 
 # =====================================Model基类区==========================================
@@ -91,6 +195,17 @@ def create_args_string(num):
     return ', '.join(L)
 
 
+# 这个函数在元类中被引用，为每个Model生成一个序列化函数，把实例转化为可以直接JSON编码的dict
+# 没有私有字段的Model本身就是dict，直接返回实例，不做任何拷贝
+# 有私有字段的Model返回一个去掉私有字段的新dict，实例本身不会被修改
+def make_serializer(private_fields):
+    if not private_fields:
+        return lambda m: m
+    def serialize(m):
+        return {k: v for k, v in m.items() if k not in private_fields}
+    return serialize
+
+
 class ModelMetaclass(type):
     #cls <class 'orm.ModelMetaclass'>  元类
     #name 'User' 子类类名
@@ -111,7 +226,7 @@ class ModelMetaclass(type):
         for k, v in attrs.items():
             # 表的每一个字段 都是 Field 的子类的实例 ，也是Field 的实例
             if isinstance(v, Field):
-                logging.info('  found mapping (建立映射): %s ==> %s' % (k, v))
+                logging.debug('  found mapping (建立映射): %s ==> %s', k, v)
                 mappings[k] = v
                 if v.primary_key:
                     # 找到主键:
@@ -127,20 +242,28 @@ class ModelMetaclass(type):
 
         # list(map(lambda f: '`%s`' % f, [1, 2, 3]))  --> ['`1`', '`2`', '`3`']
         escaped_fields = list(map(lambda f: '`%s`' % f, fields))
-        logging.info('escaped_fields:%s'% escaped_fields)
+        logging.debug('escaped_fields:%s', escaped_fields)
 
         attrs['__mappings__'] = mappings # 保存属性和列的映射关系
         attrs['__table__'] = tableName
         attrs['__primary_key__'] = primaryKey # 主键属性名
         attrs['__fields__'] = fields # 除主键外的属性名
+        updatable_fields = [f for f in fields if mappings[f].updatable]
+        attrs['__updatable_fields__'] = updatable_fields # update()写回的属性名
+        # 可以公开的字段和不能公开的字段，JSON序列化时只输出公开字段
+        private_fields = frozenset(k for k, v in mappings.items() if v.private)
+        attrs['__public_fields__'] = tuple(k for k in [primaryKey] + fields if k not in private_fields)
+        attrs['__private_fields__'] = private_fields
+        attrs['__serializer__'] = staticmethod(make_serializer(private_fields))
 
         # 构造默认的SELECT, INSERT, UPDATE和DELETE语句:
         attrs['__select__'] = 'select `%s`, %s from `%s`' % (primaryKey, ', '.join(escaped_fields), tableName)
         attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (tableName, ', '.join(escaped_fields), primaryKey, create_args_string(len(escaped_fields) + 1))
-        attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primaryKey)
+        attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (tableName, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), updatable_fields)), primaryKey)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (tableName, primaryKey)
 
-        logging.info('  attrs:  %s' % attrs)
+        # 每个模型类都会执行，用debug级别并且把参数交给logging，没有打开debug日志时不会格式化整个attrs
+        logging.debug('  attrs:  %s', attrs)
         return type.__new__(cls, name, bases, attrs)
 
 
@@ -201,9 +324,9 @@ class Model(dict, metaclass=ModelMetaclass):
             return None
         return cls(**rs[0])
 
-    # findAll() - 根据WHERE条件查找
+    # 构造findAll的select语句和参数
     @classmethod
-    async def findAll(cls, where=None, args=None, **kw):
+    def _buildSelect(cls, where=None, args=None, **kw):
         # sql语句不太会。。这里好像是添加了几个参数 where、args、OrderBy、limit
         sql = [cls.__select__]
         # 如果有where参数就在sql语句中添加字符串where和参数where
@@ -228,9 +351,34 @@ class Model(dict, metaclass=ModelMetaclass):
                 args.extend(limit)  # extend() 函数用于在列表末尾一次性追加另一个序列中的多个值（用新列表扩展原来的列表）。
             else:
                 raise ValueError("错误的limit值：%s" % limit)
-        rs = await select(" ".join(sql), args)
+        return " ".join(sql), args
+
+    # findAll() - 根据WHERE条件查找
+    @classmethod
+    async def findAll(cls, where=None, args=None, **kw):
+        sql, args = cls._buildSelect(where, args, **kw)
+        rs = await select(sql, args)
         return [cls(**r) for r in rs]
 
+    # iterAll() - 参数和findAll一样，但返回一个异步迭代器，用 async for 逐个取出对象
+    # 结果集不会一次性读进内存，适合数据量很大的查询
+    # 按键集分页读取，所以orderBy只能是一列加上可选的desc(比如"created_at desc")，主键自动作为第二个排序键，不支持limit
+    @classmethod
+    def iterAll(cls, where=None, args=None, chunk_size=100, **kw):
+        if kw.get("limit") is not None:
+            raise ValueError("iterAll不支持limit")
+        keys, desc = [], False
+        orderBy = kw.get("orderBy", None)
+        if orderBy:
+            parts = orderBy.split()
+            if len(parts) > 2 or (len(parts) == 2 and parts[1].lower() not in ("asc", "desc")) or "," in orderBy:
+                raise ValueError("iterAll只支持按一列排序：%s" % orderBy)
+            keys.append(parts[0].strip("`"))
+            desc = len(parts) == 2 and parts[1].lower() == "desc"
+        if cls.__primary_key__ not in keys:
+            keys.append(cls.__primary_key__)
+        return RowIterator(cls.__select__, where, args, keys, desc, cls, chunk_size)
+
     # findNumber() - 根据WHERE条件查找，但返回的是整数，适用于select count(*)类型的SQL。
     @classmethod
     async def findNumber(cls, selectField, where=None, args=None):
@@ -259,28 +407,34 @@ class Model(dict, metaclass=ModelMetaclass):
             logging.warn("无法插入纪录，受影响的行：%s" % rows)
 
     async def update(self):
-        args = list(map(self.getValue, self.__fields__))
+        args = list(map(self.getValue, self.__updatable_fields__))
         args.append(self.getValue(self.__primary_key__))
         rows = await execute(self.__update__, args)
         if rows != 1:
             logging.warn('failed to update by primary key: affected rows: %s' % rows)
 
+    # 返回删除的行数，记录已经被别人删除时为0
     async def remove(self):
         args = [self.getValue(self.__primary_key__)]
         rows = await execute(self.__delete__, args)
         if rows != 1:
             logging.warning('failed to remove by primary key: affected rows: %s' % rows)
+        return rows
 
 
 # =====================================Field定义域区==============================================
 # 首先来定义Field类，它负责保存数据库表的字段名和字段类型
 class Field(object):
     # 定义域的初始化，包括属性（列）名，属性（列）的类型，主键，默认值
-    def __init__(self, name, column_type, primary_key, default):
+    # private为True的字段(比如密码)不会被序列化到JSON响应中
+    # updatable为False的字段(比如用原子加减维护的计数)不会被update()写回，避免用读出时的旧值覆盖别人的修改
+    def __init__(self, name, column_type, primary_key, default, private=False, updatable=True):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
+        self.private = private
+        self.updatable = updatable
 
     # 定制输出信息为 类名，列的类型，列名
     def __str__(self):
@@ -290,26 +444,26 @@ class Field(object):
 class StringField(Field):
     # ddl是数据定义语言("data definition languages")，默认值是'varchar(100)'，意思是可变字符串，长度为100
     # 和char相对应，char是固定长度，字符串长度不够会自动补齐，varchar则是多长就是多长，但最长不能超过规定长度
-    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)'):
+    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)', private=False):
         # ddl='varchar(100)'  映射为  self.column_type
-        super().__init__(name, ddl, primary_key, default)
+        super().__init__(name, ddl, primary_key, default, private)
 
 
 class BooleanField(Field):
-    def __init__(self, name=None, default=False):
-        super().__init__(name, 'boolean', False, default)
+    def __init__(self, name=None, default=False, private=False):
+        super().__init__(name, 'boolean', False, default, private)
 
 
 class IntegerField(Field):
-    def __init__(self, name=None, primary_key=False, default=0):
-        super().__init__(name, 'bigint', primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0, private=False, updatable=True):
+        super().__init__(name, 'bigint', primary_key, default, private, updatable)
 
 
 class FloatField(Field):
-    def __init__(self, name=None, primary_key=False, default=0.0):
-        super().__init__(name, 'real', primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0.0, private=False):
+        super().__init__(name, 'real', primary_key, default, private)
 
 
 class TextField(Field):
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'text', False, default)
+    def __init__(self, name=None, default=None, private=False):
+        super().__init__(name, 'text', False, default, private)
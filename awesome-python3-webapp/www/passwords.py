@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Password hashing with a slow KDF, run off the event loop.
+'''
+
+import asyncio, base64, binascii, hashlib, hmac, os, logging
+from concurrent.futures import ThreadPoolExecutor
+
+from config import configs
+
+# 存储格式:
+#     pbkdf2_sha256$迭代次数$salt$hash
+#     scrypt$n$r$p$salt$hash
+# 旧的密码是40位十六进制的 sha1(用户id:密码)，验证通过后会被升级为新格式
+# 注意：这里的"密码"是浏览器端已经做过一次sha1的字符串，见register.html和signin.html
+
+_options = configs.passwords
+# hashlib的pbkdf2_hmac和scrypt在计算时会释放GIL，所以放在线程池中可以真正并行
+_executor = ThreadPoolExecutor(max_workers=_options.workers)
+_pending = None  # 限制排队中的哈希任务数量的信号量，第一次使用时创建
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+# 计算密码的哈希值，耗时几十毫秒，不要在事件循环中直接调用
+def hash_password(passwd, salt=None):
+    if salt is None:
+        salt = os.urandom(16)
+    if _options.algorithm == 'scrypt':
+        n, r, p = _options.scrypt_n, _options.scrypt_r, _options.scrypt_p
+        dk = hashlib.scrypt(passwd.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * 2, dklen=32)
+        return 'scrypt$%s$%s$%s$%s$%s' % (n, r, p, _b64(salt), _b64(dk))
+    iterations = _options.iterations
+    dk = hashlib.pbkdf2_hmac('sha256', passwd.encode('utf-8'), salt, iterations)
+    return 'pbkdf2_sha256$%s$%s$%s' % (iterations, _b64(salt), _b64(dk))
+
+
+# 验证密码，返回(是否正确, 是否需要用当前的算法和参数重新计算哈希)
+# uid只用于验证旧的sha1格式
+def verify_password(stored, uid, passwd):
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            iterations, salt, expected = int(parts[1]), base64.b64decode(parts[2]), base64.b64decode(parts[3])
+            dk = hashlib.pbkdf2_hmac('sha256', passwd.encode('utf-8'), salt, iterations)
+            rehash = _options.algorithm != 'pbkdf2_sha256' or iterations < _options.iterations
+            return hmac.compare_digest(dk, expected), rehash
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = base64.b64decode(parts[4]), base64.b64decode(parts[5])
+            dk = hashlib.scrypt(passwd.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * 2, dklen=len(expected))
+            rehash = _options.algorithm != 'scrypt' or (n, r, p) != (_options.scrypt_n, _options.scrypt_r, _options.scrypt_p)
+            return hmac.compare_digest(dk, expected), rehash
+    except (ValueError, binascii.Error):
+        logging.warning('malformed password hash for user %s' % uid)
+        return False, False
+    # 旧格式：sha1(用户id:密码)
+    legacy = hashlib.sha1(('%s:%s' % (uid, passwd)).encode('utf-8')).hexdigest()
+    return hmac.compare_digest(stored, legacy), True
+
+
+# 在线程池中执行fn，同时排队的任务不超过max_pending个，多出来的请求在这里等待
+async def _run(fn, *args):
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(_options.max_pending)
+    async with _pending:
+        return await asyncio.get_event_loop().run_in_executor(_executor, fn, *args)
+
+
+# 以下两个是在handler中使用的协程版本，不会阻塞事件循环
+async def hash_password_async(passwd):
+    return await _run(hash_password, passwd)
+
+
+async def verify_password_async(stored, uid, passwd):
+    return await _run(verify_password, stored, uid, passwd)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Reconcile blogs.comment_count with the actual number of comments.
+
+comment_count在发表/删除评论时用原子加减维护，但中途出错(比如评论已保存、加1之前连接断开)或者直接改数据库时会出现偏差
+这个脚本按主键顺序每次处理chunk篇博客，用一条update语句把计数改成comments表中的实际数量，只有不一致的行会被修改
+在crontab中定期运行，例如每小时一次:
+    0 * * * * cd /srv/awesome/www && python3 reconcile_comment_counts.py
+    python3 reconcile_comment_counts.py [--chunk 500] [--pause 0.1]
+'''
+
+import logging
+logging.basicConfig(level=logging.INFO)
+import asyncio, argparse
+
+import orm
+from config import configs
+
+
+# 每篇博客的评论数由子查询计算，用到comments上(blog_id, created_at, id)的索引
+_COUNT = '(select count(*) from `comments` where `comments`.`blog_id`=`blogs`.`id`)'
+
+
+async def reconcile(loop, chunk, pause):
+    await orm.create_pool(loop=loop, **configs.db)
+    try:
+        last_id, checked, fixed = '', 0, 0
+        while True:
+            # 按id翻页(seek)，只读id这一列
+            rs = await orm.select('select `id` from `blogs` where `id`>? order by `id` limit ?', [last_id, chunk])
+            if not rs:
+                break
+            ids = [r['id'] for r in rs]
+            fixed += await orm.execute('update `blogs` set `comment_count`=%s where `id` in (%s) and `comment_count`<>%s'
+                                       % (_COUNT, orm.create_args_string(len(ids)), _COUNT), ids)
+            checked += len(ids)
+            last_id = ids[-1]
+            await asyncio.sleep(pause)
+        logging.info('checked %d blogs, fixed %d comment counts' % (checked, fixed))
+    finally:
+        await orm.close_pool()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reconcile blogs.comment_count with the actual number of comments.')
+    parser.add_argument('--chunk', type=int, default=500, help='blogs per batch')
+    parser.add_argument('--pause', type=float, default=0.1, help='seconds to sleep between batches')
+    args = parser.parse_args()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(reconcile(loop, args.chunk, args.pause))
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Markdown rendering that keeps large documents off the event loop.
+'''
+
+import asyncio, html, logging, signal
+from html.parser import HTMLParser
+
+from config import configs
+from fragcache import MemoryStorage
+
+# markdown2模块是一个支持markdown文本输入的模块，是Trent Mick写的开源模块，我们将其拷贝在本文件夹中，在下面的函数中调用
+# markdown2导入时要编译几十个正则，和进程池用到的multiprocessing一样，都在第一次使用时才导入(import语句放在函数中)，
+# 不占用启动时间；app.py在开始接受连接之后调用warm_up()提前导入，第一个请求也不用等
+
+# 小文档直接在事件循环中转换，只要几毫秒，放到进程池反而更慢(要序列化、进程间通信)
+# 大文档(很多表格、代码块的长博客)转换要几十毫秒，在进程池中转换，不阻塞其他请求
+# 转换是纯python的CPU计算，不释放GIL，所以用进程池而不是线程池
+# prefork模式下每个worker进程各有一个进程池，总的渲染进程数为 server.workers * markdown.workers
+# 进程池中用增量转换(见incremental.py)：修改博客时通常只改了几段，只有改动的块需要重新转换
+# 增量转换也要对整篇文档做准备、计算每个块的hash(几十KB的文档要几十毫秒)，所以同样不在事件循环中做
+# 每个转换进程有自己的块缓存，同一篇博客两次保存落在不同的进程时，第二个进程的缓存还是空的
+# 博客内容是用户输入，markdown.hardened打开时用markdown2的hardened extra转换：
+# 最容易被构造的输入拖慢的正则换成线性时间的扫描，并限制每个文档的CPU时间，超出预算时和超时一样抛出RenderTimeout
+
+_options = configs.markdown
+_executor = None  # 进程池，第一次使用时创建
+_pending = None  # 限制排队中的转换任务数量的信号量，第一次使用时创建
+_renderers = {}  # markdown2的参数 -> IncrementalRenderer，只在转换进程中使用
+
+
+class RenderTimeout(Exception):
+    '''
+    Raised when a document takes longer than markdown.timeout to convert, or uses up the hardened CPU budget.
+    '''
+    pass
+
+
+def _alarm(signum, frame):
+    raise RenderTimeout()
+
+
+def _init_worker():
+    # Ctrl-C由主进程处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _alarm)
+
+
+# 在子进程中执行：用SIGALRM限制转换时间，re模块匹配时也会检查信号，所以回溯很严重的正则同样能被打断
+# 返回(html, 目录的html)，UnicodeWithAttrs不传回来，目录单独取出
+def _render(text, timeout, kw):
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        html = _get_renderer(kw).render(text)
+        return str(html), html.toc_html
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+# markdown.hardened打开时给markdown2的参数加上hardened extra，值是CPU时间预算
+def _hardened(kw):
+    if not _options.hardened:
+        return kw
+    extras = kw.get('extras') or {}
+    if not isinstance(extras, dict):
+        extras = dict.fromkeys(extras)
+    return dict(kw, extras=dict(extras, hardened=_options.budget))
+
+
+def _get_renderer(kw):
+    from incremental import IncrementalRenderer
+    key = repr(sorted(kw.items()))
+    renderer = _renderers.get(key)
+    if renderer is None:
+        cache = MemoryStorage(maxsize=_options.block_cache_size, default_ttl=_options.block_cache_ttl)
+        renderer = _renderers[key] = IncrementalRenderer(cache=cache, **kw)
+    return renderer
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # 用spawn而不是fork：web进程里有事件循环和其他线程池，fork出来的子进程可能继承到被锁住的锁
+        _executor = ProcessPoolExecutor(max_workers=_options.workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker)
+    return _executor
+
+
+# 把markdown转换成html，返回(html, 目录的html)，都是str，没有打开toc extra或者文档中没有标题时目录为None
+# 转换超过markdown.timeout秒或者用完hardened的CPU时间预算时抛出RenderTimeout，
+# 由调用者决定怎么处理：保存博客时拒绝这个内容，显示旧博客时按纯文本显示(plain_text_html)而且不保存
+async def render_markdown(text, **kw):
+    import markdown2
+    try:
+        return await _render_markdown(text, _hardened(kw))
+    except markdown2.MarkdownBudgetError as e:
+        logging.warning('%s, %d characters of markdown' % (e, len(text)))
+        raise RenderTimeout()
+
+
+async def _render_markdown(text, kw):
+    global _executor, _pending
+    import markdown2
+    from concurrent.futures.process import BrokenProcessPool
+    if len(text) < _options.inline_size:
+        html = markdown2.markdown(text, **kw)
+        return str(html), html.toc_html
+    if _pending is None:
+        _pending = asyncio.Semaphore(_options.max_pending)
+    async with _pending:
+        executor = _get_executor()
+        future = asyncio.get_event_loop().run_in_executor(executor, _render, text, _options.timeout, kw)
+        try:
+            # 正常情况下子进程自己会在timeout时中止，这里多等一秒只是为了防止子进程卡死
+            return (await asyncio.wait_for(future, _options.timeout + 1.0))
+        except asyncio.TimeoutError:
+            logging.warning('markdown worker did not respond, restarting the pool')
+            _executor = None
+            _kill(executor)
+            raise RenderTimeout()
+        except BrokenProcessPool:
+            logging.warning('markdown worker died, restarting the pool')
+            if _executor is executor:
+                _executor = None
+            raise RenderTimeout()
+
+
+def _kill(executor):
+    for p in list((getattr(executor, '_processes', None) or {}).values()):
+        p.kill()
+    executor.shutdown(wait=False)
+
+
+# 无法转换的内容按纯文本显示
+def plain_text_html(text):
+    return '<pre>%s</pre>' % html.escape(text)
+
+
+# 评论是纯文本：每个非空行转义后放进一个<p>中
+# 保存评论时转换一次，结果存入comments.html_content，显示时不再转换
+def text2html(text):
+    return ''.join('<p>%s</p>' % html.escape(s, quote=False) for s in text.split('\n') if s.strip() != '')
+
+
+# 摘要中跳过的元素：代码块、标题、脚注的上标和脚注列表
+_SUMMARY_SKIP = {'pre', 'script', 'style', 'sup', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# 这些元素前后的文字之间加空格，不能连在一起
+_SUMMARY_BREAKS = {'p', 'div', 'br', 'li', 'blockquote', 'table', 'tr', 'td', 'th', 'dt', 'dd', 'hr'}
+
+
+class _SummaryParser(HTMLParser):
+    def __init__(self):
+        super(_SummaryParser, self).__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_tag = None  # 正在跳过的元素，只计算同名元素的嵌套层数
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_tag is None:
+            if tag in _SUMMARY_SKIP or (tag == 'div' and ('class', 'footnotes') in attrs):
+                self.skip_tag, self.skip_depth = tag, 1
+        elif tag == self.skip_tag:
+            self.skip_depth += 1
+        if tag in _SUMMARY_BREAKS:
+            self.parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag == self.skip_tag:
+            self.skip_depth -= 1
+            if self.skip_depth == 0:
+                self.skip_tag = None
+        if tag in _SUMMARY_BREAKS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if self.skip_tag is None:
+            self.parts.append(data)
+
+
+# 从转换后的html中提取纯文本摘要，最多length个字符(和blogs.auto_summary的长度一致)
+# 超长时截断并加上省略号，英文尽量在单词之间截断
+def plain_text_summary(html_content, length=200):
+    parser = _SummaryParser()
+    parser.feed(html_content)
+    parser.close()
+    text = ' '.join(''.join(parser.parts).split())
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    space = cut.rfind(' ')
+    if space > length // 2:
+        cut = cut[:space]
+    return cut.rstrip() + '\u2026'
+
+
+# 导入转换时用到的模块，在app.init中开始接受连接之后在线程池中调用
+def warm_up():
+    import markdown2
+    from concurrent.futures import process
+
+
+# 关闭进程池，在app.shutdown中调用
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
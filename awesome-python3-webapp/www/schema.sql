@@ -9,10 +9,11 @@ grant select, insert, update, delete on awesome.* to 'pyweb'@'localhost' identif
 create table users (
     `id` varchar(50) not null,
     `email` varchar(50) not null,
-    `passwd` varchar(50) not null,
+    `passwd` varchar(200) not null,
     `admin` bool not null,
     `name` varchar(50) not null,
     `image` varchar(500) not null,
+    `session_version` bigint not null default 0,
     `created_at` real not null,
     unique key `idx_email` (`email`),
     key `idx_created_at` (`created_at`),
@@ -26,8 +27,13 @@ create table blogs (
     `user_image` varchar(500) not null,
     `name` varchar(50) not null,
     `summary` varchar(200) not null,
+    `auto_summary` varchar(200) not null default '',
     `content` mediumtext not null,
+    `html_content` mediumtext,
+    `toc_html` text,
+    `comment_count` bigint not null default 0,
     `created_at` real not null,
+    `updated_at` real not null default 0,
     key `idx_created_at` (`created_at`),
     primary key (`id`)
 ) engine=innodb default charset=utf8;
@@ -39,7 +45,9 @@ create table comments (
     `user_name` varchar(50) not null,
     `user_image` varchar(500) not null,
     `content` mediumtext not null,
+    `html_content` mediumtext,
     `created_at` real not null,
     key `idx_created_at` (`created_at`),
+    key `idx_blog_id_created_at` (`blog_id`, `created_at`, `id`),
     primary key (`id`)
 ) engine=innodb default charset=utf8;
\ No newline at end of file
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Prefork launcher for production.
+
+主进程(supervisor)fork出多个worker进程，每个worker有自己的事件循环、数据库连接池和jinja2环境，
+各自用SO_REUSEPORT绑定同一个端口，由内核把新连接分配给各个worker
+    python3 server.py          启动，worker数量和连接池大小来自config
+    kill -HUP <主进程pid>       滚动重启：逐个启动新worker并优雅地停掉旧worker，新worker会加载新代码
+    kill -TERM <主进程pid>      优雅退出：所有worker处理完正在进行的请求后退出
+worker异常退出时主进程会自动重启它
+'''
+
+import logging
+logging.basicConfig(level=logging.INFO)
+import asyncio, os, signal, socket, time
+
+from config import configs
+
+# worker启动后存活不到这么多秒就退出，视为启动失败，重启前等待一段时间，避免不停地fork
+MIN_UPTIME = 1.0
+RESTART_DELAY = 1.0
+
+
+# 创建监听socket，每个worker各自调用一次
+# SO_REUSEPORT允许多个进程绑定同一个端口，内核会在它们之间分配连接
+def bind_socket(host, port, backlog):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+# worker进程的入口，在fork之后的子进程中执行，永不返回
+# app模块在这里才导入，所以滚动重启后的新worker会加载修改后的代码
+def run_worker():
+    # 恢复主进程修改过的信号处理方式；Ctrl-C由主进程处理，worker只响应SIGTERM
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    import app as webapp
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = configs.server
+    sock = bind_socket(server.host, server.port, server.backlog)
+    application = loop.run_until_complete(webapp.init(loop, sock=sock))
+
+    def stop():
+        logging.info('worker %s stopping...' % os.getpid())
+        loop.remove_signal_handler(signal.SIGTERM)
+        task = asyncio.ensure_future(webapp.shutdown(application, server.graceful_timeout), loop=loop)
+        task.add_done_callback(lambda f: loop.stop())
+
+    loop.add_signal_handler(signal.SIGTERM, stop)
+    logging.info('worker %s serving on %s:%s' % (os.getpid(), server.host, server.port))
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+
+
+# 主进程：负责启动、监控和重启worker
+class Supervisor(object):
+    def __init__(self, workers):
+        self.num_workers = workers
+        self.workers = {}  # pid -> 启动时间
+        self.retiring = set()  # 滚动重启时正在退出的旧worker
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker()
+            except BaseException:
+                logging.exception('worker %s crashed' % os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.time()
+        logging.info('spawned worker %s' % pid)
+        return pid
+
+    # 回收已经退出的worker，非主动停止的worker会被重新启动
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if started is None:
+                continue
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                logging.info('worker %s retired' % pid)
+                continue
+            logging.warning('worker %s exited with status %s' % (pid, status))
+            if not self.stopping:
+                if time.time() - started < MIN_UPTIME:
+                    time.sleep(RESTART_DELAY)
+                self.spawn()
+
+    # 滚动重启：每次只替换一个worker，保证任何时候都有worker在接受连接
+    def reload(self):
+        logging.info('reloading %d workers...' % len(self.workers))
+        for pid in list(self.workers):
+            if self.stopping:
+                return
+            self.spawn()
+            time.sleep(configs.server.reload_interval)
+            self.retiring.add(pid)
+            self.kill(pid, signal.SIGTERM)
+            while pid in self.workers and not self.stopping:
+                time.sleep(0.1)
+                self.reap()
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    # 停止所有worker，超过graceful_timeout仍未退出的worker会被强制杀掉
+    def stop(self):
+        self.stopping = True
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.time() + configs.server.graceful_timeout
+        while self.workers and time.time() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGKILL)
+        self.reap()
+
+    def run(self):
+        def on_stop(signum, frame):
+            self.stopping = True
+
+        def on_reload(signum, frame):
+            self.reloading = True
+
+        signal.signal(signal.SIGTERM, on_stop)
+        signal.signal(signal.SIGINT, on_stop)
+        signal.signal(signal.SIGHUP, on_reload)
+        logging.info('supervisor %s starting %d workers...' % (os.getpid(), self.num_workers))
+        for i in range(self.num_workers):
+            self.spawn()
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            time.sleep(0.2)
+            self.reap()
+        logging.info('supervisor %s shutting down...' % os.getpid())
+        self.stop()
+
+
+if __name__ == '__main__':
+    Supervisor(configs.server.workers or os.cpu_count() or 1).run()
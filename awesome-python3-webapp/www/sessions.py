@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+In-process cache of verified session cookies and per-user session versions.
+'''
+
+import copy, time
+from collections import OrderedDict
+
+# 验证cookie需要查一次数据库(User.find)再算一次sha1，每个带cookie的请求都要做一遍
+# 这里把验证通过的用户按cookie缓存起来，有效期不超过cookie本身的失效时间
+# 验证失败的cookie也缓存一小段时间(negative cache)，避免伪造的cookie反复查询数据库
+# 缓存只在当前进程内有效，prefork模式下每个worker各有一份
+# 缓存中保存的是用户的副本，get每次也返回一个新的副本：同一个cookie的并发请求各自拿到自己的用户对象，
+# 某个handler修改request.__user__不会影响其他请求，也不会改掉缓存中的内容
+class SessionCache(object):
+    def __init__(self, maxsize=10000, ttl=300, negative_ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # cookie -> (user or None, 过期时间)
+        self._cookies_by_user = dict()  # user id -> 该用户缓存中的cookie集合
+        self.hits = 0  # 不查数据库就完成验证的请求数
+        self.negative_hits = 0
+        self.misses = 0
+
+    # 返回(found, user)，found为False表示缓存中没有，需要重新验证
+    # found为True且user为None表示这个cookie之前验证失败过
+    def get(self, cookie):
+        entry = self._entries.get(cookie)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        user, expires = entry
+        if expires < time.time():
+            self._remove(cookie)
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(cookie)
+        if user is None:
+            self.negative_hits += 1
+            return True, None
+        self.hits += 1
+        return True, copy.copy(user)
+
+    # 缓存验证通过的用户，cookie_expires是cookie中记录的失效时间
+    def put(self, cookie, user, cookie_expires):
+        expires = min(cookie_expires, time.time() + self.ttl)
+        self._set(cookie, copy.copy(user), expires)
+        self._cookies_by_user.setdefault(user.id, set()).add(cookie)
+
+    # 缓存验证失败的cookie
+    def put_invalid(self, cookie):
+        self._set(cookie, None, time.time() + self.negative_ttl)
+
+    # 用户的密码或者管理员权限改变时调用，删除该用户所有缓存的cookie
+    def invalidate_user(self, uid):
+        for cookie in self._cookies_by_user.pop(uid, ()):
+            self._entries.pop(cookie, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._cookies_by_user.clear()
+
+    def stats(self):
+        return dict(size=len(self._entries), hits=self.hits, negative_hits=self.negative_hits, misses=self.misses)
+
+    def _set(self, cookie, user, expires):
+        if cookie in self._entries:
+            self._remove(cookie)
+        self._entries[cookie] = (user, expires)
+        # 超过容量时淘汰最久没有使用的cookie
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, cookie):
+        user, expires = self._entries.pop(cookie)
+        if user is not None:
+            cookies = self._cookies_by_user.get(user.id)
+            if cookies is not None:
+                cookies.discard(cookie)
+                if not cookies:
+                    del self._cookies_by_user[user.id]
+
+
+# 每个用户的会话版本号(users.session_version)在内存中的副本
+# 新格式的cookie里带有签发时的版本号，和这里的版本号不一致说明会话已被撤销
+# 版本号超过ttl秒没有刷新就视为过期，由调用者重新从数据库读取(懒刷新)
+# 撤销会话时数据库中的版本号加1，其他进程最多ttl秒后就会读到新版本号
+class SessionVersions(object):
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._versions = OrderedDict()  # user id -> (版本号, 读取时间)
+
+    # 返回内存中的版本号，没有或者已经过期时返回None
+    def get(self, uid):
+        entry = self._versions.get(uid)
+        if entry is None:
+            return None
+        version, loaded_at = entry
+        if loaded_at + self.ttl < time.time():
+            del self._versions[uid]
+            return None
+        self._versions.move_to_end(uid)
+        return version
+
+    def set(self, uid, version):
+        self._versions.pop(uid, None)
+        self._versions[uid] = (version, time.time())
+        while len(self._versions) > self.maxsize:
+            self._versions.popitem(last=False)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Startup profiler: how long each import and initialization phase of booting the app takes.
+'''
+
+import sys, time, logging
+
+# app.py第一个导入这个模块，从这里开始计时
+# 用法：每个阶段结束时调用mark(名称)，这个阶段从上一次mark(或导入本模块)开始
+# server.py的worker在fork之后才导入app，所以每个worker各自重新计时
+_started = time.perf_counter()
+_last = _started
+_phases = []  # (名称, 耗时(秒), 这个阶段新导入的模块数)
+_modules = len(sys.modules)
+
+
+def mark(name):
+    global _last, _modules
+    now = time.perf_counter()
+    _phases.append((name, now - _last, len(sys.modules) - _modules))
+    _last = now
+    _modules = len(sys.modules)
+
+
+def phases():
+    return list(_phases)
+
+
+# 从导入本模块到最后一次mark的总耗时(秒)
+def total():
+    return _last - _started
+
+
+# 启动完成后记录各阶段的耗时，超出budget秒时记录警告
+def report(budget=None):
+    summary = ', '.join('%s %.1f ms' % (name, elapsed * 1000) for name, elapsed, _ in _phases)
+    logging.info('booted in %.1f ms: %s' % (total() * 1000, summary))
+    if budget and total() > budget:
+        logging.warning('boot took %.1f ms, over the %.0f ms budget, run benchmarks/bench_startup.py for details'
+                        % (total() * 1000, budget * 1000))
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''
+Boot budget check: runs benchmarks/bench_startup.py and fails when it fails.
+启动超出config中的startup.budget，或者应该延迟导入的模块在启动时就被导入时，这个测试失败
+没有安装aiohttp等依赖时跳过(app无法导入)
+运行方式: python3 -m unittest discover -s tests
+'''
+
+import os, sys, subprocess, unittest
+import importlib.util
+
+WWW = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH = os.path.join(WWW, 'benchmarks', 'bench_startup.py')
+
+# app.py启动时需要的第三方模块
+REQUIRES = ('aiohttp', 'aiomysql', 'jinja2')
+
+
+class StartupTest(unittest.TestCase):
+
+    def setUp(self):
+        missing = [m for m in REQUIRES if importlib.util.find_spec(m) is None]
+        if missing:
+            self.skipTest('not installed: %s' % ', '.join(missing))
+
+    def test_boot_within_budget(self):
+        p = subprocess.run([sys.executable, BENCH, '--runs', '3'], cwd=WWW,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        self.assertEqual(p.returncode, 0, p.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()